@@ -0,0 +1,255 @@
+import bisect
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+
+from models import db, Lead, LeadFunnelDaily, LeadStageDurationDaily, LeadStageEvent
+from rollups import _upsert_insert, to_cents
+
+# Lead stage history and the funnel analytics served from it.
+#
+# Every write that creates a lead or changes its stage appends a
+# LeadStageEvent and, in the same transaction, adds it to two per-user,
+# per-UTC-day tables: LeadFunnelDaily (transitions per from/to stage, and
+# the leads' values in integer cents, so won/lost values stay exact) and
+# LeadStageDurationDaily (a histogram of how long leads stayed in the stage
+# they left). GET /api/analytics/funnel reads a date range of those buckets,
+# a few rows per active day, so its cost does not grow with the number of
+# events. `flask rebuild-funnel` recomputes the buckets from the event log.
+
+HOUR = 3600
+DAY = 24 * HOUR
+# Upper bounds in seconds of the time-in-stage buckets; one more, open-ended
+# bucket holds longer stays. Medians are interpolated within a bucket.
+DURATION_BOUNDS = [HOUR, 4 * HOUR, 12 * HOUR] + [
+    days * DAY for days in (1, 2, 3, 5, 7, 10, 14, 21, 30, 45, 60, 90, 120, 180, 270, 365)
+]
+PERIODS = ("day", "week", "month")
+WON, LOST = "Closed Won", "Closed Lost"
+# GET /api/analytics/funnel: the last year by default, ten at most
+DEFAULT_RANGE = timedelta(days=365)
+MAX_RANGE = timedelta(days=3660)
+
+def stage_event(user_id: int, lead_id: int, from_stage, to_stage: str, value, entered_at, occurred_at: datetime):
+    # Column values for one LeadStageEvent; from_stage None for a new lead,
+    # entered_at when it had entered from_stage (None if unknown)
+    return {
+        "user_id": user_id, "lead_id": lead_id, "from_stage": from_stage, "to_stage": to_stage,
+        "estimated_value": value, "stage_entered_at": entered_at, "occurred_at": occurred_at,
+    }
+
+def duration_bucket(seconds: float) -> int:
+    return bisect.bisect_left(DURATION_BOUNDS, seconds)
+
+def _bucket_deltas(events):
+    # events: mappings with LeadStageEvent's columns -> (funnel, durations)
+    # keyed like the bucket tables; funnel values are [transitions, cents]
+    funnel = defaultdict(lambda: [0, 0])
+    durations = Counter()
+    for e in events:
+        day = e["occurred_at"].date()
+        totals = funnel[(e["user_id"], day, e["from_stage"] or "", e["to_stage"])]
+        totals[0] += 1
+        totals[1] += to_cents(e["estimated_value"])
+        if e["from_stage"] and e["stage_entered_at"]:
+            seconds = max(0.0, (e["occurred_at"] - e["stage_entered_at"]).total_seconds())
+            durations[(e["user_id"], day, e["from_stage"], duration_bucket(seconds))] += 1
+    return funnel, durations
+
+def _upsert_add(model, keys, rows):
+    # Adds each row's non-key columns onto the stored row with the same keys,
+    # inserting the ones that do not exist yet. One statement on SQLite/Postgres.
+    if not rows:
+        return
+    counters = [c for c in rows[0] if c not in keys]
+    insert = _upsert_insert(db.session.get_bind().dialect.name)
+    if insert is not None:
+        stmt = insert(model).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=keys,
+            set_={c: getattr(model, c) + getattr(stmt.excluded, c) for c in counters},
+        )
+        db.session.execute(stmt)
+        return
+    for row in rows:
+        updated = model.query.filter_by(**{k: row[k] for k in keys}).update(
+            {c: getattr(model, c) + row[c] for c in counters}, synchronize_session=False
+        )
+        if not updated:
+            db.session.add(model(**row))
+
+def _funnel_rows(funnel):
+    return [
+        {"user_id": u, "day": d, "from_stage": f, "to_stage": t, "transitions": n, "total_cents": cents}
+        for (u, d, f, t), (n, cents) in sorted(funnel.items())
+    ]
+
+def _duration_rows(durations):
+    return [
+        {"user_id": u, "day": d, "stage": s, "bucket": b, "stays": n}
+        for (u, d, s, b), n in sorted(durations.items())
+    ]
+
+def record_stage_events(events):
+    # Appends the events and adds them to the daily buckets, in the caller's transaction
+    if not events:
+        return
+    db.session.execute(db.insert(LeadStageEvent), events)
+    funnel, durations = _bucket_deltas(events)
+    _upsert_add(LeadFunnelDaily, ["user_id", "day", "from_stage", "to_stage"], _funnel_rows(funnel))
+    _upsert_add(LeadStageDurationDaily, ["user_id", "day", "stage", "bucket"], _duration_rows(durations))
+
+def backfill_stage_events():
+    # Leads written before stage history was kept: one event each, as if
+    # created in their current stage at their creation time. How long they
+    # spent in earlier stages is unknown, so they add no durations.
+    columns = ["user_id", "lead_id", "from_stage", "to_stage", "estimated_value", "stage_entered_at", "occurred_at"]
+    db.session.execute(db.insert(LeadStageEvent).from_select(columns, db.select(
+        Lead.user_id, Lead.id, db.null(), Lead.stage, Lead.estimated_value, db.null(),
+        db.func.coalesce(Lead.created_at, datetime.utcnow()),
+    )))
+    db.session.commit()
+    rebuild_funnel()
+
+def rebuild_funnel(user_id=None, repair=True):
+    # Recompute the daily buckets from LeadStageEvent and (unless
+    # repair=False) replace the stored ones. Returns the drift as
+    # (table, key, stored, actual).
+    events = db.session.query(
+        LeadStageEvent.user_id, LeadStageEvent.from_stage, LeadStageEvent.to_stage,
+        LeadStageEvent.estimated_value, LeadStageEvent.stage_entered_at, LeadStageEvent.occurred_at,
+    )
+    funnel_q = LeadFunnelDaily.query
+    durations_q = LeadStageDurationDaily.query
+    if user_id is not None:
+        events = events.filter(LeadStageEvent.user_id == user_id)
+        funnel_q = funnel_q.filter_by(user_id=user_id)
+        durations_q = durations_q.filter_by(user_id=user_id)
+    funnel, durations = _bucket_deltas(row._mapping for row in events.yield_per(5000))
+
+    drift = []
+    stored = {(r.user_id, r.day, r.from_stage, r.to_stage): (r.transitions, r.total_cents) for r in funnel_q}
+    for key in sorted(set(stored) | set(funnel)):
+        actual = tuple(funnel[key]) if key in funnel else (0, 0)
+        if stored.get(key, (0, 0)) != actual:
+            drift.append(("lead_funnel_daily", key, stored.get(key, (0, 0)), actual))
+    stored = {(r.user_id, r.day, r.stage, r.bucket): r.stays for r in durations_q}
+    for key in sorted(set(stored) | set(durations)):
+        if stored.get(key, 0) != durations.get(key, 0):
+            drift.append(("lead_stage_duration_daily", key, stored.get(key, 0), durations.get(key, 0)))
+    if not repair:
+        return drift
+    funnel_q.delete(synchronize_session=False)
+    durations_q.delete(synchronize_session=False)
+    for model, rows in ((LeadFunnelDaily, _funnel_rows(funnel)), (LeadStageDurationDaily, _duration_rows(durations))):
+        if rows:
+            db.session.execute(db.insert(model), rows)
+    db.session.commit()
+    return drift
+
+def parse_funnel_range(start, end, today: date):
+    # ?from= / ?to= as dates; `to` is exclusive and defaults to tomorrow,
+    # `from` to a year before `to`. Raises ValueError.
+    try:
+        end = date.fromisoformat(end) if end else today + timedelta(days=1)
+        start = date.fromisoformat(start) if start else end - DEFAULT_RANGE
+    except ValueError:
+        raise ValueError("from and to must be dates, e.g. 2026-01-31") from None
+    if end <= start:
+        raise ValueError("to must be after from")
+    if end - start > MAX_RANGE:
+        raise ValueError(f"from and to can be at most {MAX_RANGE.days} days apart")
+    return start, end
+
+def period_start(day: date, period: str) -> date:
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day
+
+def median_days(histogram: Counter):
+    # Median of a time-in-stage histogram ({bucket: stays}) in days,
+    # interpolated within its bucket; None without any stays
+    total = sum(histogram.values())
+    if not total:
+        return None
+    middle, seen = total / 2, 0
+    for bucket in sorted(histogram):
+        stays = histogram[bucket]
+        if seen + stays >= middle:
+            lower = DURATION_BOUNDS[bucket - 1] if bucket else 0
+            if bucket >= len(DURATION_BOUNDS):
+                return round(lower / DAY, 2)
+            upper = DURATION_BOUNDS[bucket]
+            return round((lower + (middle - seen) / stays * (upper - lower)) / DAY, 2)
+        seen += stays
+
+def funnel(user_id: int, start: date, end: date, period: str, stages):
+    # Reads [start, end) of the user's daily buckets: two primary-key range
+    # scans. `stages` orders the output.
+    rows = (
+        db.session.query(
+            LeadFunnelDaily.day, LeadFunnelDaily.from_stage, LeadFunnelDaily.to_stage, LeadFunnelDaily.transitions,
+            LeadFunnelDaily.total_cents,
+        )
+        .filter(LeadFunnelDaily.user_id == user_id, LeadFunnelDaily.day >= start, LeadFunnelDaily.day < end)
+        .all()
+    )
+    duration_rows = (
+        db.session.query(LeadStageDurationDaily.stage, LeadStageDurationDaily.bucket, LeadStageDurationDaily.stays)
+        .filter(
+            LeadStageDurationDaily.user_id == user_id,
+            LeadStageDurationDaily.day >= start, LeadStageDurationDaily.day < end,
+        )
+        .all()
+    )
+
+    entered, exited, moves = Counter(), Counter(), Counter()
+    periods = {}
+
+    def period_totals(day):
+        return periods.setdefault(period_start(day, period), {
+            "created": 0, "won_count": 0, "won_value": 0, "lost_count": 0, "lost_value": 0,
+        })
+
+    for day, from_stage, to_stage, count, cents in rows:
+        entered[to_stage] += count
+        if from_stage:
+            exited[from_stage] += count
+            moves[(from_stage, to_stage)] += count
+        p = period_totals(day)
+        if not from_stage:
+            p["created"] += count
+        # Values are summed in cents here and turned into money below
+        if to_stage == WON:
+            p["won_count"] += count
+            p["won_value"] += cents
+        elif to_stage == LOST:
+            p["lost_count"] += count
+            p["lost_value"] += cents
+    for totals in periods.values():
+        totals["won_value"] /= 100
+        totals["lost_value"] /= 100
+    histograms = defaultdict(Counter)
+    for stage, bucket, stays in duration_rows:
+        histograms[stage][bucket] += stays
+
+    order = {s: i for i, s in enumerate(stages)}
+    return {
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "period": period,
+        "stages": [
+            {
+                "stage": s, "entered": entered[s], "exited": exited[s],
+                "median_days_in_stage": median_days(histograms[s]),
+            }
+            for s in stages
+        ],
+        # rate: share of the leads leaving `from` in the range that went to `to`
+        "transitions": [
+            {"from": f, "to": t, "count": n, "rate": round(n / exited[f], 4)}
+            for (f, t), n in sorted(moves.items(), key=lambda m: (order.get(m[0][0], 99), order.get(m[0][1], 99)))
+        ],
+        "periods": [{"start": start_day.isoformat(), **totals} for start_day, totals in sorted(periods.items())],
+    }
@@ -1,313 +1,676 @@
-<<<<<<< HEAD
-from flask import Flask, request, jsonify
+import functools
+import math
+import os
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import click
+from flask import Flask, Response, current_app, request, jsonify, stream_with_context
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import timedelta
+from flask_jwt_extended import JWTManager, create_access_token, get_jwt_identity, verify_jwt_in_request
+from sqlalchemy.orm import joinedload
+from werkzeug.middleware.proxy_fix import ProxyFix
 
+from analytics import PERIODS, funnel, parse_funnel_range, rebuild_funnel, record_stage_events, stage_event
+from appointments import DEFAULT_RANGE, MAX_RANGE, appointment_timezone, parse_appointment
+from cache import build_cache, cached_view
 from config import Config
-from models import db, User, Lead, Note, Notification
-from notifications import try_send_notification
+from dedupe import MERGE_MAX_IDS, ImportDuplicates, contact_keys, duplicate_groups, find_duplicate, merge_leads
+from engine import REPLICA_BIND, configure_engine, engine_options
+from lead_import import detect_format, import_leads, iter_records
+from metrics import Metrics, instrument, timed
+from models import db, User, Lead, LeadStageRollup, LeadTombstone, Note, Notification
+from notification_log import (
+    archive_notifications, notification_counts, rebuild_notification_counts, record_lead_notifications_removed,
+)
+from notifications import ProviderRegistry
+import outbox
+from outbox import NotificationWorker, enqueue_notification, enqueue_notifications, wake_worker
+from passwords import HashingBusy, PasswordHasher
+from pagination import (
+    DELTA_OVERLAP, STREAM_CHUNK_SIZE, CursorError, encode_cursor, keyset_after, parse_limit, parse_since,
+    stream_json_array,
+)
+from queryplan import (
+    check_query_plans, format_failures, load_statement_budget, over_budget, save_statement_budget, statement_counts,
+)
+from ratelimit import build_rate_limiter, too_many_requests
+from rollups import (
+    MAX_ESTIMATED_VALUE, apply_delta, rebuild_rollups, record_lead_added, record_lead_changed, record_lead_removed,
+    to_cents,
+)
+from schema import upgrade_schema
+from serializers import (
+    LEAD_FIELDS, NOTIFICATION_COLUMNS, FastJSONProvider, lead_columns, serialize_lead, serialize_lead_row,
+    serialize_lead_rows, serialize_note, serialize_notification, serialize_notification_rows,
+)
+from search import MAX_SEARCH_LIMIT, index_leads, index_notes, rebuild_search_index, remove_leads, search
+from versions import bump_version, conditional_view, replica_reads
 
 STAGES = ["New", "Contacted", "Booked", "Estimate Sent", "Closed Won", "Closed Lost"]
 
-def create_app():
+def create_app(config=None):
     app = Flask(__name__)
+    app.json = FastJSONProvider(app)
     app.config.from_object(Config)
-    CORS(app)
-=======
-import os
-from datetime import timedelta, datetime
-
-from flask import Flask, jsonify, request
-from flask_cors import CORS
-from flask_sqlalchemy import SQLAlchemy
-from flask_jwt_extended import (
-    JWTManager, create_access_token, jwt_required, get_jwt_identity
-)
-from werkzeug.security import generate_password_hash, check_password_hash
-
-db = SQLAlchemy()
-
-class User(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(120), nullable=False)
-    email = db.Column(db.String(255), unique=True, nullable=False, index=True)
-    password_hash = db.Column(db.String(255), nullable=False)
-
-class Lead(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
-    full_name = db.Column(db.String(120), nullable=False)
-    phone = db.Column(db.String(50))
-    email = db.Column(db.String(255))
-    address = db.Column(db.String(255))
-    city = db.Column(db.String(120))
-    state = db.Column(db.String(60))
-    stage = db.Column(db.String(60), default="New", nullable=False, index=True)
-    estimated_value = db.Column(db.Float, default=0.0)
-    appointment_datetime = db.Column(db.String(80))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
-
-STAGES = ["New", "Contacted", "Booked", "Estimate Sent", "Closed Won", "Closed Lost"]
-
-def serialize_lead(l: Lead):
-    return {
-        "id": l.id,
-        "full_name": l.full_name,
-        "phone": l.phone,
-        "email": l.email,
-        "address": l.address,
-        "city": l.city,
-        "state": l.state,
-        "stage": l.stage,
-        "estimated_value": l.estimated_value,
-        "appointment_datetime": l.appointment_datetime,
-        "created_at": l.created_at.isoformat() if l.created_at else None,
-        "updated_at": l.updated_at.isoformat() if l.updated_at else None,
+    # Overrides for tooling (query-plan checks, benchmarks) that needs its own database
+    app.config.update(config or {})
+    # Engine profile (see engine.py); explicit engine options still win
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        **engine_options(app.config), **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}),
     }
-
-def create_app():
-    app = Flask(__name__)
-    CORS(app, resources={r"/*": {"origins": "*"}})
-
-    database_url = os.getenv("DATABASE_URL", "sqlite:///contractorconnect.db")
-    if database_url.startswith("postgres://"):
-        database_url = database_url.replace("postgres://", "postgresql://", 1)
-
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
-    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY", "dev-change-me")
-    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(days=3)
-
->>>>>>> 166f992dea7a1eec725fd93f0f2ac0bef437b79c
+    if app.config["DATABASE_READ_URL"]:
+        app.config["SQLALCHEMY_BINDS"] = {
+            **app.config.get("SQLALCHEMY_BINDS", {}), REPLICA_BIND: app.config["DATABASE_READ_URL"],
+        }
+    CORS(app, expose_headers=["X-Next-Cursor", "ETag", "Last-Modified"])
     db.init_app(app)
     JWTManager(app)
+    app.extensions["appointment_timezone"] = appointment_timezone(app.config["APPOINTMENT_TIMEZONE"])
 
     with app.app_context():
-        db.create_all()
+        for engine in db.engines.values():
+            configure_engine(engine, app.config)
+    # Tables are created and upgraded by `flask upgrade-schema` (schema.py)
+
+    if app.config["TRUSTED_PROXIES"]:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXIES"])
+
+    app.extensions["response_cache"] = build_cache(app.config)
+    hasher = PasswordHasher(app.config["PASSWORD_HASH_METHOD"], app.config["PASSWORD_HASH_WORKERS"],
+                            app.config["PASSWORD_HASH_QUEUE"], app.config["PASSWORD_HASH_QUEUE_TIMEOUT"])
+    app.extensions["password_hasher"] = hasher
+    limiter = build_rate_limiter(app.config)
+    app.extensions["rate_limiter"] = limiter
+    app.extensions["notification_providers"] = ProviderRegistry(app.config)
+    worker = NotificationWorker(app)
+    app.extensions["notification_worker"] = worker
+    if app.config["NOTIFICATION_WORKER"] == "thread":
+        # Started by the first request rather than here, so `flask` commands
+        # (upgrade-schema on a fresh database above all) run no dispatcher
+        @app.before_request
+        def start_notification_worker():
+            worker.start()
+
+    if app.config["METRICS_ENABLED"]:
+        with app.app_context():
+            app.extensions["metrics"] = Metrics(app, *db.engines.values())
+        # Per-row serializers are timed through their batch callers, keeping
+        # the wrapper cost off every row
+        instrument(globals(), "serialize_lead", "serialize_lead_rows", "serialize_note", "serialize_notification_rows")
+        # Timed on the request thread, so waiting for a hashing slot counts too
+        hasher.hash = timed("generate_password_hash", hasher.hash)
+        hasher.verify = timed("check_password_hash", hasher.verify)
+        instrument(vars(outbox), "try_send_notification")
+
+    @app.cli.command("upgrade-schema")
+    def upgrade_schema_command():
+        """Create missing tables and bring an older database up to date."""
+        upgrade_schema()
+        click.echo("Schema is up to date.")
+
+    @app.cli.command("rebuild-search-index")
+    def rebuild_search_index_command():
+        """Rebuild the lead/note full-text index from the tables."""
+        rebuild_search_index()
+        db.session.commit()
+        click.echo("Search index rebuilt.")
+
+    @app.cli.command("run-notification-worker")
+    @click.option("--once", is_flag=True, help="Drain everything currently due, then exit.")
+    def run_notification_worker_command(once):
+        """Send queued notifications from the outbox."""
+        if once:
+            click.echo(f"{worker.drain()} notification(s) processed.")
+            return
+        worker.start()
+        try:
+            worker._thread.join()
+        except KeyboardInterrupt:
+            worker.stop()
+
+    @app.cli.command("rebuild-rollups")
+    @click.option("--user-id", type=int, default=None, help="Only rebuild this user's rollups.")
+    @click.option("--check", is_flag=True, help="Report drift without repairing it.")
+    def rebuild_rollups_command(user_id, check):
+        """Rebuild the per-user stage counts and values from Lead and report drift."""
+        drift = rebuild_rollups(user_id, repair=not check)
+        for uid, stage, stored_count, actual_count, stored_cents, actual_cents in drift:
+            stored_value = "unset" if stored_cents is None else f"{stored_cents / 100:.2f}"
+            click.echo(
+                f"user={uid} stage={stage!r} count {stored_count} -> {actual_count} "
+                f"value {stored_value} -> {actual_cents / 100:.2f}"
+            )
+        click.echo(f"{len(drift)} drifted rollup(s){'' if check else ' repaired'}.")
+        if check and drift:
+            raise SystemExit(1)
+
+    @app.cli.command("rebuild-notification-counts")
+    @click.option("--user-id", type=int, default=None, help="Only rebuild this user's counters.")
+    @click.option("--check", is_flag=True, help="Report drift without repairing it.")
+    def rebuild_notification_counts_command(user_id, check):
+        """Rebuild the per-user notification counters from Notification and report drift."""
+        drift = rebuild_notification_counts(user_id, repair=not check)
+        for uid, channel, status, stored, actual in drift:
+            click.echo(f"user={uid} channel={channel!r} status={status!r} count {stored} -> {actual}")
+        click.echo(f"{len(drift)} drifted counter(s){'' if check else ' repaired'}.")
+        if check and drift:
+            raise SystemExit(1)
+
+    @app.cli.command("rebuild-funnel")
+    @click.option("--user-id", type=int, default=None, help="Only rebuild this user's buckets.")
+    @click.option("--check", is_flag=True, help="Report drift without repairing it.")
+    def rebuild_funnel_command(user_id, check):
+        """Rebuild the daily funnel buckets from the lead stage history and report drift."""
+        drift = rebuild_funnel(user_id, repair=not check)
+        for table, key, stored, actual in drift:
+            if table == "lead_funnel_daily":
+                # (transitions, cents); cents are None in rows not rebuilt yet
+                stored_value = "unset" if stored[1] is None else f"{stored[1] / 100:.2f}"
+                stored = f"{stored[0]} value {stored_value}"
+                actual = f"{actual[0]} value {actual[1] / 100:.2f}"
+            click.echo(f"{table} {key}: {stored} -> {actual}")
+        click.echo(f"{len(drift)} drifted bucket(s){'' if check else ' repaired'}.")
+        if check and drift:
+            raise SystemExit(1)
+
+    @app.cli.command("archive-notifications")
+    @click.option("--days", type=int, default=None,
+                  help="Archive finished notifications older than this (default NOTIFICATION_RETENTION_DAYS).")
+    @click.option("--target", type=click.Choice(["table", "jsonl"]), default=None,
+                  help="Archive table or gzipped JSONL files in NOTIFICATION_ARCHIVE_DIR (default NOTIFICATION_ARCHIVE).")
+    @click.option("--batch-size", type=int, default=None, help="Rows per transaction (default NOTIFICATION_ARCHIVE_BATCH_SIZE).")
+    def archive_notifications_command(days, target, batch_size):
+        """Move old sent/logged/failed notifications out of the live table."""
+        days = days if days is not None else app.config["NOTIFICATION_RETENTION_DAYS"]
+        if not days or days < 0:
+            click.echo("Retention is off (set NOTIFICATION_RETENTION_DAYS or pass --days).")
+            return
+        try:
+            moved = archive_notifications(
+                datetime.utcnow() - timedelta(days=days),
+                target or app.config["NOTIFICATION_ARCHIVE"],
+                app.config["NOTIFICATION_ARCHIVE_DIR"],
+                batch_size or app.config["NOTIFICATION_ARCHIVE_BATCH_SIZE"],
+            )
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"{moved} notification(s) older than {days} day(s) archived.")
+
+    @app.cli.command("check-query-plans")
+    @click.option("--database-url", envvar="QUERY_PLAN_DATABASE_URL", default=None,
+                  help="Scratch database to check against (e.g. Postgres); defaults to a temporary SQLite file.")
+    def check_query_plans_command(database_url):
+        """Run every endpoint and fail if any of its queries scans a table or sorts."""
+        failures = check_query_plans(create_app, database_url)
+        if failures:
+            click.echo(format_failures(failures), nl=False)
+            click.echo(f"{len(failures)} query plan(s) without a usable index.")
+            raise SystemExit(1)
+        click.echo("All endpoint queries are served by indexes.")
+
+    @app.cli.command("check-statement-counts")
+    @click.option("--update", is_flag=True, help="Write the current counts as the new budget.")
+    def check_statement_counts_command(update):
+        """Fail if any endpoint runs more SQL statements per request than its budget."""
+        counts = statement_counts(create_app)
+        if update:
+            save_statement_budget(counts)
+            click.echo(f"Statement budget updated for {len(counts)} endpoint(s).")
+            return
+        budget = load_statement_budget()
+        for label, count in sorted(counts.items()):
+            if count < budget.get(label, count):
+                click.echo(f"{label}: {count} statement(s), budget {budget[label]} (run with --update to lower it)")
+        failures = over_budget(counts, budget)
+        for label, allowed, count in failures:
+            click.echo(f"{label}: {count} statement(s), budget {allowed if allowed is not None else 'none'}")
+        if failures:
+            raise SystemExit(1)
+        click.echo(f"{len(counts)} endpoint(s) within their statement budget.")
+
+    @app.get("/")
+    def home():
+        return jsonify({"status": "ok", "message": "ContractorConnect API is running"})
 
-<<<<<<< HEAD
     @app.get("/api/health")
     def health():
         return {"status": "ok"}
 
-    # ---------- AUTH ----------
-    @app.post("/api/auth/register")
-    def register():
-        data = request.get_json() or {}
-=======
-    @app.get("/")
-    def home():
-        return jsonify({"status": "ok", "message": "ContractorConnect API is running"}), 200
-
+    # Plain-text probe used by the Render health check
     @app.get("/health")
-    def health():
+    def health_probe():
         return "OK", 200
 
+    # ---------- AUTH ----------
+    def rate_limited(*checks):
+        # First (rule, key) whose bucket is empty -> 429, checked before any
+        # lookup or hashing so rejected attempts stay cheap
+        if limiter is None:
+            return None
+        for rule, key in checks:
+            wait = limiter.hit(rule, key)
+            if wait:
+                return too_many_requests(wait)
+        return None
+
+    proxy_warned = False
+
+    def client_ip():
+        # Per-IP rate limit key. Behind a proxy that TRUSTED_PROXIES does not
+        # cover, every client arrives from the proxy's address and one bucket
+        # would lock them all out together, so per-IP limits are skipped and
+        # login stays limited per email.
+        nonlocal proxy_warned
+        if not app.config["TRUSTED_PROXIES"] and "X-Forwarded-For" in request.headers:
+            if not proxy_warned:
+                proxy_warned = True
+                app.logger.warning("X-Forwarded-For is set but TRUSTED_PROXIES=0; per-IP rate limits are off. "
+                                   "Set TRUSTED_PROXIES to the number of proxies in front of the app.")
+            return None
+        return request.remote_addr
+
+    def hashing_busy():
+        resp = jsonify({"error": "Server busy, try again shortly"})
+        resp.status_code = 503
+        resp.headers["Retry-After"] = "1"
+        return resp
+
     @app.post("/api/auth/register")
     def register():
+        limited = rate_limited(("register_ip", client_ip()))
+        if limited:
+            return limited
         data = request.get_json(silent=True) or {}
->>>>>>> 166f992dea7a1eec725fd93f0f2ac0bef437b79c
         name = (data.get("name") or "").strip()
         email = (data.get("email") or "").strip().lower()
         password = data.get("password") or ""
 
         if not name or not email or not password:
             return jsonify({"error": "Missing name/email/password"}), 400
-<<<<<<< HEAD
-=======
-
->>>>>>> 166f992dea7a1eec725fd93f0f2ac0bef437b79c
         if User.query.filter_by(email=email).first():
             return jsonify({"error": "Email already in use"}), 409
 
-        user = User(name=name, email=email, password_hash=generate_password_hash(password))
+        try:
+            password_hash = hasher.hash(password)
+        except HashingBusy:
+            return hashing_busy()
+        user = User(name=name, email=email, password_hash=password_hash)
         db.session.add(user)
         db.session.commit()
         return jsonify({"message": "Registered successfully"}), 201
-<<<<<<< HEAD
-    @app.get("/")
-    def home():
-        return jsonify({
-            "status": "ok",
-            "message": "ContractorConnect API is running"
-        }), 200
-
-    @app.get("/health")
-    def health():
-        return "OK", 200
-
-
-    @app.post("/api/auth/login")
-    def login():
-        data = request.get_json() or {}
-        ...
-
-    @app.post("/api/auth/login")
-    def login():
-        data = request.get_json() or {}
-=======
 
     @app.post("/api/auth/login")
     def login():
         data = request.get_json(silent=True) or {}
->>>>>>> 166f992dea7a1eec725fd93f0f2ac0bef437b79c
         email = (data.get("email") or "").strip().lower()
         password = data.get("password") or ""
+        limited = rate_limited(("login_ip", client_ip()), ("login_email", email))
+        if limited:
+            return limited
 
         user = User.query.filter_by(email=email).first()
-        if not user or not check_password_hash(user.password_hash, password):
+        if not user:
+            return jsonify({"error": "Invalid credentials"}), 401
+        try:
+            ok, outdated = hasher.verify(user.password_hash, password)
+        except HashingBusy:
+            return hashing_busy()
+        if not ok:
             return jsonify({"error": "Invalid credentials"}), 401
+        if outdated:
+            # PASSWORD_HASH_METHOD changed since this hash was made; a busy
+            # pool just leaves it for a later login
+            try:
+                user.password_hash = hasher.rehash(password)
+                db.session.commit()
+            except HashingBusy:
+                pass
 
-<<<<<<< HEAD
-        token = create_access_token(identity=str(user.id), expires_delta=timedelta(days=3))
+        token = create_access_token(identity=str(user.id))
         return jsonify({"access_token": token, "user": {"id": user.id, "name": user.name, "email": user.email}})
 
     # ---------- LEADS CRUD ----------
-=======
-        token = create_access_token(identity=str(user.id))
-        return jsonify({"access_token": token, "user": {"id": user.id, "name": user.name, "email": user.email}}), 200
-
->>>>>>> 166f992dea7a1eec725fd93f0f2ac0bef437b79c
     @app.get("/api/leads")
     @jwt_required()
+    @conditional_view("leads")
+    @cached_view("leads")
+    @replica_reads("leads")
     def list_leads():
         uid = int(get_jwt_identity())
         stage = request.args.get("stage")
-        q = Lead.query.filter_by(user_id=uid)
+        try:
+            fields = parse_lead_fields(request.args.get("fields"))
+            limit = parse_limit(request.args.get("limit"))
+            since = parse_since(request.args["since"]) if request.args.get("since") else None
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if since is not None:
+            # Delta mode: every lead changed at or after `since` plus the ids
+            # deleted since then; pass as_of back as the next `since`.
+            as_of = datetime.utcnow() - DELTA_OVERLAP
+            changed = (
+                db.session.query(*lead_columns(fields), Lead.created_at, Lead.id)
+                .filter(Lead.user_id == uid, Lead.updated_at >= since)
+                .order_by(Lead.updated_at, Lead.id)
+                .all()
+            )
+            deleted = (
+                db.session.query(LeadTombstone.lead_id)
+                .filter(LeadTombstone.user_id == uid, LeadTombstone.deleted_at >= since)
+                .order_by(LeadTombstone.deleted_at)
+                .all()
+            )
+            return jsonify({
+                "leads": serialize_lead_rows(changed, fields),
+                "deleted": [r.lead_id for r in deleted],
+                "as_of": as_of.isoformat(),
+            })
+
+        # Column-only query: rows are plain tuples, no ORM entities are built.
+        # created_at/id always ride along at the end for the keyset cursor.
+        q = db.session.query(*lead_columns(fields), Lead.created_at, Lead.id)
+        q = q.filter(Lead.user_id == uid)
         if stage:
-            q = q.filter_by(stage=stage)
-        leads = q.order_by(Lead.created_at.desc()).all()
-<<<<<<< HEAD
-        return jsonify([serialize_lead(l) for l in leads])
-=======
-        return jsonify([serialize_lead(l) for l in leads]), 200
->>>>>>> 166f992dea7a1eec725fd93f0f2ac0bef437b79c
+            q = q.filter(Lead.stage == stage)
+        after = request.args.get("after")
+        if after:
+            try:
+                q = keyset_after(q, Lead.created_at, Lead.id, after)
+            except CursorError as e:
+                return jsonify({"error": str(e)}), 400
+        q = q.order_by(Lead.created_at.desc(), Lead.id.desc())
+
+        if request.args.get("stream") in ("1", "true"):
+            if limit:
+                q = q.limit(limit)
+            # The body runs after the request's session has been torn down:
+            # bind the query to the session that is current while streaming,
+            # or its connection never makes it back to the pool
+            def stream_rows():
+                yield from q.with_session(db.session()).yield_per(STREAM_CHUNK_SIZE)
+
+            rows = stream_rows()
+            dumps = lambda obj: app.json.dumps(obj, separators=(",", ":"))
+            body = stream_json_array((serialize_lead_row(r, fields) for r in rows), dumps)
+            return Response(stream_with_context(body), mimetype="application/json")
+
+        if limit:
+            rows = q.limit(limit + 1).all()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+        else:
+            rows = q.all()
+            has_more = False
+
+        resp = jsonify(serialize_lead_rows(rows, fields))
+        if has_more:
+            resp.headers["X-Next-Cursor"] = encode_cursor(rows[-1][-2], rows[-1][-1])
+        return resp
 
     @app.post("/api/leads")
     @jwt_required()
     def create_lead():
         uid = int(get_jwt_identity())
-<<<<<<< HEAD
-        data = request.get_json() or {}
-=======
         data = request.get_json(silent=True) or {}
->>>>>>> 166f992dea7a1eec725fd93f0f2ac0bef437b79c
-
-        full_name = (data.get("full_name") or "").strip()
-        if not full_name:
-            return jsonify({"error": "full_name is required"}), 400
-
-        stage = data.get("stage") or "New"
-        if stage not in STAGES:
-            stage = "New"
-
-        lead = Lead(
-            user_id=uid,
-            full_name=full_name,
-            phone=(data.get("phone") or "").strip() or None,
-            email=(data.get("email") or "").strip() or None,
-            address=(data.get("address") or "").strip() or None,
-            city=(data.get("city") or "").strip() or None,
-            state=(data.get("state") or "").strip() or None,
-            stage=stage,
-            estimated_value=float(data.get("estimated_value") or 0),
-<<<<<<< HEAD
-            appointment_datetime=(data.get("appointment_datetime") or "").strip() or None
-=======
-            appointment_datetime=(data.get("appointment_datetime") or "").strip() or None,
->>>>>>> 166f992dea7a1eec725fd93f0f2ac0bef437b79c
-        )
+
+        try:
+            values = lead_values_from_payload(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # One index lookup on phone_key/email_key; ?allow_duplicate=1 skips it
+        if request.args.get("allow_duplicate") not in ("1", "true"):
+            duplicate_of = find_duplicate(uid, values["phone_key"], values["email_key"])
+            if duplicate_of is not None:
+                return jsonify({
+                    "error": "A lead with this phone or email already exists",
+                    "duplicate_of": duplicate_of,
+                }), 409
+
+        lead = Lead(user_id=uid, **values)
         db.session.add(lead)
+        db.session.flush()
+        record_lead_added(lead)
+        record_stage_events([
+            stage_event(uid, lead.id, None, lead.stage, lead.estimated_value, None, lead.stage_changed_at)
+        ])
+        index_leads([lead.id], new=True)
+        bump_version(uid, "leads")
         db.session.commit()
         return jsonify(serialize_lead(lead)), 201
 
+    @app.patch("/api/leads")
+    @jwt_required()
+    def bulk_update_leads():
+        uid = int(get_jwt_identity())
+        data = request.get_json(silent=True) or {}
+        ids = data.get("ids")
+        if not isinstance(ids, list) or not ids or not all(type(i) is int for i in ids):
+            return jsonify({"error": "ids must be a non-empty list of lead ids"}), 400
+        if len(ids) > app.config["BULK_UPDATE_MAX_IDS"]:
+            return jsonify({"error": f"At most {app.config['BULK_UPDATE_MAX_IDS']} ids per request"}), 400
+        try:
+            changes = lead_changes_from_payload(data.get("changes") or {})
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if not changes:
+            return jsonify({"error": "changes must set at least one field"}), 400
+
+        # One read of the owned rows gives us missing ids, rollup deltas and
+        # the Booked transitions; then a single set-based UPDATE applies it all.
+        owned = (
+            db.session.query(
+                Lead.id, Lead.stage, Lead.estimated_value, Lead.full_name, Lead.email, Lead.phone, Lead.stage_changed_at,
+            )
+            .filter(Lead.user_id == uid, Lead.id.in_(ids))
+            .all()
+        )
+        owned_ids = [row.id for row in owned]
+        missing = sorted(set(ids) - set(owned_ids))
+        now = datetime.utcnow()
+        if "stage" in changes:
+            # Only leads that actually change stage restart their time in stage
+            changes["stage_changed_at"] = db.case(
+                (Lead.stage != changes["stage"], now), else_=Lead.stage_changed_at
+            )
+        if owned_ids:
+            Lead.query.filter(Lead.user_id == uid, Lead.id.in_(owned_ids)).update(changes, synchronize_session=False)
+
+        deltas = Counter()  # stage -> lead count change
+        value_deltas = Counter()  # stage -> cents change
+        booked = []
+        events = []
+        for row in owned:
+            new_stage = changes.get("stage", row.stage)
+            new_value = changes["estimated_value"] if "estimated_value" in changes else row.estimated_value
+            value_deltas[row.stage] -= to_cents(row.estimated_value)
+            value_deltas[new_stage] += to_cents(new_value)
+            if new_stage != row.stage:
+                deltas[row.stage] -= 1
+                deltas[new_stage] += 1
+                events.append(stage_event(uid, row.id, row.stage, new_stage, new_value, row.stage_changed_at, now))
+            if row.stage != "Booked" and new_stage == "Booked":
+                booked.append(booked_notification(
+                    uid, row.id,
+                    changes.get("full_name", row.full_name),
+                    changes["email"] if "email" in changes else row.email,
+                    changes["phone"] if "phone" in changes else row.phone,
+                ))
+        for stage in deltas.keys() | value_deltas.keys():
+            apply_delta(uid, stage, deltas[stage], value_deltas[stage])
+        record_stage_events(events)
+        if SEARCHABLE_LEAD_FIELDS.intersection(changes):
+            index_leads(owned_ids)
+        queued = enqueue_notifications(booked)
+        bump_version(uid, "leads", *(("notifications",) if queued else ()))
+        db.session.commit()
+        if queued:
+            wake_worker()
+
+        return jsonify({"updated": len(owned_ids), "missing": missing, "notifications_queued": queued})
+
+    @app.post("/api/leads/bulk")
+    @jwt_required()
+    def bulk_import_leads():
+        uid = int(get_jwt_identity())
+        fmt = detect_format(request.content_type, request.args.get("format"))
+        if fmt is None:
+            return jsonify({"error": "Send text/csv or application/x-ndjson (or ?format=csv|jsonl)"}), 415
+
+        # Rows are parsed off the request stream and inserted batch by batch
+        records = iter_records(request.stream, fmt)
+        allow_duplicates = request.args.get("allow_duplicate") in ("1", "true")
+        report = import_leads(
+            uid, records, lead_values_from_payload,
+            app.config["IMPORT_BATCH_SIZE"], app.config["IMPORT_MAX_ERRORS"],
+            duplicates=None if allow_duplicates else ImportDuplicates(uid),
+        )
+        return jsonify(report), 400 if "aborted" in report else 200
+
     @app.get("/api/leads/<int:lead_id>")
     @jwt_required()
-<<<<<<< HEAD
+    @conditional_view("leads")
+    @cached_view("leads")
     def get_lead(lead_id):
-=======
-    def get_lead(lead_id: int):
->>>>>>> 166f992dea7a1eec725fd93f0f2ac0bef437b79c
         uid = int(get_jwt_identity())
-        lead = Lead.query.filter_by(id=lead_id, user_id=uid).first()
+        # Lead and its notes in one query
+        lead = Lead.query.options(joinedload(Lead.notes)).filter_by(id=lead_id, user_id=uid).one_or_none()
         if not lead:
             return jsonify({"error": "Not found"}), 404
-<<<<<<< HEAD
 
-        notes = Note.query.filter_by(lead_id=lead.id, user_id=uid).order_by(Note.created_at.desc()).all()
         payload = serialize_lead(lead)
-        payload["notes"] = [serialize_note(n) for n in notes]
+        payload["notes"] = [serialize_note(n) for n in lead.notes]
         return jsonify(payload)
 
     @app.put("/api/leads/<int:lead_id>")
     @jwt_required()
     def update_lead(lead_id):
-=======
-        return jsonify(serialize_lead(lead)), 200
-
-    @app.put("/api/leads/<int:lead_id>")
-    @jwt_required()
-    def update_lead(lead_id: int):
->>>>>>> 166f992dea7a1eec725fd93f0f2ac0bef437b79c
         uid = int(get_jwt_identity())
         lead = Lead.query.filter_by(id=lead_id, user_id=uid).first()
         if not lead:
             return jsonify({"error": "Not found"}), 404
 
-<<<<<<< HEAD
-        data = request.get_json() or {}
-        old_stage = lead.stage
-=======
         data = request.get_json(silent=True) or {}
->>>>>>> 166f992dea7a1eec725fd93f0f2ac0bef437b79c
+        old_stage = lead.stage
+        old_value = lead.estimated_value
 
-        for field in ["full_name", "phone", "email", "address", "city", "state", "appointment_datetime"]:
+        for field in ["full_name", "phone", "email", "address", "city", "state"]:
             if field in data:
                 val = (data.get(field) or "").strip()
                 setattr(lead, field, val or None)
+        for column, key in contact_keys(
+            {f: getattr(lead, f) for f in ("phone", "email") if f in data}, app.config["LEAD_PHONE_COUNTRY_CODE"]
+        ).items():
+            setattr(lead, column, key)
+
+        if "appointment_datetime" in data:
+            try:
+                lead.appointment_datetime = appointment_from_payload(data.get("appointment_datetime"))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
 
         if "estimated_value" in data:
-            lead.estimated_value = float(data.get("estimated_value") or 0)
+            try:
+                lead.estimated_value = estimated_value_from_payload(data.get("estimated_value"))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
 
         if "stage" in data:
             s = data.get("stage")
             if s in STAGES:
                 lead.stage = s
 
-        db.session.commit()
-<<<<<<< HEAD
-
-        # Trigger notification when moved to Booked
-        if old_stage != "Booked" and lead.stage == "Booked":
+        events = []
+        if lead.stage != old_stage:
+            # Set before the first statement below flushes the lead
+            now = datetime.utcnow()
+            events.append(stage_event(
+                uid, lead.id, old_stage, lead.stage, lead.estimated_value, lead.stage_changed_at, now
+            ))
+            lead.stage_changed_at = now
+        record_lead_changed(uid, old_stage, old_value, lead.stage, lead.estimated_value)
+        record_stage_events(events)
+        if SEARCHABLE_LEAD_FIELDS.intersection(data):
+            index_leads([lead.id])
+
+        # Queue a notification when moved to Booked; it commits with the lead
+        booked = old_stage != "Booked" and lead.stage == "Booked"
+        if booked:
             auto_notify_on_booked(uid, lead)
+        bump_version(uid, "leads", *(("notifications",) if booked else ()))
+        db.session.commit()
+        if booked:
+            wake_worker()
 
         return jsonify(serialize_lead(lead))
 
     @app.delete("/api/leads/<int:lead_id>")
     @jwt_required()
     def delete_lead(lead_id):
-=======
-        return jsonify(serialize_lead(lead)), 200
-
-    @app.delete("/api/leads/<int:lead_id>")
-    @jwt_required()
-    def delete_lead(lead_id: int):
->>>>>>> 166f992dea7a1eec725fd93f0f2ac0bef437b79c
         uid = int(get_jwt_identity())
-        lead = Lead.query.filter_by(id=lead_id, user_id=uid).first()
+        lead = (
+            db.session.query(Lead.id, Lead.user_id, Lead.stage, Lead.estimated_value)
+            .filter(Lead.id == lead_id, Lead.user_id == uid)
+            .first()
+        )
         if not lead:
             return jsonify({"error": "Not found"}), 404
-<<<<<<< HEAD
 
-        Note.query.filter_by(lead_id=lead.id, user_id=uid).delete()
-        Notification.query.filter_by(lead_id=lead.id, user_id=uid).delete()
-        db.session.delete(lead)
+        # Index entries first: the note_fts cleanup looks up the lead's notes,
+        # which the database deletes along with the lead (ON DELETE CASCADE)
+        remove_leads([lead.id])
+        record_lead_notifications_removed(lead.id)
+        db.session.execute(db.delete(Lead).where(Lead.id == lead.id))
+        record_lead_removed(lead)
+        db.session.add(LeadTombstone(user_id=uid, lead_id=lead.id))
+        bump_version(uid, "leads", "notifications")
         db.session.commit()
         return jsonify({"message": "Deleted"})
 
+    # ---------- DUPLICATES ----------
+    @app.get("/api/leads/duplicates")
+    @jwt_required()
+    @conditional_view("leads")
+    def lead_duplicates():
+        # Leads sharing a phone number or an email address, grouped per
+        # match; ?limit= caps the groups of each kind (default 100)
+        uid = int(get_jwt_identity())
+        try:
+            limit = parse_limit(request.args.get("limit"), default=DUPLICATE_GROUP_LIMIT)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        groups = duplicate_groups(uid, limit, lead_columns())
+        return jsonify({"groups": [
+            {"match": g["match"], "key": g["key"], "leads": serialize_lead_rows(g["rows"])} for g in groups
+        ]})
+
+    @app.post("/api/leads/<int:lead_id>/merge")
+    @jwt_required()
+    def merge_lead_duplicates(lead_id):
+        # {"duplicate_ids": [...]}: folds those leads into this one (see
+        # dedupe.merge_leads) and deletes them, all in one transaction
+        uid = int(get_jwt_identity())
+        data = request.get_json(silent=True) or {}
+        ids = data.get("duplicate_ids")
+        if not isinstance(ids, list) or not ids or not all(type(i) is int for i in ids):
+            return jsonify({"error": "duplicate_ids must be a non-empty list of lead ids"}), 400
+        ids = list(dict.fromkeys(ids))
+        if lead_id in ids:
+            return jsonify({"error": "A lead cannot be merged into itself"}), 400
+        if len(ids) > MERGE_MAX_IDS:
+            return jsonify({"error": f"At most {MERGE_MAX_IDS} duplicate_ids per merge"}), 400
+
+        try:
+            lead = merge_leads(uid, lead_id, ids, app.config["LEAD_PHONE_COUNTRY_CODE"])
+        except LookupError as e:
+            db.session.rollback()
+            return jsonify({"error": "Not found", "missing": e.args[0]}), 404
+        bump_version(uid, "leads", "notifications")
+        db.session.commit()
+        return jsonify({"lead": serialize_lead(lead), "merged": ids})
+
     # ---------- NOTES ----------
     @app.post("/api/leads/<int:lead_id>/notes")
     @jwt_required()
@@ -317,13 +680,16 @@ def create_app():
         if not lead:
             return jsonify({"error": "Not found"}), 404
 
-        data = request.get_json() or {}
+        data = request.get_json(silent=True) or {}
         text = (data.get("note_text") or "").strip()
         if not text:
             return jsonify({"error": "note_text required"}), 400
 
         note = Note(lead_id=lead.id, user_id=uid, note_text=text)
         db.session.add(note)
+        db.session.flush()
+        index_notes([note.id])
+        bump_version(uid, "leads")
         db.session.commit()
         return jsonify(serialize_note(note)), 201
 
@@ -332,7 +698,7 @@ def create_app():
     @jwt_required()
     def send_notification():
         uid = int(get_jwt_identity())
-        data = request.get_json() or {}
+        data = request.get_json(silent=True) or {}
         channel = (data.get("channel") or "").lower().strip()
         to_value = (data.get("to_value") or "").strip()
         subject = (data.get("subject") or "").strip() or None
@@ -343,145 +709,362 @@ def create_app():
             return jsonify({"error": "channel must be email or sms"}), 400
         if not to_value or not message:
             return jsonify({"error": "to_value and message are required"}), 400
-
-        status, provider_resp = try_send_notification(app.config, channel, to_value, subject or "ContractorConnect Notification", message)
-
-        notif = Notification(
-            user_id=uid,
-            lead_id=lead_id,
-            channel=channel,
-            to_value=to_value,
-            subject=subject,
-            message=message,
-            status=status,
-            provider_response=provider_resp
-        )
-        db.session.add(notif)
+        # lead_id is a foreign key now enforced by the database too
+        if lead_id is not None and not db.session.query(
+            Lead.query.filter_by(id=lead_id, user_id=uid).exists()
+        ).scalar():
+            return jsonify({"error": "Lead not found"}), 404
+
+        # Delivery happens on the outbox worker; the client polls the log for status
+        notif = enqueue_notification(uid, lead_id, channel, to_value, subject, message)
+        bump_version(uid, "notifications")
         db.session.commit()
-        return jsonify(serialize_notification(notif))
+        wake_worker()
+        return jsonify(serialize_notification(notif)), 202
+
+    @app.get("/api/notifications/provider-stats")
+    @jwt_required()
+    def notification_provider_stats():
+        # Per-process send timings and connection reuse for each provider
+        return jsonify(app.extensions["notification_providers"].stats())
+
+    @app.get("/api/cache/stats")
+    @jwt_required()
+    def cache_stats():
+        # Per-process hit/miss/eviction counters of the response cache
+        cache = app.extensions["response_cache"]
+        return jsonify(cache.stats() if cache is not None else {"enabled": False})
 
     @app.get("/api/notifications")
     @jwt_required()
+    @conditional_view("notifications")
+    @cached_view("notifications")
+    @replica_reads("notifications")
     def list_notifications():
+        # Newest first, NOTIFICATION_PAGE_SIZE at a time by default; follow
+        # X-Next-Cursor with ?after= for older pages. ?status= and ?lead_id=
+        # have their own indexes; ?channel= filters the user's range.
         uid = int(get_jwt_identity())
-        notifs = Notification.query.filter_by(user_id=uid).order_by(Notification.created_at.desc()).limit(100).all()
-        return jsonify([serialize_notification(n) for n in notifs])
+        try:
+            limit = parse_limit(request.args.get("limit"), default=NOTIFICATION_PAGE_SIZE)
+            filters = notification_filters(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        q = db.session.query(*NOTIFICATION_COLUMNS).filter(Notification.user_id == uid, *filters)
+        after = request.args.get("after")
+        if after:
+            try:
+                q = keyset_after(q, Notification.created_at, Notification.id, after)
+            except CursorError as e:
+                return jsonify({"error": str(e)}), 400
+        rows = q.order_by(Notification.created_at.desc(), Notification.id.desc()).limit(limit + 1).all()
+
+        resp = jsonify(serialize_notification_rows(rows[:limit]))
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            resp.headers["X-Next-Cursor"] = encode_cursor(last.created_at, last.id)
+        return resp
+
+    @app.get("/api/notifications/counts")
+    @jwt_required()
+    @conditional_view("notifications")
+    def notification_counts_view():
+        # Live-log totals by channel and status, from the counter rows
+        return jsonify(notification_counts(int(get_jwt_identity())))
+
+    # ---------- SEARCH ----------
+    @app.get("/api/search")
+    @jwt_required()
+    def search_leads():
+        uid = int(get_jwt_identity())
+        try:
+            limit = min(int(request.args.get("limit") or 20), MAX_SEARCH_LIMIT)
+        except ValueError:
+            return jsonify({"error": "limit must be an integer"}), 400
+        if limit < 1:
+            return jsonify({"error": "limit must be positive"}), 400
+        return jsonify(search(uid, request.args.get("q") or "", limit))
+
+    # ---------- APPOINTMENTS ----------
+    @app.get("/api/appointments")
+    @jwt_required()
+    @conditional_view("leads")
+    @cached_view("leads")
+    def list_appointments():
+        # Leads with an appointment in [from, to), soonest first; one index
+        # range scan on ix_lead_user_appointment. Same ?fields= and
+        # ?limit= / ?after= paging as the lead list.
+        uid = int(get_jwt_identity())
+        tz = app.extensions["appointment_timezone"]
+        try:
+            start = parse_appointment(request.args.get("from"), tz, "from")
+            if start is None:
+                raise ValueError("from is required")
+            end = parse_appointment(request.args.get("to"), tz, "to") or start + DEFAULT_RANGE
+            if end <= start:
+                raise ValueError("to must be after from")
+            if end - start > MAX_RANGE:
+                raise ValueError(f"from and to can be at most {MAX_RANGE.days} days apart")
+            fields = parse_lead_fields(request.args.get("fields"))
+            limit = parse_limit(request.args.get("limit"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        q = db.session.query(*lead_columns(fields), Lead.appointment_datetime, Lead.id)
+        q = q.filter(Lead.user_id == uid, Lead.appointment_datetime >= start, Lead.appointment_datetime < end)
+        after = request.args.get("after")
+        if after:
+            try:
+                q = keyset_after(q, Lead.appointment_datetime, Lead.id, after, ascending=True)
+            except CursorError as e:
+                return jsonify({"error": str(e)}), 400
+        q = q.order_by(Lead.appointment_datetime, Lead.id)
+
+        if limit:
+            rows = q.limit(limit + 1).all()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+        else:
+            rows = q.all()
+            has_more = False
+
+        resp = jsonify(serialize_lead_rows(rows, fields))
+        if has_more:
+            resp.headers["X-Next-Cursor"] = encode_cursor(rows[-1][-2], rows[-1][-1])
+        return resp
+
+    # ---------- ANALYTICS ----------
+    @app.get("/api/analytics/funnel")
+    @jwt_required()
+    @conditional_view("leads")
+    @cached_view("leads")
+    @replica_reads("leads")
+    def analytics_funnel():
+        # Stage conversion, median time in stage and won/lost value per
+        # ?period= (day, week or month) over [?from, ?to), from the daily
+        # buckets in analytics.py
+        uid = int(get_jwt_identity())
+        period = request.args.get("period") or "month"
+        try:
+            if period not in PERIODS:
+                raise ValueError(f"period must be one of: {', '.join(PERIODS)}")
+            start, end = parse_funnel_range(
+                request.args.get("from"), request.args.get("to"), datetime.now(timezone.utc).date()
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify(funnel(uid, start, end, period, STAGES))
 
     # ---------- DASHBOARD ----------
     @app.get("/api/dashboard")
     @jwt_required()
+    @cached_view("leads")
+    @replica_reads("leads")
     def dashboard():
         uid = int(get_jwt_identity())
-        leads = Lead.query.filter_by(user_id=uid).all()
 
-        total = len(leads)
-        pipeline_value = sum((l.estimated_value or 0) for l in leads if l.stage != "Closed Lost")
-        by_stage = {s: 0 for s in STAGES}
-        for l in leads:
-            by_stage[l.stage] = by_stage.get(l.stage, 0) + 1
+        # Totals come from the per-stage rollups maintained on every lead
+        # write, so this is O(stages) no matter how many leads the user has.
+        rows = (
+            db.session.query(LeadStageRollup.stage, LeadStageRollup.lead_count, LeadStageRollup.total_cents)
+            .filter(LeadStageRollup.user_id == uid)
+            .all()
+        )
 
-        upcoming = [serialize_lead(l) for l in leads if l.appointment_datetime]
-        upcoming = sorted(upcoming, key=lambda x: x["appointment_datetime"])[:10]
+        total = 0
+        pipeline_cents = 0
+        by_stage = {s: 0 for s in STAGES}
+        for stage, count, cents in rows:
+            total += count
+            if count:
+                by_stage[stage] = count
+            if stage != "Closed Lost":
+                pipeline_cents += cents or 0
+        # 0 (an int, like the old Python sum()) when nothing counts
+        pipeline = pipeline_cents / 100 if pipeline_cents else 0
+
+        # Next appointments from now on: index range scan on
+        # ix_lead_user_appointment. A cached dashboard can still list one
+        # that passed within the last RESPONSE_CACHE_TTL seconds.
+        upcoming_rows = (
+            db.session.query(*lead_columns())
+            .filter(Lead.user_id == uid, Lead.appointment_datetime >= datetime.now(timezone.utc))
+            .order_by(Lead.appointment_datetime, Lead.id)
+            .limit(10)
+            .all()
+        )
+        upcoming = serialize_lead_rows(upcoming_rows)
 
         return jsonify({
             "total_leads": total,
-            "pipeline_value": pipeline_value,
+            "pipeline_value": pipeline,
             "by_stage": by_stage,
             "upcoming": upcoming
         })
 
     return app
 
-def auto_notify_on_booked(uid: int, lead: Lead):
-    # Automatic notification is logged; will send for real only if providers configured
+# Token checks for jwt_required(), timed as a metrics section
+timed_verify_jwt = timed("jwt_verify", verify_jwt_in_request)
+
+def jwt_required():
+    # flask_jwt_extended's jwt_required(), calling verify_jwt_in_request
+    # through timed() when metrics are on, so the library stays unpatched
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            (timed_verify_jwt if current_app.config["METRICS_ENABLED"] else verify_jwt_in_request)()
+            return current_app.ensure_sync(view)(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def booked_notification(uid: int, lead_id: int, full_name: str, email, phone):
+    # Notification column values for a lead that just moved to Booked.
     # Prefer email if lead email exists, else SMS if phone exists, else just log to "email" with placeholder
-    if lead.email and "@" in lead.email:
+    if email and "@" in email:
         channel = "email"
-        to_value = lead.email
+        to_value = email
         subject = "Appointment booked"
-        message = f"Hi {lead.full_name}, your appointment has been booked. We'll follow up soon."
-    elif lead.phone:
+        message = f"Hi {full_name}, your appointment has been booked. We'll follow up soon."
+    elif phone:
         channel = "sms"
-        to_value = lead.phone
+        to_value = phone
         subject = None
-        message = f"{lead.full_name}, your appointment is booked. Reply if you need to reschedule."
+        message = f"{full_name}, your appointment is booked. Reply if you need to reschedule."
     else:
         channel = "email"
         to_value = "no-recipient@example.com"
         subject = "Appointment booked (logged)"
-        message = f"Lead {lead.full_name} moved to Booked; no email/phone on file. Logged only."
-
-    # config isn't accessible outside app context easily, so this is called inside request with app context.
-    # We'll send/log using current app config.
-    from flask import current_app
-    status, provider_resp = try_send_notification(current_app.config, channel, to_value, subject or "ContractorConnect", message)
-
-    notif = Notification(
-        user_id=uid,
-        lead_id=lead.id,
-        channel=channel,
-        to_value=to_value,
-        subject=subject,
-        message=message,
-        status=status,
-        provider_response=provider_resp
-    )
-    db.session.add(notif)
-    db.session.commit()
-
-def serialize_lead(l: Lead):
+        message = f"Lead {full_name} moved to Booked; no email/phone on file. Logged only."
     return {
-        "id": l.id,
-        "full_name": l.full_name,
-        "phone": l.phone,
-        "email": l.email,
-        "address": l.address,
-        "city": l.city,
-        "state": l.state,
-        "stage": l.stage,
-        "estimated_value": l.estimated_value,
-        "appointment_datetime": l.appointment_datetime,
-        "created_at": l.created_at.isoformat() if l.created_at else None,
-        "updated_at": l.updated_at.isoformat() if l.updated_at else None,
+        "user_id": uid,
+        "lead_id": lead_id,
+        "channel": channel,
+        "to_value": to_value,
+        "subject": subject,
+        "message": message,
     }
 
-def serialize_note(n: Note):
-    return {
-        "id": n.id,
-        "lead_id": n.lead_id,
-        "note_text": n.note_text,
-        "created_at": n.created_at.isoformat() if n.created_at else None,
-    }
-
-def serialize_notification(n: Notification):
-    return {
-        "id": n.id,
-        "lead_id": n.lead_id,
-        "channel": n.channel,
-        "to_value": n.to_value,
-        "subject": n.subject,
-        "message": n.message,
-        "status": n.status,
-        "provider_response": n.provider_response,
-        "created_at": n.created_at.isoformat() if n.created_at else None,
-    }
-
-import os
+def auto_notify_on_booked(uid: int, lead: Lead):
+    # Automatic notification is queued; will send for real only if providers configured.
+    # Queued in the caller's transaction; the outbox worker sends it after commit
+    enqueue_notification(**booked_notification(uid, lead.id, lead.full_name, lead.email, lead.phone))
+
+# Lead columns covered by the full-text index (see search.py)
+SEARCHABLE_LEAD_FIELDS = {"full_name", "email", "phone", "address", "city"}
+
+LEAD_TEXT_FIELDS = ("phone", "email", "address", "city", "state")
+
+def _clean_text(value):
+    return str(value).strip() if value is not None else ""
+
+def appointment_from_payload(value):
+    # Lenient date/time (see appointments.py); raises ValueError
+    return parse_appointment(value, current_app.extensions["appointment_timezone"])
+
+def estimated_value_from_payload(value):
+    # A finite number (NaN/Infinity would be written into responses as
+    # invalid JSON) no larger than the rollups can total; raises ValueError
+    try:
+        estimated_value = float(value or 0)
+    except (TypeError, ValueError):
+        raise ValueError("estimated_value must be a number") from None
+    if not math.isfinite(estimated_value):
+        raise ValueError("estimated_value must be a number")
+    if abs(estimated_value) > MAX_ESTIMATED_VALUE:
+        raise ValueError(f"estimated_value must be between -{MAX_ESTIMATED_VALUE} and {MAX_ESTIMATED_VALUE}")
+    return estimated_value
+
+def lead_values_from_payload(data):
+    # Validation and normalisation shared by create_lead and the bulk import.
+    # Returns Lead column values; raises ValueError with a client-facing message.
+    full_name = _clean_text(data.get("full_name"))
+    if not full_name:
+        raise ValueError("full_name is required")
+
+    stage = data.get("stage") or "New"
+    if stage not in STAGES:
+        stage = "New"
+
+    estimated_value = estimated_value_from_payload(data.get("estimated_value"))
+
+    values = {field: _clean_text(data.get(field)) or None for field in LEAD_TEXT_FIELDS}
+    values.update(full_name=full_name, stage=stage, estimated_value=estimated_value,
+                  appointment_datetime=appointment_from_payload(data.get("appointment_datetime")))
+    values.update(contact_keys(values, current_app.config["LEAD_PHONE_COUNTRY_CODE"]))
+    values["stage_changed_at"] = datetime.utcnow()
+    return values
+
+def lead_changes_from_payload(changes):
+    # Field changes for PATCH /api/leads, normalised like update_lead does.
+    # Unlike update_lead an unknown stage is an error, not a silent no-op.
+    if not isinstance(changes, dict):
+        raise ValueError("changes must be an object")
+    unknown = set(changes) - set(LEAD_TEXT_FIELDS) - {"full_name", "stage", "estimated_value", "appointment_datetime"}
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(sorted(unknown))}")
+
+    values = {field: _clean_text(changes[field]) or None for field in LEAD_TEXT_FIELDS if field in changes}
+    if "full_name" in changes:
+        values["full_name"] = _clean_text(changes["full_name"])
+        if not values["full_name"]:
+            raise ValueError("full_name cannot be empty")
+    if "stage" in changes:
+        if changes["stage"] not in STAGES:
+            raise ValueError(f"stage must be one of: {', '.join(STAGES)}")
+        values["stage"] = changes["stage"]
+    if "appointment_datetime" in changes:
+        values["appointment_datetime"] = appointment_from_payload(changes["appointment_datetime"])
+    values.update(contact_keys(values, current_app.config["LEAD_PHONE_COUNTRY_CODE"]))
+    if "estimated_value" in changes:
+        values["estimated_value"] = estimated_value_from_payload(changes["estimated_value"])
+    return values
+
+# Default number of groups per match kind in GET /api/leads/duplicates
+DUPLICATE_GROUP_LIMIT = 100
+
+# Default page size of GET /api/notifications, which used to return the newest 100
+NOTIFICATION_PAGE_SIZE = 100
+NOTIFICATION_STATUSES = (outbox.QUEUED, outbox.SENDING, outbox.SENT, outbox.LOGGED, outbox.FAILED)
+
+def notification_filters(args):
+    # ?channel= / ?status= / ?lead_id= -> filter clauses; raises ValueError
+    filters = []
+    channel = args.get("channel")
+    if channel:
+        if channel not in ("email", "sms"):
+            raise ValueError("channel must be email or sms")
+        filters.append(Notification.channel == channel)
+    status = args.get("status")
+    if status:
+        if status not in NOTIFICATION_STATUSES:
+            raise ValueError(f"status must be one of: {', '.join(NOTIFICATION_STATUSES)}")
+        filters.append(Notification.status == status)
+    lead_id = args.get("lead_id")
+    if lead_id:
+        try:
+            filters.append(Notification.lead_id == int(lead_id))
+        except ValueError:
+            raise ValueError("lead_id must be an integer")
+    return filters
+
+def parse_lead_fields(value):
+    # ?fields=id,full_name,stage -> ("id", "full_name", "stage"); empty means all
+    if not value:
+        return LEAD_FIELDS
+    fields = tuple(dict.fromkeys(f.strip() for f in value.split(",") if f.strip()))
+    unknown = [f for f in fields if f not in LEAD_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    return fields or LEAD_FIELDS
 
 app = create_app()
 
 if __name__ == "__main__":
+    # Development server: upgrade in place first, as the release step would
+    with app.app_context():
+        upgrade_schema()
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port)
 
-=======
-        db.session.delete(lead)
-        db.session.commit()
-        return jsonify({"message": "Deleted"}), 200
-
-    return app
-
-app = create_app()
-if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
->>>>>>> 166f992dea7a1eec725fd93f0f2ac0bef437b79c
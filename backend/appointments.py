@@ -0,0 +1,74 @@
+import re
+from datetime import date, datetime, time, timedelta, timezone
+
+# Appointment times are stored as timezone-aware UTC datetimes
+# (Lead.appointment_datetime). The column used to be free text and the forms
+# still are, so input is parsed leniently: ISO 8601 and the usual US ways of
+# writing a date and time. Times without an offset are taken to be in
+# APPOINTMENT_TIMEZONE.
+
+APPOINTMENT_FORMAT_HINT = "e.g. 2025-12-16 14:00"
+# GET /api/appointments: `to` defaults to a month after `from`, and one
+# request covers at most a year
+DEFAULT_RANGE = timedelta(days=31)
+MAX_RANGE = timedelta(days=366)
+
+_FORMATS = [
+    f"{day} {clock}".strip()
+    for day in ("%m/%d/%Y", "%m/%d/%y", "%m-%d-%Y", "%b %d %Y", "%B %d %Y", "%d %b %Y", "%d %B %Y", "%Y-%m-%d")
+    for clock in ("%I:%M %p", "%I %p", "%H:%M", "%H:%M:%S", "")
+]
+
+_MERIDIEM_RE = re.compile(r"(\d)\s*([ap])\.?\s*m\.?(?=\s|$)", re.IGNORECASE)
+_ORDINAL_RE = re.compile(r"(\d)(st|nd|rd|th)\b", re.IGNORECASE)
+_UTC_SUFFIX_RE = re.compile(r"\s*(z|utc|gmt)$", re.IGNORECASE)
+
+def appointment_timezone(name: str):
+    # ZoneInfo needs the tzdata package on Windows; UTC never does
+    if name in ("", "UTC", "utc"):
+        return timezone.utc
+    from zoneinfo import ZoneInfo
+
+    return ZoneInfo(name)
+
+def _parse_text(text: str, field: str) -> datetime:
+    utc = _UTC_SUFFIX_RE.search(text)
+    if utc and utc.start() > 0:
+        text = text[:utc.start()]
+    try:
+        parsed = datetime.fromisoformat(text)
+    except ValueError:
+        # "Dec 16th, 2025 at 2pm" -> "Dec 16 2025 2 PM"
+        cleaned = _ORDINAL_RE.sub(r"\1", text.replace(",", " "))
+        cleaned = re.sub(r"\s+at\s+", " ", cleaned, flags=re.IGNORECASE)
+        cleaned = _MERIDIEM_RE.sub(lambda m: f"{m.group(1)} {m.group(2).upper()}M", cleaned)
+        cleaned = " ".join(cleaned.split())
+        for fmt in _FORMATS:
+            try:
+                parsed = datetime.strptime(cleaned, fmt)
+                break
+            except ValueError:
+                continue
+        else:
+            raise ValueError(f"{field} must be a date and time, {APPOINTMENT_FORMAT_HINT}") from None
+    if utc:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+def parse_appointment(value, tz=timezone.utc, field="appointment_datetime"):
+    # Aware UTC datetime, or None for an empty value. Raises ValueError
+    # naming `field`.
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, date):
+        parsed = datetime.combine(value, time())
+    else:
+        text = str(value).strip()
+        if not text:
+            return None
+        parsed = _parse_text(text, field)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=tz)
+    return parsed.astimezone(timezone.utc)
@@ -0,0 +1,430 @@
+"""Throughput and latency benchmark for every API endpoint.
+
+Seeds a scratch database (benchmarks/seed.py), then drives each endpoint in
+turn through the Flask test client (in-process: handler cost without a
+server) and/or a real gunicorn server hit by concurrent HTTP clients.
+Reports requests/second, p50/p95/p99 latency and peak RSS per mode, and
+compares them with a stored baseline: an endpoint whose median latency or
+throughput is worse than the baseline by more than --tolerance, whose p95
+is worse by more than --p95-tolerance, or that starts returning errors
+fails the run.
+Notification providers are in-process fakes (NOTIFICATION_FAKE_PROVIDERS).
+
+    python benchmarks/api.py                          # both modes, SQLite
+    python benchmarks/api.py --mode gunicorn --concurrency 16 --workers 2
+    python benchmarks/api.py --database-url postgresql://.../bench_scratch
+    python benchmarks/api.py --update-baseline        # after a deliberate change
+
+Baselines are only comparable on the machine that recorded them; record a
+fresh one (--update-baseline) before comparing on a new machine.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+sys.path.insert(0, BENCH_DIR)
+
+from seed import PASSWORD, seed  # noqa: E402
+
+# ---------- endpoint scenarios ----------
+# Each takes (client state, request number) and returns (method, path, kwargs).
+# `after` sees the decoded JSON body of successful responses.
+
+def _csv_batch():
+    # Fresh addresses each time: repeats would be rejected as duplicates
+    run = uuid.uuid4().hex[:12]
+    return "full_name,city,email\n" + "".join(f"Import {i},Austin,import{i}.{run}@example.com\n" for i in range(20))
+
+def _lead(ctx, i):
+    return ctx.lead_ids[i % len(ctx.lead_ids)]
+
+def _month_from(i):
+    # Seeded appointments fall in the past year and the next two months
+    return (date.today() - timedelta(days=30 * (i % 4))).isoformat()
+
+def _remember_created(ctx, body):
+    ctx.created.append(body["id"])
+
+SCENARIOS = [
+    ("health", lambda ctx, i: ("GET", "/api/health", {}), None),
+    ("login", lambda ctx, i: ("POST", "/api/auth/login", {"json": {"email": ctx.email, "password": PASSWORD}}), None),
+    ("list_leads_page", lambda ctx, i: ("GET", "/api/leads?limit=50", {}), None),
+    ("list_leads_all", lambda ctx, i: ("GET", "/api/leads", {}), None),
+    ("list_leads_stream", lambda ctx, i: ("GET", "/api/leads?stream=1&fields=id,full_name,stage", {}), None),
+    ("list_leads_since", lambda ctx, i: ("GET", "/api/leads?since=2000-01-01T00:00:00", {}), None),
+    ("get_lead", lambda ctx, i: ("GET", f"/api/leads/{_lead(ctx, i)}", {}), None),
+    ("list_appointments", lambda ctx, i: ("GET", f"/api/appointments?from={_month_from(i)}", {}), None),
+    ("dashboard", lambda ctx, i: ("GET", "/api/dashboard", {}), None),
+    ("analytics_funnel", lambda ctx, i: ("GET", f"/api/analytics/funnel?period={['month', 'week', 'day'][i % 3]}", {}), None),
+    ("search", lambda ctx, i: ("GET", f"/api/search?q={['gar', 'copper', 'austin', 'main st'][i % 4]}", {}), None),
+    ("list_notifications", lambda ctx, i: ("GET", "/api/notifications", {}), None),
+    ("lead_duplicates", lambda ctx, i: ("GET", "/api/leads/duplicates", {}), None),
+    ("create_lead", lambda ctx, i: ("POST", "/api/leads", {"json": {
+        "full_name": f"Bench Lead {i}", "email": f"bench.lead{i}.{uuid.uuid4().hex[:12]}@example.com", "city": "Austin",
+        "estimated_value": 1200,
+    }}), _remember_created),
+    ("update_lead", lambda ctx, i: ("PUT", f"/api/leads/{_lead(ctx, i)}", {"json": {
+        "stage": ["Contacted", "Booked", "Estimate Sent"][i % 3], "estimated_value": 1000 + i,
+    }}), None),
+    ("add_note", lambda ctx, i: ("POST", f"/api/leads/{_lead(ctx, i)}/notes", {"json": {
+        "note_text": f"Benchmark note {i} about the copper gutters",
+    }}), None),
+    ("bulk_update_leads", lambda ctx, i: ("PATCH", "/api/leads", {"json": {
+        "ids": [_lead(ctx, i + k) for k in range(10)], "changes": {"stage": ["New", "Contacted"][i % 2]},
+    }}), None),
+    ("bulk_import_leads", lambda ctx, i: ("POST", "/api/leads/bulk", {
+        "data": _csv_batch().encode(), "headers": {"Content-Type": "text/csv"},
+    }), None),
+    ("send_notification", lambda ctx, i: ("POST", "/api/notifications/send", {"json": {
+        "channel": "email", "to_value": "customer@example.com", "message": f"Benchmark {i}",
+    }}), None),
+    ("delete_lead", lambda ctx, i: ("DELETE", f"/api/leads/{ctx.created.pop()}", {}), None),
+    ("register", lambda ctx, i: ("POST", "/api/auth/register", {"json": {
+        "name": "Bench", "email": f"bench-{uuid.uuid4().hex}@example.com", "password": PASSWORD,
+    }}), None),
+]
+
+class ClientState:
+    def __init__(self, email):
+        self.email = email
+        self.token = None
+        self.lead_ids = []
+        self.created = []
+
+# ---------- transports ----------
+
+class TestClientTransport:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, token, json=None, data=None, headers=None):
+        headers = dict(headers or {})
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        resp = self.client.open(path, method=method, json=json, data=data, headers=headers)
+        body = resp.get_data()
+        # Like a WSGI server would: ends a streamed response's request context
+        # and hands its database connection back to the pool
+        resp.close()
+        return resp.status_code, body
+
+class HttpTransport:
+    def __init__(self, base_url):
+        import requests
+
+        self.base_url = base_url
+        self.session = requests.Session()
+
+    def request(self, method, path, token, json=None, data=None, headers=None):
+        headers = dict(headers or {})
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        resp = self.session.request(method, self.base_url + path, json=json, data=data, headers=headers, timeout=60)
+        return resp.status_code, resp.content
+
+# ---------- measurement ----------
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def run_endpoint(name, make_request, after, clients, transports, total):
+    # Splits `total` requests over the clients, each on its own thread
+    share, extra = divmod(total, len(clients))
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client_loop(n):
+        ctx, transport = clients[n], transports[n]
+        local, local_errors = [], []
+        for i in range(share + (n < extra)):
+            method, path, kwargs = make_request(ctx, i * len(clients) + n)
+            start = time.perf_counter()
+            status, body = transport.request(method, path, ctx.token, **kwargs)
+            local.append(time.perf_counter() - start)
+            if status >= 400:
+                local_errors.append(status)
+            elif after is not None:
+                after(ctx, json.loads(body))
+        with lock:
+            latencies.extend(local)
+            errors.extend(local_errors)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(len(clients)) as pool:
+        list(pool.map(client_loop, range(len(clients))))
+    wall = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": round(len(latencies) / wall, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+def prepare_clients(emails, transports):
+    clients = []
+    for n, transport in enumerate(transports):
+        ctx = ClientState(emails[n % len(emails)])
+        status, body = transport.request("POST", "/api/auth/login", None, json={"email": ctx.email, "password": PASSWORD})
+        if status != 200:
+            raise RuntimeError(f"Login failed for {ctx.email}: {status}")
+        ctx.token = json.loads(body)["access_token"]
+        status, body = transport.request("GET", "/api/leads?fields=id&limit=200", ctx.token)
+        ctx.lead_ids = [row["id"] for row in json.loads(body)]
+        clients.append(ctx)
+    return clients
+
+def best_of(rounds):
+    # Each metric's best value over the rounds: noise only ever makes a round
+    # look slower, so the best is the most repeatable figure
+    best = dict(rounds[0])
+    for stats in rounds[1:]:
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            best[key] = min(best[key], stats[key])
+        best["rps"] = max(best["rps"], stats["rps"])
+        best["errors"] = max(best["errors"], stats["errors"])
+    return best
+
+def run_scenarios(transports, emails, requests_per_endpoint, rounds=1, only=None):
+    clients = prepare_clients(emails, transports)
+    measured = {}
+    for round_number in range(1, rounds + 1):
+        for name, make_request, after in SCENARIOS:
+            if only and name not in only:
+                continue
+            # delete_lead removes what create_lead made, so it never runs dry
+            total = requests_per_endpoint
+            if name == "delete_lead":
+                total = min(total, min(len(c.created) for c in clients) * len(clients))
+                if not total:
+                    continue
+            stats = run_endpoint(name, make_request, after, clients, transports, total)
+            measured.setdefault(name, []).append(stats)
+            print(f"  [{round_number}/{rounds}] {name:<20} {json.dumps(stats)}", file=sys.stderr)
+    return {name: best_of(stats) for name, stats in measured.items()}
+
+# ---------- modes ----------
+
+def bench_testclient(database_url, emails, args):
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["NOTIFICATION_WORKER"] = "off"
+    sys.path.insert(0, BACKEND_DIR)
+    from app import create_app
+
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": database_url,
+        "NOTIFICATION_WORKER": "thread",
+        "NOTIFICATION_FAKE_PROVIDERS": True,
+        "NOTIFICATION_FAKE_LATENCY_MS": args.provider_latency_ms,
+        "RESPONSE_CACHE": "off" if args.no_cache else "memory",
+        # Every scenario logs in from one address as the same few users
+        "RATE_LIMIT_STORE": "off",
+    })
+    transports = [TestClientTransport(app) for _ in range(args.testclient_concurrency)]
+    results = run_scenarios(transports, emails, args.requests, args.rounds, args.only)
+    app.extensions["notification_worker"].stop(timeout=5)
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    scale = 1024 if sys.platform != "darwin" else 1
+    return {"endpoints": results, "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20, 1)}
+
+def _tree_rss(pid):
+    # RSS of a process and its descendants from /proc (Linux); None elsewhere
+    total = 0
+    stack = [pid]
+    while stack:
+        p = stack.pop()
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+            with open(f"/proc/{p}/task/{p}/children") as f:
+                stack.extend(int(c) for c in f.read().split())
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            if p == pid:
+                return None
+    return total
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def bench_gunicorn(database_url, emails, args):
+    port = _free_port()
+    env = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        NOTIFICATION_WORKER="thread",
+        NOTIFICATION_FAKE_PROVIDERS="1",
+        NOTIFICATION_FAKE_LATENCY_MS=str(args.provider_latency_ms),
+        RESPONSE_CACHE="off" if args.no_cache else "memory",
+        RATE_LIMIT_STORE="off",
+    )
+    # gunicorn.conf.py defaults to gthread; the baseline was taken with sync
+    # workers (benchmarks/concurrency.py compares the worker classes)
+    env.setdefault("GUNICORN_WORKER_CLASS", "sync")
+    cmd = [sys.executable, "-m", "gunicorn", "app:app", "--bind", f"127.0.0.1:{port}",
+           "--workers", str(args.workers), *args.gunicorn_arg]
+    # gunicorn logs to a file: an unread pipe would fill up and stall the workers
+    log = tempfile.TemporaryFile()
+    server = subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    peak = [0]
+    stop = threading.Event()
+
+    def sample_rss():
+        while not stop.is_set():
+            rss = _tree_rss(server.pid)
+            if rss:
+                peak[0] = max(peak[0], rss)
+            stop.wait(0.1)
+
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    sampler.start()
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=1):
+                    break
+            except OSError:
+                if server.poll() is not None or time.monotonic() > deadline:
+                    log.seek(0)
+                    raise RuntimeError("gunicorn did not start:\n" + log.read().decode(errors="replace"))
+                time.sleep(0.1)
+        transports = [HttpTransport(base_url) for _ in range(args.concurrency)]
+        results = run_scenarios(transports, emails, args.requests, args.rounds, args.only)
+    finally:
+        stop.set()
+        server.terminate()
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+        log.close()
+    return {"endpoints": results, "peak_rss_mb": round(peak[0] / 2**20, 1) if peak[0] else None}
+
+# ---------- baseline ----------
+
+def compare(report, baseline, tolerance, p95_tolerance):
+    # Returns human-readable regressions
+    problems = []
+    ignored = ("mode", "only", "tolerance", "p95_tolerance")
+    ours = {k: v for k, v in report["config"].items() if k not in ignored}
+    theirs = {k: v for k, v in baseline.get("config", {}).items() if k not in ignored}
+    if ours != theirs:
+        problems.append(f"run settings differ from the baseline's: {theirs}")
+    for mode, result in report["modes"].items():
+        base = baseline.get("modes", {}).get(mode)
+        if not base:
+            continue
+        for name, stats in result["endpoints"].items():
+            old = base["endpoints"].get(name)
+            if not old:
+                continue
+            if stats["errors"] > old.get("errors", 0):
+                problems.append(f"{mode} {name}: {stats['errors']} errors (baseline {old.get('errors', 0)})")
+            if stats["p50_ms"] > old["p50_ms"] * (1 + tolerance):
+                problems.append(f"{mode} {name}: p50 {stats['p50_ms']} ms vs {old['p50_ms']} ms")
+            if stats["p95_ms"] > old["p95_ms"] * (1 + p95_tolerance):
+                problems.append(f"{mode} {name}: p95 {stats['p95_ms']} ms vs {old['p95_ms']} ms")
+            if stats["rps"] < old["rps"] * (1 - tolerance):
+                problems.append(f"{mode} {name}: {stats['rps']} req/s vs {old['rps']} req/s")
+        if result.get("peak_rss_mb") and base.get("peak_rss_mb") and result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            problems.append(f"{mode}: peak RSS {result['peak_rss_mb']} MB vs {base['peak_rss_mb']} MB")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["testclient", "gunicorn", "both"], default="both")
+    parser.add_argument("--database-url", default=None,
+                        help="Empty scratch database (e.g. Postgres); default is a temporary SQLite file.")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--leads", type=int, default=200, help="Leads per user.")
+    parser.add_argument("--notes", type=int, default=2, help="Notes per lead.")
+    parser.add_argument("--notifications", type=int, default=20, help="Notifications per user.")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per endpoint.")
+    parser.add_argument("--rounds", type=int, default=3, help="Runs of every endpoint; the best of each metric counts.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent HTTP clients against gunicorn.")
+    parser.add_argument("--testclient-concurrency", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes.")
+    parser.add_argument("--gunicorn-arg", action="append", default=[], help="Extra gunicorn argument (repeatable).")
+    parser.add_argument("--provider-latency-ms", type=float, default=0, help="Simulated provider round trip.")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the response cache.")
+    parser.add_argument("--only", action="append", help="Only this endpoint scenario (repeatable).")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.3,
+                        help="Allowed p50 slowdown / throughput drop before failing (0.3 = 30%%).")
+    parser.add_argument("--p95-tolerance", type=float, default=1.0,
+                        help="Allowed p95 slowdown; tails are noisier, especially SQLite writes across workers.")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--output", help="Also write the report to this file.")
+    args = parser.parse_args()
+
+    modes = ["testclient", "gunicorn"] if args.mode == "both" else [args.mode]
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("baseline", "output", "update_baseline")},
+        "machine": {"cpus": os.cpu_count(), "python": platform.python_version(), "platform": platform.platform()},
+        "modes": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in modes:
+            # A fresh database per mode so writes in one don't skew the other
+            url = args.database_url or f"sqlite:///{os.path.join(tmp, f'{mode}.db')}"
+            print(f"Seeding {url} ...", file=sys.stderr)
+            emails = seed(url, args.users, args.leads, args.notes, args.notifications)
+            print(f"Running {mode} ...", file=sys.stderr)
+            runner = bench_testclient if mode == "testclient" else bench_gunicorn
+            report["modes"][mode] = runner(url, emails, args)
+            if args.database_url and len(modes) > 1 and mode != modes[-1]:
+                print("Reusing --database-url for the next mode: reset it between modes for clean numbers.",
+                      file=sys.stderr)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+        return
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare against; run with --update-baseline to record one.", file=sys.stderr)
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("machine") != report["machine"]:
+        print(f"Warning: the baseline was recorded on {baseline.get('machine')}; numbers may not be comparable.",
+              file=sys.stderr)
+    problems = compare(report, baseline, args.tolerance, args.p95_tolerance)
+    for problem in problems:
+        print(f"REGRESSION {problem}", file=sys.stderr)
+    if problems:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
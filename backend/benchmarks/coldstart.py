@@ -0,0 +1,67 @@
+"""Cold-start budget for a gunicorn worker booting `app:app`.
+
+Boots the app in fresh interpreters against a throwaway SQLite database and
+reports how long `import app` takes (module imports plus create_app()), and
+how much of that is create_app() alone. Exits non-zero when the median
+import time is over budget.
+
+    python benchmarks/coldstart.py --runs 7 --budget-ms 1500
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+app.create_app()
+t2 = time.perf_counter()
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "create_app_ms": (t2 - t1) * 1000}))
+"""
+
+def boot_once(env):
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=BACKEND_DIR, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("COLDSTART_BUDGET_MS", "1500")))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'coldstart.db')}",
+            NOTIFICATION_WORKER="off",
+        )
+        # First boot creates the schema; gunicorn workers boot against an existing one
+        first = boot_once(env)
+        runs = [boot_once(env) for _ in range(args.runs)]
+
+    imports = [r["import_ms"] for r in runs]
+    create = [r["create_app_ms"] for r in runs]
+    report = {
+        "first_boot_ms": round(first["import_ms"], 1),
+        "import_ms_median": round(statistics.median(imports), 1),
+        "import_ms_max": round(max(imports), 1),
+        "create_app_ms_median": round(statistics.median(create), 1),
+        "budget_ms": args.budget_ms,
+    }
+    print(json.dumps(report, indent=2))
+    if report["import_ms_median"] > args.budget_ms:
+        print(f"Cold start over budget: {report['import_ms_median']} ms > {args.budget_ms} ms", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Throughput at high client concurrency under each gunicorn worker class.
+
+Seeds a fresh SQLite file per worker class, then drives the lead,
+notification and dashboard endpoints of benchmarks/api.py through gunicorn
+with 200 concurrent clients: once with sync workers (one request at a time
+per process) and once per other class in --worker-classes (gunicorn.conf.py).
+Every SQL statement waits --db-latency-ms first (DATABASE_FAKE_LATENCY_MS,
+like a database on another host) and the fake email/SMS providers take
+--provider-latency-ms per send, so requests spend most of their time waiting
+rather than computing. The response cache is off unless --cache is given, so
+every read reaches the database. Prints a side-by-side table of
+requests/second, p95 latency and errors, and the full reports as JSON.
+
+    python benchmarks/concurrency.py
+    python benchmarks/concurrency.py --threads 16
+    python benchmarks/concurrency.py --database-url postgresql://.../bench_scratch --worker-classes sync,gthread,gevent
+
+gevent only makes sense on Postgres (see gunicorn.conf.py): against SQLite
+with a fake latency, a greenlet sleeps while holding the write lock and the
+other greenlets' SQLite lock waits then block its event loop.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from api import bench_gunicorn  # noqa: E402
+from seed import seed  # noqa: E402
+
+IO_SCENARIOS = [
+    "list_leads_page", "get_lead", "dashboard", "list_notifications",
+    "create_lead", "update_lead", "add_note", "send_notification",
+]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--worker-classes", default="sync,gthread",
+                        help="gunicorn worker classes to compare, in order (gevent needs `pip install gevent` "
+                             "and Postgres).")
+    parser.add_argument("--database-url", default=None,
+                        help="Empty scratch database (e.g. Postgres), reused by every worker class; default is a "
+                             "fresh temporary SQLite file per class.")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--leads", type=int, default=200, help="Leads per user.")
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per endpoint.")
+    parser.add_argument("--rounds", type=int, default=1, help="Runs of every endpoint; the best of each metric counts.")
+    parser.add_argument("--concurrency", type=int, default=200, help="Concurrent HTTP clients.")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes.")
+    parser.add_argument("--threads", type=int, default=8, help="Threads per gthread worker.")
+    parser.add_argument("--db-latency-ms", type=float, default=2, help="Simulated database round trip per statement.")
+    parser.add_argument("--provider-latency-ms", type=float, default=250, help="Simulated provider round trip.")
+    parser.add_argument("--cache", action="store_true", help="Keep the response cache on.")
+    parser.add_argument("--gunicorn-arg", action="append", default=[], help="Extra gunicorn argument (repeatable).")
+    parser.add_argument("--output", help="Also write the reports to this file.")
+    args = parser.parse_args()
+    # What bench_gunicorn reads besides the above
+    args.only = IO_SCENARIOS
+    args.no_cache = not args.cache
+
+    classes = [c.strip() for c in args.worker_classes.split(",") if c.strip()]
+    reports = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for worker_class in classes:
+            url = args.database_url or f"sqlite:///{os.path.join(tmp, f'{worker_class}.db')}"
+            print(f"Seeding {url} ...", file=sys.stderr)
+            emails = seed(url, args.users, args.leads, 1, 5)
+            print(f"Running {worker_class} workers ...", file=sys.stderr)
+            # Read by gunicorn.conf.py and the app in the server process
+            os.environ.update(
+                GUNICORN_WORKER_CLASS=worker_class,
+                GUNICORN_THREADS=str(args.threads),
+                DATABASE_FAKE_LATENCY_MS=str(args.db_latency_ms),
+            )
+            reports[worker_class] = bench_gunicorn(url, emails, args)["endpoints"]
+
+    print(f"{'endpoint':<20}" + "".join(f"{c + ' req/s':>16}{'p95 ms':>10}{'errors':>8}" for c in classes))
+    for name in IO_SCENARIOS:
+        row = f"{name:<20}"
+        for worker_class in classes:
+            stats = reports[worker_class].get(name)
+            row += f"{stats['rps']:>16}{stats['p95_ms']:>10}{stats['errors']:>8}" if stats else f"{'-':>34}"
+        print(row)
+    output = json.dumps({"config": vars(args), "worker_classes": reports}, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""Seed a benchmark database with users, leads, notes and notifications.
+
+Rows go in with batched executemany INSERTs rather than through the API, then
+the search index, pipeline rollups, notification counters and funnel
+buckets are rebuilt from the tables, the same way `flask
+rebuild-search-index` / `rebuild-rollups` / `rebuild-notification-counts` /
+`rebuild-funnel` do. Each lead gets a stage history that walks the pipeline
+from New to its stage. Every user gets the password "benchmark".
+
+    python benchmarks/seed.py --database-url sqlite:////tmp/bench.db --users 20 --leads 500
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "benchmark"
+
+FIRST = ["Ana", "Ben", "Carla", "Dev", "Eli", "Fay", "Gus", "Hana", "Ivan", "Jo", "Kai", "Lena", "Mo", "Nia"]
+LAST = ["Garcia", "Nguyen", "Smith", "Okafor", "Patel", "Kowalski", "Lee", "Haddad", "Rossi", "Brown"]
+CITIES = ["Austin", "Dallas", "Houston", "San Antonio", "El Paso", "Waco", "Round Rock"]
+NOTES = [
+    "Called, left voicemail about the gutter quote",
+    "Wants a copper gutter estimate before spring",
+    "Asked for financing options on the roof repair",
+    "Follow up next week about the fence install",
+    "Sent photos of the water damage in the attic",
+]
+
+def seed(database_url, users=10, leads=200, notes=2, notifications=20, seed_value=42, batch_size=2000,
+         app_config=None):
+    # Returns the seeded users' emails. Expects an empty database.
+    # app_config: extra create_app() settings, e.g. the DATABASE_PROFILE under test.
+    # Importing app also builds the module-level app from the environment;
+    # point it at the benchmark database too, without a dispatcher thread
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["NOTIFICATION_WORKER"] = "off"
+    sys.path.insert(0, BACKEND_DIR)
+
+    from analytics import rebuild_funnel, stage_event
+    from app import STAGES, create_app
+    from dedupe import contact_keys
+    from models import db, User, Lead, LeadStageEvent, Note, Notification
+    from notification_log import rebuild_notification_counts
+    from rollups import rebuild_rollups
+    from schema import upgrade_schema
+    from search import rebuild_search_index
+
+    rng = random.Random(seed_value)
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": database_url, "NOTIFICATION_WORKER": "off", "RESPONSE_CACHE": "off",
+        **(app_config or {}),
+    })
+    with app.app_context():
+        upgrade_schema()
+    # One hash for everyone: hashing is deliberately slow. Made with the
+    # configured method so benchmark logins never trigger a rehash.
+    password_hash = app.extensions["password_hasher"].hash(PASSWORD)
+    now = datetime.utcnow()
+
+    def insert(model, rows):
+        for start in range(0, len(rows), batch_size):
+            db.session.execute(db.insert(model), rows[start:start + batch_size])
+
+    with app.app_context():
+        emails = [f"bench{u}@example.com" for u in range(users)]
+        insert(User, [
+            {"name": f"Bench User {u}", "email": email, "password_hash": password_hash, "created_at": now}
+            for u, email in enumerate(emails)
+        ])
+        user_ids = db.session.execute(db.select(User.id).where(User.email.in_(emails)).order_by(User.id)).scalars().all()
+
+        lead_rows = []
+        for uid in user_ids:
+            for i in range(leads):
+                created = now - timedelta(minutes=rng.randrange(0, 60 * 24 * 365))
+                appointment = created + timedelta(days=rng.randrange(1, 60), hours=rng.randrange(8, 18))
+                first, last = rng.choice(FIRST), rng.choice(LAST)
+                lead_rows.append({
+                    "user_id": uid,
+                    "full_name": f"{first} {last}",
+                    "phone": f"512-555-{rng.randrange(10000):04d}",
+                    "email": f"{first.lower()}.{last.lower()}{i}@example.com",
+                    "address": f"{rng.randrange(100, 9999)} Main St",
+                    "city": rng.choice(CITIES),
+                    "state": "TX",
+                    "stage": rng.choice(STAGES),
+                    "estimated_value": float(rng.randrange(500, 50000)),
+                    "appointment_datetime": appointment.replace(second=0, microsecond=0)
+                    if rng.random() < 0.3 else None,
+                    "created_at": created,
+                    "updated_at": created,
+                })
+                lead_rows[-1].update(contact_keys(lead_rows[-1], app.config["LEAD_PHONE_COUNTRY_CODE"]))
+        insert(Lead, lead_rows)
+        leads_by_user = {}
+        event_rows = []
+        entered = []
+        for lead in db.session.execute(db.select(Lead.id, Lead.user_id, Lead.stage, Lead.estimated_value, Lead.created_at)):
+            leads_by_user.setdefault(lead.user_id, []).append(lead.id)
+            events = stage_history(rng, lead, STAGES, now, stage_event)
+            event_rows.extend(events)
+            entered.append({"lead_id": lead.id, "entered": events[-1]["occurred_at"]})
+        insert(LeadStageEvent, event_rows)
+        db.session.execute(
+            db.update(Lead.__table__)
+            .where(Lead.__table__.c.id == db.bindparam("lead_id"))
+            .values(stage_changed_at=db.bindparam("entered")),
+            entered,
+        )
+
+        note_rows = []
+        notification_rows = []
+        for uid, lead_ids in leads_by_user.items():
+            for lead_id in lead_ids:
+                for _ in range(notes):
+                    note_rows.append({"lead_id": lead_id, "user_id": uid, "note_text": rng.choice(NOTES),
+                                      "created_at": now - timedelta(minutes=rng.randrange(0, 60 * 24 * 90))})
+            for _ in range(notifications):
+                notification_rows.append({
+                    "user_id": uid, "lead_id": rng.choice(lead_ids), "channel": "email",
+                    "to_value": "customer@example.com", "subject": "Appointment booked",
+                    "message": "Your appointment has been booked.", "status": "sent", "attempts": 1,
+                    "provider_response": "Fake email", "created_at": now - timedelta(minutes=rng.randrange(0, 60 * 24 * 90)),
+                })
+        insert(Note, note_rows)
+        insert(Notification, notification_rows)
+        db.session.commit()
+
+        rebuild_search_index()
+        db.session.commit()
+        rebuild_rollups()
+        rebuild_notification_counts()
+        rebuild_funnel()
+        db.engine.dispose()
+    return emails
+
+def stage_history(rng, lead, stages, now, stage_event):
+    # Events taking `lead` from New through the pipeline to its stage; Closed
+    # Lost leads drop out after a random number of steps
+    pipeline = [s for s in stages if s != "Closed Lost"]
+    if lead.stage == "Closed Lost":
+        path = pipeline[:rng.randrange(1, len(pipeline))] + [lead.stage]
+    else:
+        path = pipeline[:pipeline.index(lead.stage) + 1]
+    at = lead.created_at
+    events = [stage_event(lead.user_id, lead.id, None, path[0], lead.estimated_value, None, at)]
+    for previous, stage in zip(path, path[1:]):
+        entered_at = at
+        at = min(now, at + timedelta(hours=rng.randrange(1, 24 * 21)))
+        events.append(stage_event(lead.user_id, lead.id, previous, stage, lead.estimated_value, entered_at, at))
+    return events
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", required=True, help="An empty scratch database.")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--leads", type=int, default=200, help="Leads per user.")
+    parser.add_argument("--notes", type=int, default=2, help="Notes per lead.")
+    parser.add_argument("--notifications", type=int, default=20, help="Notifications per user.")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    emails = seed(args.database_url, args.users, args.leads, args.notes, args.notifications, args.seed)
+    print(f"Seeded {len(emails)} user(s); log in as {emails[0]} / {PASSWORD}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Serialization microbenchmark: time per 1k rows to build and encode a list response.
+
+Compares the old path (a dict per row with .isoformat() on every
+datetime, encoded by Flask's stdlib JSON provider) with serializers.py (one
+dict(zip()) per row, datetimes left to FastJSONProvider), on synthetic lead
+and notification rows shaped like the column-only query results. Also checks
+that both produce the same response bytes, and times FastJSONProvider
+without orjson (the stdlib fallback).
+
+    python benchmarks/serialization.py --rows 10000 --repeat 20
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+import serializers  # noqa: E402
+from serializers import (  # noqa: E402
+    LEAD_FIELDS, NOTIFICATION_FIELDS, FastJSONProvider, serialize_lead_rows, serialize_notification_rows,
+)
+
+def legacy_rows(rows, fields, datetime_fields):
+    # The serializers as they were: a field-by-field dict with a datetime check per value
+    out = []
+    for row in rows:
+        obj = {}
+        for field, value in zip(fields, row):
+            if field in datetime_fields and value is not None:
+                value = value.isoformat()
+            obj[field] = value
+        out.append(obj)
+    return out
+
+def lead_rows(n, rng):
+    now = datetime(2026, 1, 1)
+    names = ["Ana Garcia", "Ben Nguyen", "José Núñez", "Carla Smith", "Dev Patel"]
+    return [
+        (i, rng.choice(names), f"512-555-{rng.randrange(10000):04d}", f"lead{i}@example.com",
+         f"{rng.randrange(100, 9999)} Main St", "Austin", "TX", "New", float(rng.randrange(500, 50000)),
+         None if i % 3 else "2026-02-01T10:00", now - timedelta(minutes=i), now, now - timedelta(minutes=i), i)
+        for i in range(n)
+    ]
+
+def notification_rows(n, rng):
+    now = datetime(2026, 1, 1)
+    return [
+        (i, i, "email", "customer@example.com", "Appointment booked", "Your appointment has been booked.",
+         "sent", f"Email sent id=SM{rng.getrandbits(64):016x}", now - timedelta(minutes=i))
+        for i in range(n)
+    ]
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    app = Flask(__name__)
+    stdlib, fast = DefaultJSONProvider(app), FastJSONProvider(app)
+    cases = [
+        ("leads", lead_rows(args.rows, rng), LEAD_FIELDS, {"created_at", "updated_at"}, serialize_lead_rows),
+        ("notifications", notification_rows(args.rows, rng), NOTIFICATION_FIELDS, {"created_at"},
+         serialize_notification_rows),
+    ]
+    per_1k = 1000 / args.rows * 1e6  # seconds for all rows -> microseconds per 1k rows
+    orjson = serializers.orjson
+    print(f"{'':<14}{'build µs':>10}{'encode µs':>11}{'total µs':>10}  per 1k rows")
+    with app.app_context():
+        for name, rows, fields, datetime_fields, serialize in cases:
+            old_objs = legacy_rows(rows, fields, datetime_fields)
+            new_objs = serialize(rows)
+            old_body = stdlib.response(old_objs).get_data()
+            if fast.response(new_objs).get_data() != old_body:
+                sys.exit(f"{name}: FastJSONProvider output differs from the stdlib provider")
+
+            build_old = timed(lambda: legacy_rows(rows, fields, datetime_fields), args.repeat)
+            build_new = timed(lambda: serialize(rows), args.repeat)
+            encode_old = timed(lambda: stdlib.response(old_objs), args.repeat)
+            encode_new = timed(lambda: fast.response(new_objs), args.repeat)
+            serializers.orjson = None
+            try:
+                encode_fallback = timed(lambda: fast.response(new_objs), args.repeat)
+            finally:
+                serializers.orjson = orjson
+
+            old_total, new_total = build_old + encode_old, build_new + encode_new
+            for label, build, encode in (("before", build_old, encode_old), ("after", build_new, encode_new)):
+                print(f"{name + ' ' + label:<14}{build * per_1k:>10.0f}{encode * per_1k:>11.0f}"
+                      f"{(build + encode) * per_1k:>10.0f}")
+            print(f"{name + ' no orjson':<14}{build_new * per_1k:>10.0f}{encode_fallback * per_1k:>11.0f}"
+                  f"{(build_new + encode_fallback) * per_1k:>10.0f}")
+            print(f"{name}: {old_total / new_total:.1f}x faster, identical {len(old_body)}-byte body\n")
+    if orjson is None:
+        print("orjson is not installed; 'after' used the stdlib fallback.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Concurrent write throughput under each database engine profile.
+
+Seeds a fresh SQLite file per profile, then drives the write endpoints of
+benchmarks/api.py through gunicorn with several workers and concurrent
+clients, once with DATABASE_PROFILE=none (rollback journal, synchronous=FULL,
+the driver's lock wait) and once with the tuned profile (WAL,
+synchronous=NORMAL, busy timeout; see engine.py). Prints a side-by-side
+table of requests/second, p95 latency and errors (a "database is locked"
+failure is a 500), and the full reports as JSON.
+
+    python benchmarks/writes.py
+    python benchmarks/writes.py --workers 4 --concurrency 32 --requests 400
+    python benchmarks/writes.py --database-url postgresql://.../bench_scratch --profiles none,auto
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from api import bench_gunicorn  # noqa: E402
+from seed import seed  # noqa: E402
+
+WRITE_SCENARIOS = ["create_lead", "update_lead", "add_note", "bulk_update_leads", "send_notification", "delete_lead"]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", default="none,auto", help="DATABASE_PROFILE values to compare, in order.")
+    parser.add_argument("--database-url", default=None,
+                        help="Empty scratch database (e.g. Postgres), reused by every profile; default is a "
+                             "fresh temporary SQLite file per profile.")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--leads", type=int, default=200, help="Leads per user.")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint.")
+    parser.add_argument("--rounds", type=int, default=2, help="Runs of every endpoint; the best of each metric counts.")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent HTTP clients.")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn worker processes.")
+    parser.add_argument("--gunicorn-arg", action="append", default=[], help="Extra gunicorn argument (repeatable).")
+    parser.add_argument("--output", help="Also write the reports to this file.")
+    args = parser.parse_args()
+    # What bench_gunicorn reads besides the above
+    args.only = WRITE_SCENARIOS
+    args.provider_latency_ms = 0
+    args.no_cache = False
+
+    profiles = [p.strip() for p in args.profiles.split(",") if p.strip()]
+    reports = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for profile in profiles:
+            url = args.database_url or f"sqlite:///{os.path.join(tmp, f'{profile}.db')}"
+            print(f"Seeding {url} ...", file=sys.stderr)
+            # Seeded under the profile too: SQLite keeps WAL mode in the file
+            emails = seed(url, args.users, args.leads, 1, 5, app_config={"DATABASE_PROFILE": profile})
+            print(f"Running DATABASE_PROFILE={profile} ...", file=sys.stderr)
+            os.environ["DATABASE_PROFILE"] = profile
+            reports[profile] = bench_gunicorn(url, emails, args)["endpoints"]
+
+    print(f"{'endpoint':<20}" + "".join(f"{p + ' req/s':>16}{'p95 ms':>10}{'errors':>8}" for p in profiles))
+    for name in WRITE_SCENARIOS:
+        row = f"{name:<20}"
+        for profile in profiles:
+            stats = reports[profile].get(name)
+            row += f"{stats['rps']:>16}{stats['p95_ms']:>10}{stats['errors']:>8}" if stats else f"{'-':>34}"
+        print(row)
+    output = json.dumps({"config": vars(args), "profiles": reports}, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import functools
+import json
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from flask import Response, current_app, g, request
+from flask_jwt_extended import get_jwt_identity
+
+from versions import current_version
+
+# Per-user cache of serialized GET responses.
+#
+# Every entry's key embeds the user's current DataVersion for the data the
+# view reads (versions.py), e.g. "leads" or "notifications", plus the URL and
+# query string. A committed write bumps that version in the database, so the
+# next request in any process looks up a new key and stale entries simply age
+# out through the LRU/TTL. Nothing has to be invalidated, which is what keeps
+# a per-process memory cache correct under several gunicorn workers: each
+# worker may miss where another one already cached, but none can serve a body
+# older than the version it read.
+#
+# The version is read before the view's queries (in the same request), so a
+# cached body is never older than the version in its key.
+
+class MemoryCacheBackend:
+    """In-process LRU with per-entry TTL, capped by the bytes it holds.
+    Also the stand-in for a shared backend in tests and benchmarks."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl=None):
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, value = self._entries.pop(key)
+        self._bytes -= len(key) + len(value)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "evictions": self.evictions}
+
+class RedisCacheBackend:
+    """Shared backend, so a response cached by one gunicorn worker is a hit
+    in every other. Redis applies its own maxmemory/LRU policy."""
+
+    def __init__(self, url: str):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key: str):
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, ttl=None):
+        self.client.set(key, value, ex=max(int(ttl), 1) if ttl else None)
+
+    def stats(self) -> dict:
+        info = self.client.info("memory")
+        return {"bytes": info.get("used_memory"), "evictions": self.client.info("stats").get("evicted_keys")}
+
+class ResponseCache:
+    def __init__(self, backend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, user_id: int, scope: str, version: int, path: str, args) -> str:
+        # args: the request's MultiDict; order and duplicates are normalised
+        params = urlencode(sorted(args.items(multi=True)))
+        return f"resp:{user_id}:{scope}:{version}:{path}?{params}"
+
+    def get(self, key: str):
+        # Returns (body, headers) or None
+        packed = self.backend.get(key)
+        with self._lock:
+            if packed is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        head, _, body = packed.partition(b"\n")
+        return body, json.loads(head)
+
+    def set(self, key: str, body: bytes, headers: dict):
+        self.backend.set(key, json.dumps(headers).encode() + b"\n" + body, self.ttl)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = {"hits": self.hits, "misses": self.misses}
+        lookups = counters["hits"] + counters["misses"]
+        counters["hit_ratio"] = round(counters["hits"] / lookups, 4) if lookups else None
+        return {**counters, **self.backend.stats()}
+
+# Response headers that are part of a cached response
+CACHED_HEADERS = ("X-Next-Cursor",)
+
+def cached_view(scope: str):
+    # Serves a GET view's 200 responses from the cache. Goes under
+    # @jwt_required() and @conditional_view(), whose version read is reused;
+    # scope is the DataVersion scope the view's response depends on.
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            cache = current_app.extensions.get("response_cache")
+            if cache is None or request.args.get("stream") in ("1", "true"):
+                return view(**kwargs)
+            uid = int(get_jwt_identity())
+            known = g.get("data_versions", {}).get(scope)
+            if known is None:
+                # No conditional_view above; replica_reads() below reuses it too
+                known = g.setdefault("data_versions", {})[scope] = current_version(uid, scope)
+            key = cache.key(uid, scope, known[0], request.path, request.args)
+            hit = cache.get(key)
+            if hit is not None:
+                body, headers = hit
+                return Response(body, mimetype="application/json", headers=headers)
+            resp = current_app.make_response(view(**kwargs))
+            if resp.status_code == 200:
+                cache.set(key, resp.get_data(), {h: resp.headers[h] for h in CACHED_HEADERS if h in resp.headers})
+            return resp
+        return wrapper
+    return decorator
+
+def build_cache(config):
+    kind = config.get("RESPONSE_CACHE", "memory")
+    if kind in ("off", "", None):
+        return None
+    if kind == "redis":
+        backend = RedisCacheBackend(config["RESPONSE_CACHE_URL"])
+    else:
+        backend = MemoryCacheBackend(config["RESPONSE_CACHE_MAX_BYTES"])
+    return ResponseCache(backend, config["RESPONSE_CACHE_TTL"])
@@ -1,9 +1,75 @@
 import os
+from datetime import timedelta
+
+def _database_url(name="DATABASE_URL", default="sqlite:///contractorconnect.db"):
+    url = os.getenv(name, default)
+    # Render/Heroku hand out postgres:// URLs, which SQLAlchemy no longer accepts
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+    return url
 
 class Config:
-    SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL", "sqlite:///contractorconnect.db")
+    SQLALCHEMY_DATABASE_URI = _database_url()
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    JWT_SECRET_KEY = os.getenv("JWT_SECRET", "change-me")
+
+    # Engine tuning (see engine.py): "auto" picks the sqlite or postgres
+    # profile from the URL, "none" keeps the driver defaults
+    DATABASE_PROFILE = os.getenv("DATABASE_PROFILE", "auto")
+    # SQLite: WAL lets reads run alongside the one writer, NORMAL syncs at
+    # checkpoints rather than every commit (a power cut can lose the last
+    # commits but not corrupt the file), and a writer waits up to
+    # BUSY_TIMEOUT_MS for the lock instead of failing with "database is locked"
+    SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "wal")
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "normal")
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+    SQLITE_MMAP_SIZE_MB = int(os.getenv("SQLITE_MMAP_SIZE_MB", "256"))
+    # Postgres: each process opens up to POOL_SIZE + MAX_OVERFLOW connections;
+    # keep gunicorn workers x that under the server's max_connections, and
+    # that at or above GUNICORN_THREADS (see gunicorn.conf.py).
+    # Timeouts are per statement / per lock wait, 0 for none.
+    DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "5"))
+    DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "5"))
+    DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "10"))
+    DATABASE_POOL_RECYCLE = int(os.getenv("DATABASE_POOL_RECYCLE", "1800"))
+    DATABASE_STATEMENT_TIMEOUT_MS = int(os.getenv("DATABASE_STATEMENT_TIMEOUT_MS", "15000"))
+    DATABASE_LOCK_TIMEOUT_MS = int(os.getenv("DATABASE_LOCK_TIMEOUT_MS", "5000"))
+    # Read replica for the lead list, dashboard and notification log. A
+    # user's reads only go there once their data is READ_MAX_LAG seconds old,
+    # so set it above the replica's worst lag (see versions.replica_reads).
+    DATABASE_READ_URL = _database_url("DATABASE_READ_URL", "")
+    DATABASE_READ_MAX_LAG = float(os.getenv("DATABASE_READ_MAX_LAG", "5"))
+    # Benchmarks only: sleep this long before every statement, like the
+    # network round trip to a database on another host
+    DATABASE_FAKE_LATENCY_MS = float(os.getenv("DATABASE_FAKE_LATENCY_MS", "0"))
+
+    # JWT_SECRET_KEY is what the Render docs ask for; JWT_SECRET is the older name
+    JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY") or os.getenv("JWT_SECRET", "change-me")
+    JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=3)
+
+    # Password hashing (see passwords.py). A werkzeug method such as
+    # "scrypt:32768:8:1" or "pbkdf2:sha256:600000"; users are rehashed with
+    # it at their next login after it changes. At most WORKERS hashes run at
+    # once and QUEUE more wait, each for up to QUEUE_TIMEOUT seconds (then 503).
+    PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt")
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+    PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "8"))
+    PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", "2"))
+
+    # Token-bucket limits on the auth endpoints (see ratelimit.py), as
+    # "<burst>/<seconds>" or "off". "memory" is per process, "redis"
+    # (RATE_LIMIT_URL) is shared by every worker, "off" disables them all.
+    RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "memory")
+    RATE_LIMIT_URL = os.getenv("RATE_LIMIT_URL", "")
+    RATE_LIMIT_LOGIN_IP = os.getenv("RATE_LIMIT_LOGIN_IP", "30/60")
+    RATE_LIMIT_LOGIN_EMAIL = os.getenv("RATE_LIMIT_LOGIN_EMAIL", "10/300")
+    RATE_LIMIT_REGISTER_IP = os.getenv("RATE_LIMIT_REGISTER_IP", "10/3600")
+    # Processes that split each "memory" limit between them; gunicorn.conf.py
+    # sets WEB_CONCURRENCY to its worker count
+    RATE_LIMIT_PROCESSES = int(os.getenv("RATE_LIMIT_PROCESSES", os.getenv("WEB_CONCURRENCY", "1")))
+    # Proxies in front of the app whose X-Forwarded-For is trusted for the
+    # client IP (1 on Render); 0 uses the socket address
+    TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", "0"))
 
     SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY", "")
     FROM_EMAIL = os.getenv("FROM_EMAIL", "notifications@example.com")
@@ -11,3 +77,64 @@ class Config:
     TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID", "")
     TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN", "")
     TWILIO_FROM_NUMBER = os.getenv("TWILIO_FROM_NUMBER", "")
+
+    # Notification outbox (see outbox.py). "thread" runs the dispatcher inside
+    # each web process, started by its first request; "off" leaves it to
+    # `flask run-notification-worker`.
+    NOTIFICATION_WORKER = os.getenv("NOTIFICATION_WORKER", "thread")
+    NOTIFICATION_BATCH_SIZE = int(os.getenv("NOTIFICATION_BATCH_SIZE", "20"))
+    NOTIFICATION_MAX_ATTEMPTS = int(os.getenv("NOTIFICATION_MAX_ATTEMPTS", "5"))
+    NOTIFICATION_BACKOFF_SECONDS = float(os.getenv("NOTIFICATION_BACKOFF_SECONDS", "2"))
+    NOTIFICATION_BACKOFF_MAX_SECONDS = float(os.getenv("NOTIFICATION_BACKOFF_MAX_SECONDS", "300"))
+    NOTIFICATION_LEASE_SECONDS = float(os.getenv("NOTIFICATION_LEASE_SECONDS", "120"))
+    NOTIFICATION_POLL_SECONDS = float(os.getenv("NOTIFICATION_POLL_SECONDS", "2"))
+    NOTIFICATION_EMAIL_CONCURRENCY = int(os.getenv("NOTIFICATION_EMAIL_CONCURRENCY", "4"))
+    NOTIFICATION_SMS_CONCURRENCY = int(os.getenv("NOTIFICATION_SMS_CONCURRENCY", "2"))
+
+    # Retention (see notification_log.py): `flask archive-notifications`
+    # moves sent/logged/failed notifications older than RETENTION_DAYS into
+    # the notification_archive table ("table") or gzipped JSONL files in
+    # ARCHIVE_DIR ("jsonl"), BATCH_SIZE rows per transaction. 0 keeps everything.
+    NOTIFICATION_RETENTION_DAYS = int(os.getenv("NOTIFICATION_RETENTION_DAYS", "0"))
+    NOTIFICATION_ARCHIVE = os.getenv("NOTIFICATION_ARCHIVE", "table")
+    NOTIFICATION_ARCHIVE_DIR = os.getenv("NOTIFICATION_ARCHIVE_DIR", "")
+    NOTIFICATION_ARCHIVE_BATCH_SIZE = int(os.getenv("NOTIFICATION_ARCHIVE_BATCH_SIZE", "1000"))
+
+    # Provider clients are built once per process (see notifications.py).
+    # NOTIFICATION_FAKE_PROVIDERS swaps in in-process fakes for benchmarks.
+    NOTIFICATION_PROVIDER_TIMEOUT = float(os.getenv("NOTIFICATION_PROVIDER_TIMEOUT", "10"))
+    NOTIFICATION_FAKE_PROVIDERS = os.getenv("NOTIFICATION_FAKE_PROVIDERS", "") == "1"
+    NOTIFICATION_FAKE_LATENCY_MS = float(os.getenv("NOTIFICATION_FAKE_LATENCY_MS", "0"))
+
+    # Appointment times typed without an offset ("2025-12-16 14:00") are in
+    # this IANA zone, e.g. "America/Chicago" (see appointments.py)
+    APPOINTMENT_TIMEZONE = os.getenv("APPOINTMENT_TIMEZONE", "UTC")
+
+    # Lead phone numbers written without "+<country code>" are national
+    # numbers of this country when matching duplicates (see dedupe.py)
+    LEAD_PHONE_COUNTRY_CODE = os.getenv("LEAD_PHONE_COUNTRY_CODE", "1")
+
+    # POST /api/leads/bulk and PATCH /api/leads
+    IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+    IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+    BULK_UPDATE_MAX_IDS = int(os.getenv("BULK_UPDATE_MAX_IDS", "5000"))
+
+    # Per-user GET response cache (see cache.py), keyed by data version:
+    # "memory" is per process, "redis" (RESPONSE_CACHE_URL) is shared by every
+    # worker, "off" disables it
+    RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "memory")
+    RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL", "")
+    RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "60"))
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+    # Request instrumentation served at /metrics (see metrics.py). A sampled
+    # share of requests is run under cProfile; the slowest are kept at
+    # /metrics/profiles and, with METRICS_PROFILE_DIR, dumped as .prof files.
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "") == "1"
+    METRICS_PROFILE_RATE = float(os.getenv("METRICS_PROFILE_RATE", "0"))
+    METRICS_PROFILE_KEEP = int(os.getenv("METRICS_PROFILE_KEEP", "10"))
+    METRICS_PROFILE_DIR = os.getenv("METRICS_PROFILE_DIR", "")
+    # Who may read /metrics and /metrics/profiles: a bearer token, or client
+    # addresses/networks (comma-separated; behind a proxy see TRUSTED_PROXIES)
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+    METRICS_ALLOW_IPS = os.getenv("METRICS_ALLOW_IPS", "127.0.0.1,::1")
@@ -0,0 +1,204 @@
+import re
+from datetime import datetime
+
+from models import db, Lead, LeadTombstone, Note, Notification
+from rollups import record_lead_removed
+from search import index_leads, index_notes, remove_leads
+
+# Duplicate leads.
+#
+# Every lead stores its phone and email a second time as match keys:
+# Lead.phone_key holds the number as E.164 digits (no "+"), Lead.email_key
+# holds the lowercased address. Both are indexed per user, so the duplicate
+# check on create and import is an index lookup however many leads a user
+# has, and GET /api/leads/duplicates groups on the indexes instead of
+# comparing leads pairwise.
+#
+# merge_leads() folds duplicates into one surviving lead; their notes and
+# notifications move over in the same transaction.
+
+# Country code plus at least 7 digits; shorter runs are typos, not numbers.
+# E.164 allows 15 digits at most.
+MIN_PHONE_DIGITS = 8
+MAX_PHONE_DIGITS = 15
+# Leads folded into one by a single POST /api/leads/<id>/merge
+MERGE_MAX_IDS = 50
+# Lead fields a merge copies from a duplicate when the survivor has none
+MERGE_FILL_FIELDS = ("phone", "email", "address", "city", "state", "appointment_datetime")
+
+_EXTENSION_RE = re.compile(r"\s*(?:ext\.?|x|#)\s*\d+\s*$", re.IGNORECASE)
+_NON_DIGITS_RE = re.compile(r"\D")
+
+def phone_key(phone, country_code="1"):
+    # "(512) 555-0100 x12" -> "15125550100"; "+44 20 7946 0958" ->
+    # "442079460958". Numbers without "+"/"00" are national numbers in
+    # `country_code` (a leading trunk 0 is dropped). None if not a number.
+    text = _EXTENSION_RE.sub("", str(phone or "").strip())
+    digits = _NON_DIGITS_RE.sub("", text)
+    if text.startswith("+"):
+        key = digits
+    elif digits.startswith("00"):
+        key = digits[2:]
+    elif country_code == "1" and len(digits) == 11 and digits.startswith("1"):
+        # NANP numbers are often written with their 1 in front
+        key = digits
+    else:
+        key = country_code + digits.lstrip("0")
+    return key if MIN_PHONE_DIGITS <= len(key) <= MAX_PHONE_DIGITS else None
+
+def email_key(email):
+    text = str(email or "").strip().lower()
+    return text if "@" in text else None
+
+def contact_keys(values: dict, country_code="1") -> dict:
+    # phone_key/email_key column values for the phone/email in `values`
+    keys = {}
+    if "phone" in values:
+        keys["phone_key"] = phone_key(values["phone"], country_code)
+    if "email" in values:
+        keys["email_key"] = email_key(values["email"])
+    return keys
+
+def _key_filter(phone_keys, email_keys):
+    # Either side can be empty; OR-ing two IN lists is a lookup on each index
+    clauses = []
+    if phone_keys:
+        clauses.append(Lead.phone_key.in_(phone_keys))
+    if email_keys:
+        clauses.append(Lead.email_key.in_(email_keys))
+    return db.or_(*clauses) if clauses else None
+
+def find_duplicate(user_id: int, phone=None, email=None):
+    # Id of an existing lead with this phone or email key, else None
+    clause = _key_filter([phone] if phone else [], [email] if email else [])
+    if clause is None:
+        return None
+    return db.session.query(Lead.id).filter(Lead.user_id == user_id, clause).limit(1).scalar()
+
+class ImportDuplicates:
+    """Duplicate check for one bulk import: a batch of rows is looked up
+    with one query, and rows repeating an earlier row of the same import are
+    caught too (the keys of accepted rows are kept until the import ends)."""
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.seen = {}  # ("phone" | "email", key) -> row number
+
+    def check(self, rows):
+        # rows: [(row_number, values)] -> error message or None per row
+        pairs = [_pairs(values) for _, values in rows]
+        phones = sorted({k for p in pairs for kind, k in p if kind == "phone"})
+        emails = sorted({k for p in pairs for kind, k in p if kind == "email"})
+        existing = {}
+        clause = _key_filter(phones, emails)
+        if clause is not None:
+            found = (
+                db.session.query(Lead.id, Lead.phone_key, Lead.email_key)
+                .filter(Lead.user_id == self.user_id, clause)
+                .all()
+            )
+            for lead_id, phone, email in found:
+                existing.setdefault(("phone", phone), lead_id)
+                existing.setdefault(("email", email), lead_id)
+
+        messages = []
+        for (row_number, _), row_pairs in zip(rows, pairs):
+            message = None
+            for pair in row_pairs:
+                if pair in existing:
+                    message = f"Duplicate of lead {existing[pair]} ({pair[0]})"
+                    break
+                if pair in self.seen:
+                    message = f"Duplicate of row {self.seen[pair]} ({pair[0]})"
+                    break
+            if message is None:
+                for pair in row_pairs:
+                    self.seen[pair] = row_number
+            messages.append(message)
+        return messages
+
+def _pairs(values):
+    return [
+        (kind, values.get(f"{kind}_key")) for kind in ("phone", "email") if values.get(f"{kind}_key")
+    ]
+
+def duplicate_groups(user_id: int, limit: int, columns):
+    # [{"match": "phone"|"email", "key", "lead_ids", "rows"}]: up to `limit`
+    # keys per kind shared by more than one lead. The GROUP BY walks
+    # ix_lead_user_phone_key / ix_lead_user_email_key in key order; the
+    # member leads are then fetched by key and grouped here.
+    groups = []
+    for match, column in (("phone", Lead.phone_key), ("email", Lead.email_key)):
+        keys = [
+            key for key, in
+            db.session.query(column)
+            .filter(Lead.user_id == user_id, column.isnot(None))
+            .group_by(column)
+            .having(db.func.count(Lead.id) > 1)
+            .limit(limit)
+            .all()
+        ]
+        if not keys:
+            continue
+        members = {key: [] for key in keys}
+        rows = (
+            db.session.query(*columns, Lead.id, column)
+            .filter(Lead.user_id == user_id, column.in_(keys))
+            .all()
+        )
+        for row in rows:
+            members[row[-1]].append(row)
+        for key in keys:
+            rows = sorted(members[key], key=lambda r: r[-2])
+            groups.append({"match": match, "key": key, "lead_ids": [r[-2] for r in rows], "rows": rows})
+    return groups
+
+def merge_leads(user_id: int, survivor_id: int, duplicate_ids, country_code="1"):
+    # Folds `duplicate_ids` into the survivor in the caller's transaction:
+    # blank survivor fields are filled from the duplicates (in the order
+    # given), their notes and notifications move over, and the duplicates
+    # are deleted with tombstones and rollup updates. Notification counters
+    # are per user, so moving rows leaves them as they are. Returns the
+    # survivor; raises LookupError with the ids that are not the user's leads.
+    survivor = Lead.query.filter_by(id=survivor_id, user_id=user_id).first()
+    duplicates = {
+        row.id: row
+        for row in db.session.query(
+            Lead.id, Lead.user_id, Lead.stage, Lead.estimated_value, *(getattr(Lead, f) for f in MERGE_FILL_FIELDS)
+        ).filter(Lead.user_id == user_id, Lead.id.in_(duplicate_ids))
+    }
+    missing = [i for i in duplicate_ids if i not in duplicates]
+    if survivor is None:
+        missing.insert(0, survivor_id)
+    if missing:
+        raise LookupError(missing)
+
+    filled = False
+    for field in MERGE_FILL_FIELDS:
+        if getattr(survivor, field) is not None:
+            continue
+        value = next((getattr(duplicates[i], field) for i in duplicate_ids if getattr(duplicates[i], field) is not None), None)
+        if value is not None:
+            setattr(survivor, field, value)
+            filled = True
+    for column, value in contact_keys({"phone": survivor.phone, "email": survivor.email}, country_code).items():
+        setattr(survivor, column, value)
+    # Moved notes change the survivor's detail view: list it in delta syncs
+    survivor.updated_at = datetime.utcnow()
+
+    # Index entries first: the note_fts cleanup finds the notes by their old lead
+    remove_leads(duplicate_ids)
+    note_ids = db.session.execute(db.select(Note.id).where(Note.lead_id.in_(duplicate_ids))).scalars().all()
+    if note_ids:
+        db.session.execute(db.update(Note).where(Note.lead_id.in_(duplicate_ids)).values(lead_id=survivor_id))
+    db.session.execute(
+        db.update(Notification).where(Notification.lead_id.in_(duplicate_ids)).values(lead_id=survivor_id)
+    )
+    db.session.execute(db.delete(Lead).where(Lead.id.in_(duplicate_ids)))
+    for row in duplicates.values():
+        record_lead_removed(row)
+    db.session.add_all(LeadTombstone(user_id=user_id, lead_id=i) for i in duplicate_ids)
+    index_notes(note_ids)
+    if filled:
+        index_leads([survivor_id])
+    return survivor
@@ -0,0 +1,137 @@
+import threading
+import time
+
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# Engine tuning profiles and read-replica routing.
+#
+# DATABASE_PROFILE "auto" picks a profile from the database URL:
+# - sqlite: WAL journal (readers no longer block the writer or each other),
+#   synchronous=NORMAL, a busy timeout so concurrent gunicorn workers wait
+#   for the write lock instead of failing with "database is locked", and a
+#   larger page cache and mmap window. Applied to every new connection.
+#   Writers of one process also queue on a lock: SQLite's busy handler
+#   polls, so with many request threads (gthread) some lose every retry and
+#   fail after the busy timeout, and under gevent it blocks the event loop.
+# - postgres: a sized connection pool with pre-ping (connections the server
+#   or a proxy dropped are replaced instead of failing a request), recycled
+#   connections, and statement/lock timeouts set per connection.
+# "none" keeps the driver defaults.
+#
+# DATABASE_FAKE_LATENCY_MS adds a sleep before each statement, so benchmarks
+# against a local SQLite file wait on the database like a deployment does.
+#
+# With DATABASE_READ_URL set, the replica is an extra engine (bind
+# REPLICA_BIND) and RoutingSession sends the queries of views marked with
+# versions.replica_reads() to it.
+
+REPLICA_BIND = "replica"
+WRITE_VERBS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+WRITE_LOCK_HELD = "sqlite_write_lock"
+PROFILES = ("sqlite", "postgres")
+
+def database_profile(config):
+    # "sqlite", "postgres" or None
+    profile = (config.get("DATABASE_PROFILE") or "none").lower()
+    if profile in ("none", "off"):
+        return None
+    if profile == "auto":
+        backend = make_url(config["SQLALCHEMY_DATABASE_URI"]).get_backend_name()
+        return {"sqlite": "sqlite", "postgresql": "postgres"}.get(backend)
+    if profile not in PROFILES:
+        raise ValueError(f"DATABASE_PROFILE must be auto, none, {' or '.join(PROFILES)}, got {profile!r}")
+    return profile
+
+def engine_options(config) -> dict:
+    # SQLALCHEMY_ENGINE_OPTIONS for the profile; Flask-SQLAlchemy applies
+    # them to the replica too
+    if database_profile(config) != "postgres":
+        return {}
+    options = {
+        "pool_size": config["DATABASE_POOL_SIZE"],
+        "max_overflow": config["DATABASE_MAX_OVERFLOW"],
+        "pool_timeout": config["DATABASE_POOL_TIMEOUT"],
+        "pool_recycle": config["DATABASE_POOL_RECYCLE"],
+        "pool_pre_ping": True,
+    }
+    timeouts = [
+        f"-c {name}={ms}"
+        for name, ms in (
+            ("statement_timeout", config["DATABASE_STATEMENT_TIMEOUT_MS"]),
+            ("lock_timeout", config["DATABASE_LOCK_TIMEOUT_MS"]),
+        )
+        if ms
+    ]
+    if timeouts:
+        options["connect_args"] = {"options": " ".join(timeouts)}
+    return options
+
+def sqlite_pragmas(config):
+    # (pragma, value) pairs run on each new connection; journal_mode is
+    # stored in the database file, the rest last for the connection
+    return [
+        ("journal_mode", config["SQLITE_JOURNAL_MODE"]),
+        ("synchronous", config["SQLITE_SYNCHRONOUS"]),
+        ("busy_timeout", config["SQLITE_BUSY_TIMEOUT_MS"]),
+        # Negative sizes are KiB rather than pages
+        ("cache_size", -config["SQLITE_CACHE_SIZE_KB"]),
+        ("mmap_size", config["SQLITE_MMAP_SIZE_MB"] * 2**20),
+    ]
+
+def configure_engine(engine, config):
+    # Call before the engine's first connection (right after db.init_app)
+    latency = config["DATABASE_FAKE_LATENCY_MS"] / 1000
+    if latency:
+        @event.listens_for(engine, "before_cursor_execute")
+        def _fake_round_trip(conn, cursor, statement, parameters, context, executemany):
+            time.sleep(latency)
+
+    if database_profile(config) != "sqlite" or engine.dialect.name != "sqlite":
+        return
+    pragmas = sqlite_pragmas(config)
+
+    @event.listens_for(engine, "connect")
+    def _apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    _serialize_writes(engine, config["SQLITE_BUSY_TIMEOUT_MS"] / 1000)
+
+def _serialize_writes(engine, timeout):
+    # Taken before a connection's first write statement (when the driver
+    # opens its transaction; reads before it run outside one) and released
+    # as the transaction commits or rolls back. A connection that cannot get it within the
+    # busy timeout writes anyway and leaves the wait to SQLite, so two
+    # connections in one thread cannot deadlock.
+    lock = threading.Lock()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _acquire(conn, cursor, statement, parameters, context, executemany):
+        if conn.info.get(WRITE_LOCK_HELD) is None and statement.lstrip()[:7].upper().startswith(WRITE_VERBS):
+            conn.info[WRITE_LOCK_HELD] = lock.acquire(timeout=timeout)
+
+    def _release(info):
+        if info.pop(WRITE_LOCK_HELD, None):
+            lock.release()
+
+    event.listen(engine, "commit", lambda conn: _release(conn.info))
+    event.listen(engine, "rollback", lambda conn: _release(conn.info))
+    # A connection checked back in without either still ends its transaction
+    event.listen(engine.pool, "checkin", lambda dbapi_connection, record: _release(record.info))
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy's session, except that while g.read_replica is set
+    (see versions.replica_reads) queries go to the replica engine. Flushes
+    always go to the primary."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_app_context() and g.get("read_replica"):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -0,0 +1,56 @@
+import os
+
+# gunicorn settings, read from this directory by `gunicorn app:app`.
+#
+# Requests mostly wait on the database (and the outbox threads on
+# SendGrid/Twilio), so a sync worker, which serves one request at a time,
+# sits idle for most of each request. The default "gthread" worker serves
+# GUNICORN_THREADS requests at once per process. Everything the app shares
+# between requests is locked or per thread (caches, rate limits, metrics, the
+# provider registry), and Flask-SQLAlchemy gives each request its own session.
+# Across processes, cached responses are keyed by the data version in the
+# database and rate limits are split between the workers (see on_starting).
+#
+# "gevent" (needs `pip install gevent`, plus `psycogreen` on Postgres) serves
+# up to GUNICORN_WORKER_CONNECTIONS requests per process on greenlets. It
+# only pays off on Postgres: SQLite calls cannot yield, so one slow query
+# stalls the whole worker.
+#
+# Anything here can still be overridden on the command line (a sync worker
+# there also needs `--threads 1`).
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+# WEB_CONCURRENCY is what Render and Heroku set from the instance size
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+# gunicorn turns a sync worker with threads > 1 into gthread, so only pass
+# threads to gthread. Keep DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW at or
+# above this, or threads queue for a connection.
+threads = int(os.getenv("GUNICORN_THREADS", "8")) if worker_class == "gthread" else 1
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+# Longer than the idle timeout of a load balancer in front (commonly 60 s),
+# so it never sends a request down a connection gunicorn is closing just
+# then. Idle connections wait in the worker's poller, not on a thread, and
+# count towards worker_connections.
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "75"))
+
+def on_starting(server):
+    # Workers inherit this and split the per-process rate limits between them
+    # (RATE_LIMIT_PROCESSES in config.py), also when --workers overrides it
+    os.environ["WEB_CONCURRENCY"] = str(server.cfg.workers)
+    if server.cfg.worker_class_str == "gevent" and os.getenv("DATABASE_URL", "sqlite").startswith("sqlite"):
+        server.log.warning("The gevent worker is meant for Postgres: SQLite calls block its event loop. "
+                           "Use GUNICORN_WORKER_CLASS=gthread with SQLite.")
+
+def post_fork(server, worker):
+    # gevent's monkey-patching does not reach psycopg2, a C extension; its
+    # wait hook makes queries yield to the event loop. Runs before the worker
+    # loads the app, so every connection gets it.
+    if worker.cfg.worker_class_str != "gevent":
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        return
+    patch_psycopg()
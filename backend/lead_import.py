@@ -0,0 +1,145 @@
+import csv
+import io
+import json
+from collections import Counter
+
+from analytics import record_stage_events, stage_event
+from models import db, Lead
+from rollups import apply_delta, to_cents
+from search import index_leads
+from versions import bump_version
+
+IMPORT_FORMATS = {
+    "text/csv": "csv",
+    "application/x-ndjson": "jsonl",
+    "application/jsonl": "jsonl",
+    "application/x-jsonlines": "jsonl",
+}
+
+def detect_format(content_type: str, explicit=None):
+    if explicit:
+        return explicit if explicit in ("csv", "jsonl") else None
+    mimetype = (content_type or "").split(";")[0].strip().lower()
+    return IMPORT_FORMATS.get(mimetype)
+
+class _ReadableStream(io.RawIOBase):
+    # Servers that mark wsgi.input as terminated (gunicorn) get their raw
+    # input object passed through by Werkzeug, which only has read()
+    def __init__(self, stream):
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+def iter_records(stream, fmt: str):
+    # Yields (row_number, record_or_None, error_or_None) straight off the
+    # request stream; nothing beyond the current line is held in memory.
+    if not isinstance(stream, io.IOBase):
+        stream = _ReadableStream(stream)
+    text = io.TextIOWrapper(io.BufferedReader(stream), encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for row_number, row in enumerate(reader, start=1):
+            if None in row:
+                yield row_number, None, "Row has more columns than the header"
+            else:
+                yield row_number, row, None
+        return
+
+    row_number = 0
+    for line in text:
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield row_number, None, "Invalid JSON"
+            continue
+        if not isinstance(record, dict):
+            yield row_number, None, "Each line must be a JSON object"
+            continue
+        yield row_number, record, None
+
+def import_leads(user_id: int, records, validate, batch_size: int, max_errors: int, duplicates=None):
+    # validate(record) -> column values for Lead, or raises ValueError.
+    # Valid rows are inserted with one executemany per batch; each batch
+    # commits together with its rollup deltas and search index entries.
+    # duplicates: a dedupe.ImportDuplicates; rows it flags fail like invalid ones.
+    inserted = 0
+    failed = 0
+    errors = []
+    batch = []  # (row_number, values)
+
+    def fail(row_number, error):
+        nonlocal failed
+        failed += 1
+        if len(errors) < max_errors:
+            errors.append({"row": row_number, "error": error})
+
+    def flush():
+        nonlocal inserted
+        if duplicates is not None and batch:
+            flagged = duplicates.check(batch)
+            for (row_number, _), error in zip(batch, flagged):
+                if error is not None:
+                    fail(row_number, error)
+            batch[:] = [row for row, error in zip(batch, flagged) if error is None]
+        if not batch:
+            return
+        rows = [values for _, values in batch]
+        lead_ids = db.session.execute(
+            db.insert(Lead).returning(Lead.id, sort_by_parameter_order=True), rows
+        ).scalars().all()
+        index_leads(lead_ids, new=True)
+        record_stage_events([
+            stage_event(user_id, lead_id, None, v["stage"], v["estimated_value"], None, v["stage_changed_at"])
+            for lead_id, v in zip(lead_ids, rows)
+        ])
+        counts, cents = Counter(), Counter()
+        for values in rows:
+            counts[values["stage"]] += 1
+            cents[values["stage"]] += to_cents(values["estimated_value"])
+        for stage, count in counts.items():
+            apply_delta(user_id, stage, count, cents[stage])
+        bump_version(user_id, "leads")
+        db.session.commit()
+        inserted += len(batch)
+        batch.clear()
+
+    aborted = None
+    try:
+        for row_number, record, error in records:
+            if error is None:
+                try:
+                    values = validate(record)
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                fail(row_number, error)
+                continue
+            values["user_id"] = user_id
+            batch.append((row_number, values))
+            if len(batch) >= batch_size:
+                flush()
+    except (UnicodeDecodeError, csv.Error) as e:
+        # Unreadable body: keep the rows parsed so far and report where it stopped
+        aborted = f"Import stopped: {e}"
+    flush()
+    # Duplicates are only known when their batch is flushed
+    errors.sort(key=lambda e: e["row"])
+
+    report = {
+        "inserted": inserted,
+        "failed": failed,
+        "errors": errors,
+        "errors_truncated": failed > len(errors),
+    }
+    if aborted:
+        report["aborted"] = aborted
+    return report
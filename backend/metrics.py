@@ -0,0 +1,270 @@
+import bisect
+import cProfile
+import functools
+import heapq
+import hmac
+import io
+import ipaddress
+import os
+import pstats
+import random
+import threading
+import time
+
+from flask import Response, g, request
+from sqlalchemy import event
+
+# Opt-in request instrumentation (METRICS_ENABLED=1), served in Prometheus
+# text format at /metrics:
+#
+# - latency histogram per route, method and status
+# - SQL statements and time per route, via SQLAlchemy cursor events
+# - time inside named sections: our own functions swapped for timed wrappers
+#   with instrument() (password hashing, serializers, provider sends, JSON
+#   encoding) and library calls wrapped with timed() where we make them (JWT
+#   checks in app.jwt_required); third-party modules are never patched
+# - optionally a cProfile of a random sample of requests, keeping the N slowest
+#
+# Both endpoints answer only `Authorization: Bearer <METRICS_TOKEN>` or
+# clients in METRICS_ALLOW_IPS (loopback by default), and label everything
+# by route template, never by the raw URL and query string.
+#
+# Section and SQL timings of a request are gathered in a thread-local
+# accumulator without locking and merged into the totals once per request.
+# Sections timed outside a request (the outbox worker threads) go straight
+# to the totals under "background".
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+PREFIX = "contractorconnect"
+
+_local = threading.local()
+_sink = None  # the Metrics instance sections outside a request report to
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f"{name}_sum{{{labels}}} {self.sum:.6f}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+def _record_section(name, elapsed):
+    acc = getattr(_local, "acc", None)
+    if acc is not None:
+        calls, seconds = acc["sections"].get(name, (0, 0.0))
+        acc["sections"][name] = (calls + 1, seconds + elapsed)
+    elif _sink is not None:
+        _sink.merge("background", {name: (1, elapsed)})
+
+def timed(name, fn):
+    if getattr(fn, "_metrics_section", None):
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _record_section(name, time.perf_counter() - start)
+
+    wrapper._metrics_section = name
+    return wrapper
+
+def instrument(namespace: dict, *names, section=None):
+    # Replace functions in a module's globals with timed wrappers. Call sites
+    # that look the name up at call time (module globals) pick them up.
+    for name in names:
+        namespace[name] = timed(section or name, namespace[name])
+
+class Metrics:
+    def __init__(self, app, *engines):
+        global _sink
+        cfg = app.config
+        self.profile_rate = cfg["METRICS_PROFILE_RATE"]
+        self.profile_keep = cfg["METRICS_PROFILE_KEEP"]
+        self.profile_dir = cfg["METRICS_PROFILE_DIR"]
+        self.token = cfg["METRICS_TOKEN"]
+        self.allow_ips = [
+            ipaddress.ip_network(net.strip(), strict=False) for net in cfg["METRICS_ALLOW_IPS"].split(",") if net.strip()
+        ]
+        self._lock = threading.Lock()
+        self.latency = {}     # (method, route, status) -> Histogram
+        self.statements = {}  # route -> Histogram of statements per request
+        self.sql = {}         # route -> [statements, seconds]
+        self.sections = {}    # (route, section) -> [calls, seconds]
+        self.slowest = []     # min-heap of (seconds, seq, label, stats text, .prof path)
+        self._seq = 0
+
+        app.before_request(self._before)
+        app.after_request(self._record_status)
+        app.teardown_request(self._teardown)
+        # The primary and, if configured, the read replica
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._before_cursor)
+            event.listen(engine, "after_cursor_execute", self._after_cursor)
+        # Once per jsonify(); streamed responses encode row by row and are not timed
+        app.json.response = timed("json_response", app.json.response)
+        app.add_url_rule("/metrics", "metrics", self.metrics_view)
+        app.add_url_rule("/metrics/profiles", "metrics_profiles", self.profiles_view)
+        _sink = self
+
+    # ---------- hooks ----------
+    def _before(self):
+        _local.acc = {"sql": 0, "sql_seconds": 0.0, "sections": {}}
+        _local.start = time.perf_counter()
+        _local.profiler = None
+        if self.profile_rate and random.random() < self.profile_rate:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is active (Python 3.12+ allows one per process)
+                return
+            _local.profiler = profiler
+
+    def _teardown(self, exc):
+        acc = getattr(_local, "acc", None)
+        if acc is None:
+            return
+        elapsed = time.perf_counter() - _local.start
+        _local.acc = None
+        profiler = _local.profiler
+        if profiler is not None:
+            profiler.disable()
+            _local.profiler = None
+
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        status = str(g.get("metrics_status", 500 if exc else 200))
+        with self._lock:
+            key = (request.method, route, status)
+            hist = self.latency.get(key)
+            if hist is None:
+                hist = self.latency[key] = Histogram(LATENCY_BUCKETS)
+            hist.observe(elapsed)
+            hist = self.statements.get(route)
+            if hist is None:
+                hist = self.statements[route] = Histogram(STATEMENT_BUCKETS)
+            hist.observe(acc["sql"])
+            totals = self.sql.setdefault(route, [0, 0.0])
+            totals[0] += acc["sql"]
+            totals[1] += acc["sql_seconds"]
+        self.merge(route, acc["sections"])
+        if profiler is not None:
+            self._keep_profile(elapsed, f"{request.method} {route}", profiler)
+
+    def _record_status(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def _before_cursor(self, conn, cursor, statement, parameters, context, executemany):
+        context._metrics_start = time.perf_counter()
+
+    def _after_cursor(self, conn, cursor, statement, parameters, context, executemany):
+        acc = getattr(_local, "acc", None)
+        if acc is not None:
+            acc["sql"] += 1
+            acc["sql_seconds"] += time.perf_counter() - context._metrics_start
+
+    def merge(self, route, sections):
+        if not sections:
+            return
+        with self._lock:
+            for name, (calls, seconds) in sections.items():
+                totals = self.sections.setdefault((route, name), [0, 0.0])
+                totals[0] += calls
+                totals[1] += seconds
+
+    def _keep_profile(self, elapsed, label, profiler):
+        with self._lock:
+            self._seq += 1
+            if len(self.slowest) >= self.profile_keep and elapsed <= self.slowest[0][0]:
+                return
+            seq = self._seq
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(30)
+        path = None
+        if self.profile_dir:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(self.profile_dir, f"{os.getpid()}-{seq}-{elapsed * 1000:.0f}ms.prof")
+            profiler.dump_stats(path)
+        entry = (elapsed, seq, label, out.getvalue(), path)
+        with self._lock:
+            if len(self.slowest) < self.profile_keep:
+                heapq.heappush(self.slowest, entry)
+                return
+            dropped = heapq.heappushpop(self.slowest, entry)
+        # Only the N slowest stay on disk too
+        if dropped[4]:
+            try:
+                os.remove(dropped[4])
+            except OSError:
+                pass
+
+    # ---------- views ----------
+    def _allowed(self):
+        auth = request.headers.get("Authorization", "")
+        if self.token and hmac.compare_digest(auth.encode(), f"Bearer {self.token}".encode()):
+            return True
+        try:
+            addr = ipaddress.ip_address(request.remote_addr or "")
+        except ValueError:
+            return False
+        return any(addr in net for net in self.allow_ips)
+
+    def metrics_view(self):
+        if not self._allowed():
+            return Response("Forbidden\n", status=403, mimetype="text/plain")
+        return Response("\n".join(self.render()) + "\n", mimetype="text/plain; version=0.0.4")
+
+    def profiles_view(self):
+        if not self._allowed():
+            return Response("Forbidden\n", status=403, mimetype="text/plain")
+        with self._lock:
+            slowest = sorted(self.slowest, reverse=True)
+        text = "".join(f"==== {label} {elapsed * 1000:.1f} ms\n{stats}\n" for elapsed, _, label, stats, _ in slowest)
+        return Response(text or "No profiles sampled yet.\n", mimetype="text/plain")
+
+    def render(self):
+        lines = []
+        with self._lock:
+            name = f"{PREFIX}_request_duration_seconds"
+            lines += [f"# HELP {name} Request latency by route.", f"# TYPE {name} histogram"]
+            for (method, route, status), hist in sorted(self.latency.items()):
+                lines.extend(hist.lines(name, f'method="{method}",route="{route}",status="{status}"'))
+
+            name = f"{PREFIX}_sql_statements_per_request"
+            lines += [f"# HELP {name} SQL statements run by one request.", f"# TYPE {name} histogram"]
+            for route, hist in sorted(self.statements.items()):
+                lines.extend(hist.lines(name, f'route="{route}"'))
+
+            for metric, index, help_text in (
+                ("sql_statements_total", 0, "SQL statements executed."),
+                ("sql_seconds_total", 1, "Time spent executing SQL."),
+            ):
+                lines += [f"# HELP {PREFIX}_{metric} {help_text}", f"# TYPE {PREFIX}_{metric} counter"]
+                for route, totals in sorted(self.sql.items()):
+                    lines.append(f'{PREFIX}_{metric}{{route="{route}"}} {totals[index]}')
+
+            for metric, index, help_text in (
+                ("section_calls_total", 0, "Calls to instrumented functions."),
+                ("section_seconds_total", 1, "Time inside instrumented functions."),
+            ):
+                lines += [f"# HELP {PREFIX}_{metric} {help_text}", f"# TYPE {PREFIX}_{metric} counter"]
+                for (route, section), totals in sorted(self.sections.items()):
+                    lines.append(f'{PREFIX}_{metric}{{route="{route}",section="{section}"}} {totals[index]}')
+        return lines
@@ -1,7 +1,48 @@
+import sqlite3
+
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from datetime import datetime, timezone
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.types import DateTime, TypeDecorator
+
+from engine import RoutingSession
+
+# Objects stay loaded after commit: handlers serialize what they just wrote
+# without a reload SELECT, and each request gets a fresh session anyway.
+# RoutingSession can send read-only views to a replica (see engine.py).
+db = SQLAlchemy(session_options={"expire_on_commit": False, "class_": RoutingSession})
+
+@event.listens_for(Engine, "connect")
+def _sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores foreign keys (and so ON DELETE CASCADE) unless asked per connection
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+class UTCDateTime(TypeDecorator):
+    """Timezone-aware datetimes, stored in UTC. SQLite has no time zones, so
+    there the stored text is naive UTC (and sorts chronologically); values
+    read back are always aware UTC. Naive values written are taken as UTC."""
 
-db = SQLAlchemy()
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        value = value.astimezone(timezone.utc)
+        return value.replace(tzinfo=None) if dialect.name == "sqlite" else value
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc)
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -12,7 +53,7 @@ class User(db.Model):
 
 class Lead(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
 
     full_name = db.Column(db.String(160), nullable=False)
     phone = db.Column(db.String(50), nullable=True)
@@ -23,30 +64,186 @@ class Lead(db.Model):
 
     stage = db.Column(db.String(60), nullable=False, default="New")
     estimated_value = db.Column(db.Float, nullable=True, default=0.0)
-    appointment_datetime = db.Column(db.String(60), nullable=True)  # ISO string for simplicity
+    appointment_datetime = db.Column(UTCDateTime, nullable=True)  # see appointments.py
+    # Duplicate-match keys derived from phone/email on every write (see dedupe.py)
+    phone_key = db.Column(db.String(20), nullable=True)
+    email_key = db.Column(db.String(160), nullable=True)
+    # When the lead entered its current stage; unknown for leads last moved
+    # before stage history was kept (see analytics.py)
+    stage_changed_at = db.Column(db.DateTime, nullable=True)
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # Deleting a lead deletes its notes and notifications in the database
+    # (ON DELETE CASCADE); passive_deletes keeps the ORM from loading them first
+    notes = db.relationship(
+        "Note", order_by="Note.created_at.desc()", cascade="all, delete-orphan", passive_deletes=True
+    )
+    notifications = db.relationship("Notification", cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (
+        # Appointment ranges (GET /api/appointments, dashboard upcoming)
+        db.Index("ix_lead_user_appointment", "user_id", "appointment_datetime", "id"),
+        # Lead list: keyset pagination on (created_at, id) DESC
+        db.Index("ix_lead_user_created", "user_id", "created_at", "id"),
+        # Lead list filtered by stage, same ordering
+        db.Index("ix_lead_user_stage_created", "user_id", "stage", "created_at", "id"),
+        # Lead list delta mode (?since=)
+        db.Index("ix_lead_user_updated", "user_id", "updated_at", "id"),
+        # Duplicate checks on create/import and GET /api/leads/duplicates
+        db.Index("ix_lead_user_phone_key", "user_id", "phone_key", "id"),
+        db.Index("ix_lead_user_email_key", "user_id", "email_key", "id"),
+    )
+
 class Note(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    lead_id = db.Column(db.Integer, db.ForeignKey("lead.id"), nullable=False, index=True)
+    lead_id = db.Column(db.Integer, db.ForeignKey("lead.id", ondelete="CASCADE"), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
 
     note_text = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Lead detail: a lead's notes, newest first (Lead.notes)
+        db.Index("ix_note_lead_created", "lead_id", "created_at"),
+    )
+
 class Notification(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
-    lead_id = db.Column(db.Integer, db.ForeignKey("lead.id"), nullable=True, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    lead_id = db.Column(db.Integer, db.ForeignKey("lead.id", ondelete="CASCADE"), nullable=True)
 
     channel = db.Column(db.String(20), nullable=False)  # email or sms
     to_value = db.Column(db.String(200), nullable=False)
     subject = db.Column(db.String(200), nullable=True)
     message = db.Column(db.Text, nullable=False)
 
-    status = db.Column(db.String(30), nullable=False, default="logged")  # logged/sent/failed
+    # queued -> sending -> sent/logged/failed; see outbox.py
+    status = db.Column(db.String(30), nullable=False, default="queued")
     provider_response = db.Column(db.Text, nullable=True)
 
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    next_attempt_at = db.Column(db.DateTime, nullable=True)  # retry time while queued, lease expiry while sending
+    sent_at = db.Column(db.DateTime, nullable=True)
+
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Outbox workers claim due rows by status and retry time; retention
+        # finds finished rows (no retry time) by age
+        db.Index("ix_notification_status_next_attempt_created", "status", "next_attempt_at", "created_at"),
+        # Notification history, newest first; ?channel= filters this range
+        db.Index("ix_notification_user_created", "user_id", "created_at", "id"),
+        # History filtered by ?status=
+        db.Index("ix_notification_user_status_created", "user_id", "status", "created_at", "id"),
+        # History of one lead (?lead_id=), and the ON DELETE CASCADE lookup
+        db.Index("ix_notification_lead_created", "lead_id", "created_at", "id"),
+    )
+
+class NotificationCount(db.Model):
+    # Per-user notification counters by channel and status, maintained on
+    # every Notification write (see notification_log.py)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    channel = db.Column(db.String(20), primary_key=True)
+    status = db.Column(db.String(30), primary_key=True)
+
+    notification_count = db.Column(db.Integer, nullable=False, default=0)
+
+class NotificationArchive(db.Model):
+    # Notifications moved out of the live table by `flask archive-notifications`.
+    # id is the original Notification id; message and provider_response are
+    # kept as zlib-compressed JSON in body. No lead foreign key: archived rows
+    # outlive their leads.
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    lead_id = db.Column(db.Integer, nullable=True)
+
+    channel = db.Column(db.String(20), nullable=False)
+    status = db.Column(db.String(30), nullable=False)
+    to_value = db.Column(db.String(200), nullable=False)
+    subject = db.Column(db.String(200), nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    body = db.Column(db.LargeBinary, nullable=False)
+
+    created_at = db.Column(db.DateTime, nullable=False)
+    sent_at = db.Column(db.DateTime, nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("ix_notification_archive_user_created", "user_id", "created_at", "id"),
+    )
+
+class LeadStageEvent(db.Model):
+    # Append-only stage history: one row per stage a lead enters, from_stage
+    # None when it was created in to_stage (see analytics.py). No lead
+    # foreign key: the history outlives deleted and merged leads.
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    lead_id = db.Column(db.Integer, nullable=False)
+
+    from_stage = db.Column(db.String(60), nullable=True)
+    to_stage = db.Column(db.String(60), nullable=False)
+    estimated_value = db.Column(db.Float, nullable=True)
+    # When the lead had entered from_stage, if known
+    stage_entered_at = db.Column(db.DateTime, nullable=True)
+    occurred_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Per-user rebuilds of the funnel buckets
+        db.Index("ix_lead_stage_event_user_occurred", "user_id", "occurred_at", "id"),
+    )
+
+class LeadFunnelDaily(db.Model):
+    # Stage transitions per user and UTC day, maintained with every
+    # LeadStageEvent insert; from_stage is "" for leads created in to_stage
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    from_stage = db.Column(db.String(60), primary_key=True)
+    to_stage = db.Column(db.String(60), primary_key=True)
+
+    transitions = db.Column(db.Integer, nullable=False, default=0)
+    # Sum of those leads' estimated_value in whole cents (won/lost values).
+    # NULL only in rows from before the column existed, until upgrade-schema
+    # rebuilds them.
+    total_cents = db.Column(db.BigInteger, default=0)
+
+class LeadStageDurationDaily(db.Model):
+    # Histogram of finished stays in a stage, by the UTC day the lead left it;
+    # bucket indexes analytics.DURATION_BOUNDS
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    stage = db.Column(db.String(60), primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True)
+
+    stays = db.Column(db.Integer, nullable=False, default=0)
+
+class LeadStageRollup(db.Model):
+    # Per-user, per-stage lead counts and values maintained on every Lead
+    # write (see rollups.py)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    stage = db.Column(db.String(60), primary_key=True)
+
+    lead_count = db.Column(db.Integer, nullable=False, default=0)
+    # Sum of estimated_value in whole cents. NULL only in rows from before the
+    # column existed, until upgrade-schema rebuilds them.
+    total_cents = db.Column(db.BigInteger, default=0)
+
+class LeadTombstone(db.Model):
+    # One row per deleted lead, so GET /api/leads?since= can report deletions
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    lead_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("ix_lead_tombstone_user_deleted", "user_id", "deleted_at"),
+    )
+
+class DataVersion(db.Model):
+    # Per-user change counters behind ETag / Last-Modified (see versions.py)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    scope = db.Column(db.String(30), primary_key=True)
+
+    version = db.Column(db.Integer, nullable=False, default=0)
+    changed_at = db.Column(db.DateTime, nullable=True)
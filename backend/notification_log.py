@@ -0,0 +1,189 @@
+import gzip
+import json
+import os
+import zlib
+from collections import Counter
+from datetime import datetime
+
+from models import db, Notification, NotificationArchive, NotificationCount
+from rollups import _upsert_insert
+from versions import bump_version
+
+# The notification log's per-user counters and its retention.
+#
+# NotificationCount holds one row per (user, channel, status), adjusted in the
+# same transaction as every Notification insert, status change and delete, so
+# GET /api/notifications/counts reads a handful of rows however long the log
+# is. `flask rebuild-notification-counts` recomputes them from the table.
+#
+# archive_notifications() moves finished rows older than the retention window
+# out of the live table in batches: into NotificationArchive (message and
+# provider response zlib-compressed) or into gzipped JSONL files. Queued and
+# sending rows are never archived. Counters only cover the live table.
+
+# outbox.SENT, LOGGED and FAILED
+FINISHED = ("sent", "logged", "failed")
+
+ARCHIVE_COLUMNS = [
+    Notification.id, Notification.user_id, Notification.lead_id, Notification.channel, Notification.to_value,
+    Notification.subject, Notification.message, Notification.status, Notification.provider_response,
+    Notification.attempts, Notification.created_at, Notification.sent_at,
+]
+
+def apply_count_deltas(deltas):
+    # deltas: {(user_id, channel, status): change}. Runs in the caller's
+    # transaction; one statement on SQLite/Postgres however many keys change.
+    deltas = {key: n for key, n in deltas.items() if n}
+    if not deltas:
+        return
+    insert = _upsert_insert(db.session.get_bind().dialect.name)
+    if insert is not None:
+        stmt = insert(NotificationCount).values([
+            {"user_id": u, "channel": c, "status": s, "notification_count": n}
+            for (u, c, s), n in sorted(deltas.items())
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id", "channel", "status"],
+            set_={"notification_count": NotificationCount.notification_count + stmt.excluded.notification_count},
+        )
+        db.session.execute(stmt)
+        return
+    for (u, c, s), n in sorted(deltas.items()):
+        updated = NotificationCount.query.filter_by(user_id=u, channel=c, status=s).update(
+            {"notification_count": NotificationCount.notification_count + n}, synchronize_session=False
+        )
+        if not updated:
+            db.session.add(NotificationCount(user_id=u, channel=c, status=s, notification_count=n))
+
+def count_transition(user_id: int, channel: str, old_status, new_status):
+    # Delta for one row moving between statuses (None = inserted / deleted)
+    deltas = Counter()
+    if old_status is not None:
+        deltas[(user_id, channel, old_status)] -= 1
+    if new_status is not None:
+        deltas[(user_id, channel, new_status)] += 1
+    return deltas
+
+def record_lead_notifications_removed(lead_id: int):
+    # Call before deleting a lead: its notifications go with it (ON DELETE
+    # CASCADE), so take them off their owners' counters
+    rows = (
+        db.session.query(Notification.user_id, Notification.channel, Notification.status)
+        .filter(Notification.lead_id == lead_id)
+        .all()
+    )
+    apply_count_deltas(Counter({key: -n for key, n in Counter(rows).items()}))
+
+def notification_counts(user_id: int) -> dict:
+    rows = (
+        db.session.query(NotificationCount.channel, NotificationCount.status, NotificationCount.notification_count)
+        .filter(NotificationCount.user_id == user_id)
+        .all()
+    )
+    by_channel, by_status = {}, {}
+    for channel, status, count in rows:
+        if count:
+            by_channel[channel] = by_channel.get(channel, 0) + count
+            by_status[status] = by_status.get(status, 0) + count
+    return {"total": sum(by_channel.values()), "by_channel": by_channel, "by_status": by_status}
+
+def rebuild_notification_counts(user_id=None, repair=True):
+    # Recompute counters from Notification and (unless repair=False) replace
+    # the stored ones. Returns the drift as (user_id, channel, status, stored, actual).
+    actual_q = db.session.query(
+        Notification.user_id, Notification.channel, Notification.status, db.func.count(Notification.id)
+    ).group_by(Notification.user_id, Notification.channel, Notification.status)
+    stored_q = NotificationCount.query
+    if user_id is not None:
+        actual_q = actual_q.filter(Notification.user_id == user_id)
+        stored_q = stored_q.filter_by(user_id=user_id)
+
+    actual = {(u, c, s): n for u, c, s, n in actual_q.all()}
+    stored = {(r.user_id, r.channel, r.status): r.notification_count for r in stored_q.all()}
+    drift = [
+        (*key, stored.get(key, 0), actual.get(key, 0))
+        for key in sorted(set(actual) | set(stored))
+        if stored.get(key, 0) != actual.get(key, 0)
+    ]
+    if not repair:
+        return drift
+    stored_q.delete(synchronize_session=False)
+    db.session.add_all(
+        NotificationCount(user_id=u, channel=c, status=s, notification_count=n) for (u, c, s), n in actual.items()
+    )
+    db.session.commit()
+    return drift
+
+# ---------- retention ----------
+
+def _archive_rows_to_table(rows, now):
+    db.session.execute(db.insert(NotificationArchive), [
+        {
+            "id": r.id, "user_id": r.user_id, "lead_id": r.lead_id, "channel": r.channel, "status": r.status,
+            "to_value": r.to_value, "subject": r.subject, "attempts": r.attempts,
+            "created_at": r.created_at, "sent_at": r.sent_at, "archived_at": now,
+            "body": zlib.compress(json.dumps(
+                {"message": r.message, "provider_response": r.provider_response}, separators=(",", ":")
+            ).encode()),
+        }
+        for r in rows
+    ])
+
+def _archive_rows_to_jsonl(rows, directory, now):
+    # One file per day; gzip members appended by later runs read back as one stream
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"notifications-{now:%Y-%m-%d}.jsonl.gz")
+    lines = []
+    for r in rows:
+        row = r._asdict()
+        for key in ("created_at", "sent_at"):
+            row[key] = row[key].isoformat() if row[key] else None
+        lines.append(json.dumps(row, separators=(",", ":")))
+    with gzip.open(path, "at", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def archive_notifications(older_than: datetime, target="table", directory=None, batch_size=1000, max_batches=None):
+    # Moves finished notifications created before `older_than` out of the
+    # live table, one committed batch at a time. Returns the rows moved.
+    # JSONL batches are written before the rows are deleted, so a crash in
+    # between archives those rows again on the next run (files may repeat ids).
+    if target not in ("table", "jsonl"):
+        raise ValueError("archive target must be 'table' or 'jsonl'")
+    if target == "jsonl" and not directory:
+        raise ValueError("NOTIFICATION_ARCHIVE_DIR is required for JSONL archives")
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+        # Range scan on ix_notification_status_next_attempt_created:
+        # finished rows have no next_attempt_at
+        rows = (
+            db.session.query(*ARCHIVE_COLUMNS)
+            .filter(
+                Notification.status.in_(FINISHED),
+                Notification.next_attempt_at.is_(None),
+                Notification.created_at < older_than,
+            )
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        now = datetime.utcnow()
+        if target == "table":
+            _archive_rows_to_table(rows, now)
+        else:
+            _archive_rows_to_jsonl(rows, directory, now)
+        db.session.execute(db.delete(Notification).where(Notification.id.in_([r.id for r in rows])))
+        apply_count_deltas(Counter({
+            key: -n for key, n in Counter((r.user_id, r.channel, r.status) for r in rows).items()
+        }))
+        users = {r.user_id for r in rows}
+        for user_id in users:
+            bump_version(user_id, "notifications")
+        db.session.commit()
+        moved += len(rows)
+        batches += 1
+        if len(rows) < batch_size:
+            break
+    return moved
@@ -1,30 +1,221 @@
-import os
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
-from twilio.rest import Client
-
-def send_email_sendgrid(api_key: str, from_email: str, to_email: str, subject: str, message: str):
-    sg = SendGridAPIClient(api_key)
-    mail = Mail(from_email=from_email, to_emails=to_email, subject=subject, plain_text_content=message)
-    resp = sg.send(mail)
-    return f"SendGrid status={resp.status_code}"
-
-def send_sms_twilio(account_sid: str, auth_token: str, from_number: str, to_number: str, message: str):
-    client = Client(account_sid, auth_token)
-    msg = client.messages.create(body=message, from_=from_number, to=to_number)
-    return f"Twilio sid={msg.sid}"
-
-def try_send_notification(config, channel: str, to_value: str, subject: str, message: str):
-    # Returns (status, provider_response)
+import threading
+import time
+
+SENDGRID_API_URL = "https://api.sendgrid.com/v3/mail/send"
+
+class Provider:
+    """One delivery channel. Instances live for the whole process and are
+    shared by every send, so implementations must be thread-safe and should
+    keep their HTTP connections alive between sends."""
+
+    channel = None
+    name = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sends = 0
+        self._errors = 0
+        self._seconds = 0.0
+
+    def send(self, to_value: str, subject: str, message: str) -> str:
+        # Returns the provider_response text; raises on delivery errors
+        raise NotImplementedError
+
+    def timed_send(self, to_value: str, subject: str, message: str) -> str:
+        start = time.perf_counter()
+        try:
+            return self.send(to_value, subject, message)
+        except Exception:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._sends += 1
+                self._seconds += elapsed
+
+    def connection_counters(self):
+        # (connections opened, requests made) over this provider's lifetime
+        return 0, 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            sends, errors, seconds = self._sends, self._errors, self._seconds
+        opened, requests_made = self.connection_counters()
+        return {
+            "provider": self.name,
+            "sends": sends,
+            "errors": errors,
+            "total_ms": round(seconds * 1000, 3),
+            "avg_ms": round(seconds * 1000 / sends, 3) if sends else None,
+            "connections_opened": opened,
+            "http_requests": requests_made,
+            "connections_reused": max(requests_made - opened, 0),
+        }
+
+def _pool_counters(session):
+    # urllib3 keeps per-host pools under each requests adapter; each pool
+    # counts connections it had to open and requests it served.
+    opened = requests_made = 0
+    for adapter in session.adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+                requests_made += pool.num_requests
+    return opened, requests_made
+
+class SendGridProvider(Provider):
+    channel = "email"
+    name = "sendgrid"
+
+    def __init__(self, api_key: str, from_email: str, timeout: float = 10, pool_size: int = 4,
+                 api_url: str = SENDGRID_API_URL):
+        super().__init__()
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.from_email = from_email
+        self.timeout = timeout
+        self.api_url = api_url
+        # Talk to the v3 REST API over one keep-alive session: the SendGrid
+        # SDK opens a fresh urllib connection (and TLS handshake) per send.
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.headers.update({"Authorization": f"Bearer {api_key}"})
+
+    def send(self, to_value: str, subject: str, message: str) -> str:
+        resp = self.session.post(self.api_url, timeout=self.timeout, json={
+            "personalizations": [{"to": [{"email": to_value}]}],
+            "from": {"email": self.from_email},
+            "subject": subject,
+            "content": [{"type": "text/plain", "value": message}],
+        })
+        resp.raise_for_status()
+        return f"SendGrid status={resp.status_code}"
+
+    def connection_counters(self):
+        return _pool_counters(self.session)
+
+class TwilioProvider(Provider):
+    channel = "sms"
+    name = "twilio"
+
+    def __init__(self, account_sid: str, auth_token: str, from_number: str, timeout: float = 10):
+        super().__init__()
+        from twilio.http.http_client import TwilioHttpClient
+        from twilio.rest import Client
+
+        self.from_number = from_number
+        self.http_client = TwilioHttpClient(pool_connections=True, timeout=timeout)
+        self.client = Client(account_sid, auth_token, http_client=self.http_client)
+
+    def send(self, to_value: str, subject: str, message: str) -> str:
+        msg = self.client.messages.create(body=message, from_=self.from_number, to=to_value)
+        return f"Twilio sid={msg.sid}"
+
+    def connection_counters(self):
+        return _pool_counters(self.http_client.session)
+
+class FakeProvider(Provider):
+    """In-process stand-in for tests and benchmarks. Sleeps `latency` seconds
+    per send to mimic a provider round trip and records what it was given."""
+
+    name = "fake"
+
+    def __init__(self, channel: str, latency: float = 0.0, fail_every: int = 0):
+        super().__init__()
+        self.channel = channel
+        self.latency = latency
+        self.fail_every = fail_every
+        self.sent = []
+
+    def send(self, to_value: str, subject: str, message: str) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.sent.append((to_value, subject, message))
+            count = len(self.sent)
+        if self.fail_every and count % self.fail_every == 0:
+            raise RuntimeError("fake provider failure")
+        return f"Fake {self.channel} #{count}"
+
+    def connection_counters(self):
+        # One long-lived "connection", every send reuses it
+        return 1, len(self.sent)
+
+class ProviderRegistry:
+    """Builds each channel's provider once per process from app config.
+    register() installs a provider directly, e.g. a FakeProvider in tests."""
+
+    def __init__(self, config):
+        self.config = config
+        self._providers = {}
+        self._lock = threading.Lock()
+
+    def register(self, provider: Provider):
+        with self._lock:
+            self._providers[provider.channel] = provider
+
+    def get(self, channel: str):
+        provider = self._providers.get(channel)
+        if provider is None and channel not in self._providers:
+            with self._lock:
+                if channel not in self._providers:
+                    self._providers[channel] = self._build(channel)
+                provider = self._providers[channel]
+        return provider
+
+    def _build(self, channel: str):
+        cfg = self.config
+        if cfg.get("NOTIFICATION_FAKE_PROVIDERS"):
+            return FakeProvider(channel, latency=cfg.get("NOTIFICATION_FAKE_LATENCY_MS", 0) / 1000)
+        timeout = cfg.get("NOTIFICATION_PROVIDER_TIMEOUT", 10)
+        if channel == "email" and cfg.get("SENDGRID_API_KEY"):
+            return SendGridProvider(cfg["SENDGRID_API_KEY"], cfg["FROM_EMAIL"], timeout=timeout,
+                                    pool_size=cfg.get("NOTIFICATION_EMAIL_CONCURRENCY", 4))
+        if channel == "sms" and cfg.get("TWILIO_ACCOUNT_SID") and cfg.get("TWILIO_AUTH_TOKEN") and cfg.get("TWILIO_FROM_NUMBER"):
+            return TwilioProvider(cfg["TWILIO_ACCOUNT_SID"], cfg["TWILIO_AUTH_TOKEN"], cfg["TWILIO_FROM_NUMBER"], timeout=timeout)
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            providers = dict(self._providers)
+        return {channel: p.stats() for channel, p in providers.items() if p is not None}
+
+def permanent_error(exc: Exception) -> bool:
+    # A 4xx from the provider (bad address, unverified number, rejected
+    # payload) fails the same way on every retry. 429 and 408 are throttling
+    # and timeouts, so those are retried like network and 5xx errors.
+    status = None
+    try:
+        import requests
+        if isinstance(exc, requests.HTTPError) and exc.response is not None:
+            status = exc.response.status_code
+    except ImportError:
+        pass
+    try:
+        from twilio.base.exceptions import TwilioRestException
+        if isinstance(exc, TwilioRestException):
+            status = exc.status
+    except ImportError:
+        pass
+    return isinstance(status, int) and 400 <= status < 500 and status not in (408, 429)
+
+def try_send_notification(registry: ProviderRegistry, channel: str, to_value: str, subject: str, message: str):
+    # Returns (status, provider_response). Provider errors propagate so the
+    # outbox worker can retry them (or fail them, see permanent_error).
     channel = (channel or "").lower().strip()
     if channel == "email":
-        if config.SENDGRID_API_KEY and to_value and "@" in to_value:
-            resp = send_email_sendgrid(config.SENDGRID_API_KEY, config.FROM_EMAIL, to_value, subject or "Notification", message)
-            return ("sent", resp)
+        provider = registry.get("email")
+        if provider and to_value and "@" in to_value:
+            return ("sent", provider.timed_send(to_value, subject or "Notification", message))
         return ("logged", "Email provider not configured (SENDGRID_API_KEY missing) or invalid recipient; logged only.")
     if channel == "sms":
-        if config.TWILIO_ACCOUNT_SID and config.TWILIO_AUTH_TOKEN and config.TWILIO_FROM_NUMBER:
-            resp = send_sms_twilio(config.TWILIO_ACCOUNT_SID, config.TWILIO_AUTH_TOKEN, config.TWILIO_FROM_NUMBER, to_value, message)
-            return ("sent", resp)
+        provider = registry.get("sms")
+        if provider:
+            return ("sent", provider.timed_send(to_value, subject, message))
         return ("logged", "SMS provider not configured (Twilio env vars missing); logged only.")
     return ("failed", "Unknown channel; must be 'email' or 'sms'.")
@@ -0,0 +1,230 @@
+import logging
+import random
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from models import db, Notification
+from notification_log import apply_count_deltas, count_transition
+from notifications import ProviderRegistry, permanent_error, try_send_notification
+from versions import bump_version
+
+log = logging.getLogger(__name__)
+
+# Notification.status lifecycle. "logged" is terminal like "sent": the row was
+# processed but no provider is configured for its channel.
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+LOGGED = "logged"
+FAILED = "failed"
+
+DEFAULT_SUBJECT = "ContractorConnect Notification"
+
+def enqueue_notification(user_id: int, lead_id, channel: str, to_value: str, subject, message: str) -> Notification:
+    # Adds a queued row to the caller's session; it is sent once the caller
+    # commits and a worker picks it up (call wake_worker() after commit).
+    notif = Notification(
+        user_id=user_id,
+        lead_id=lead_id,
+        channel=channel,
+        to_value=to_value,
+        subject=subject,
+        message=message,
+        status=QUEUED,
+        attempts=0,
+        next_attempt_at=None,
+    )
+    db.session.add(notif)
+    apply_count_deltas(count_transition(user_id, channel, None, QUEUED))
+    return notif
+
+def enqueue_notifications(rows) -> int:
+    # Batched form of enqueue_notification: one executemany INSERT for many
+    # rows of Notification column values, in the caller's transaction.
+    rows = [dict(row, status=QUEUED, attempts=0, next_attempt_at=None) for row in rows]
+    if rows:
+        db.session.execute(db.insert(Notification), rows)
+        apply_count_deltas(Counter((row["user_id"], row["channel"], QUEUED) for row in rows))
+    return len(rows)
+
+def wake_worker():
+    worker = current_app.extensions.get("notification_worker")
+    if worker is not None:
+        worker.wake()
+
+class NotificationWorker:
+    """Drains queued Notification rows in batches on a pool of threads.
+
+    Rows are claimed with a conditional UPDATE, so several workers (threads in
+    different gunicorn processes, or a separate `flask run-notification-worker`)
+    can share one outbox. A claim is a lease: a row left in "sending" by a
+    worker that died is picked up again once next_attempt_at passes.
+
+    Providers come from the app's ProviderRegistry unless one is passed in;
+    register a notifications.FakeProvider on it for tests and benchmarks.
+    """
+
+    def __init__(self, app, providers: ProviderRegistry = None):
+        cfg = app.config
+        self.app = app
+        self.providers = providers or app.extensions["notification_providers"]
+        self.batch_size = cfg["NOTIFICATION_BATCH_SIZE"]
+        self.max_attempts = cfg["NOTIFICATION_MAX_ATTEMPTS"]
+        self.backoff_seconds = cfg["NOTIFICATION_BACKOFF_SECONDS"]
+        self.backoff_max_seconds = cfg["NOTIFICATION_BACKOFF_MAX_SECONDS"]
+        self.lease_seconds = cfg["NOTIFICATION_LEASE_SECONDS"]
+        self.poll_seconds = cfg["NOTIFICATION_POLL_SECONDS"]
+        # One pool per channel caps concurrent calls to each provider
+        self.pools = {
+            "email": ThreadPoolExecutor(cfg["NOTIFICATION_EMAIL_CONCURRENCY"], thread_name_prefix="notify-email"),
+            "sms": ThreadPoolExecutor(cfg["NOTIFICATION_SMS_CONCURRENCY"], thread_name_prefix="notify-sms"),
+        }
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        # Called on every request when the dispatcher runs in-process; only
+        # the first one starts the thread
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="notify-dispatcher", daemon=True)
+                    self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        for pool in self.pools.values():
+            pool.shutdown(wait=True)
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                processed = self.run_once()
+            except Exception:
+                log.exception("Notification dispatch failed")
+                processed = 0
+            # A full batch means there is probably more waiting
+            if processed < self.batch_size:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+
+    def run_once(self) -> int:
+        """Claim one batch of due rows, deliver them and wait. Returns the batch size."""
+        with self.app.app_context():
+            claimed = self._claim_batch()
+        futures = []
+        for notif_id, channel in claimed:
+            pool = self.pools.get(channel)
+            if pool is None:
+                self._deliver(notif_id)
+            else:
+                futures.append(pool.submit(self._deliver, notif_id))
+        wait(futures)
+        return len(claimed)
+
+    def drain(self) -> int:
+        """Process batches until nothing is due. Returns the number of rows processed."""
+        total = 0
+        while True:
+            processed = self.run_once()
+            total += processed
+            if not processed:
+                return total
+
+    def _claim_batch(self):
+        now = datetime.utcnow()
+        due = db.or_(Notification.next_attempt_at.is_(None), Notification.next_attempt_at <= now)
+        # No ORDER BY: rows come back in ix_notification_status_next_attempt
+        # order (fresh rows first, then retries by due time), and sorting by id
+        # would mean sorting the whole due backlog on every claim.
+        candidates = (
+            db.session.query(Notification.id, Notification.user_id, Notification.channel, Notification.status)
+            .filter(Notification.status.in_([QUEUED, SENDING]), due)
+            .limit(self.batch_size)
+            .all()
+        )
+        lease_until = now + timedelta(seconds=self.lease_seconds)
+        claimed = []
+        users = set()
+        deltas = Counter()
+        for notif_id, user_id, channel, status in candidates:
+            # Conditional update: only one worker wins each row
+            won = Notification.query.filter(
+                Notification.id == notif_id, Notification.status == status, due
+            ).update({
+                "status": SENDING,
+                "attempts": Notification.attempts + 1,
+                "next_attempt_at": lease_until,
+            }, synchronize_session=False)
+            if won:
+                claimed.append((notif_id, channel))
+                users.add(user_id)
+                deltas.update(count_transition(user_id, channel, status, SENDING))
+        apply_count_deltas(deltas)
+        # The claimed rows now show as "sending" in their owners' logs
+        for user_id in users:
+            bump_version(user_id, "notifications")
+        db.session.commit()
+        return claimed
+
+    def _deliver(self, notif_id: int):
+        with self.app.app_context():
+            row = (
+                db.session.query(
+                    Notification.user_id, Notification.channel, Notification.to_value, Notification.subject,
+                    Notification.message, Notification.status, Notification.attempts,
+                )
+                .filter(Notification.id == notif_id)
+                .first()
+            )
+            # Hand the connection back before the provider call, which can
+            # take seconds; the result is written in a new transaction
+            db.session.close()
+            if row is None or row.status != SENDING:
+                return
+            try:
+                status, provider_resp = try_send_notification(
+                    self.providers, row.channel, row.to_value, row.subject or DEFAULT_SUBJECT, row.message
+                )
+            except Exception as e:
+                log.warning("Notification %s attempt %s failed: %s", notif_id, row.attempts, e)
+                values = {"provider_response": f"{type(e).__name__}: {e}"}
+                if permanent_error(e) or row.attempts >= self.max_attempts:
+                    values.update(status=FAILED, next_attempt_at=None)
+                else:
+                    values.update(
+                        status=QUEUED,
+                        next_attempt_at=datetime.utcnow() + timedelta(seconds=self._backoff(row.attempts)),
+                    )
+            else:
+                values = {"status": status, "provider_response": provider_resp, "next_attempt_at": None}
+                if status == SENT:
+                    values["sent_at"] = datetime.utcnow()
+            # Only if the row is still this attempt's claim: once the lease
+            # runs out another worker may have claimed it again
+            updated = Notification.query.filter(
+                Notification.id == notif_id, Notification.status == SENDING, Notification.attempts == row.attempts
+            ).update(values, synchronize_session=False)
+            if updated:
+                apply_count_deltas(count_transition(row.user_id, row.channel, SENDING, values["status"]))
+                bump_version(row.user_id, "notifications")
+            db.session.commit()
+
+    def _backoff(self, attempts: int) -> float:
+        # Exponential backoff, base * 2^(n-1) capped, with jitter in [0.5, 1)
+        delay = min(self.backoff_seconds * (2 ** (attempts - 1)), self.backoff_max_seconds)
+        return delay * (0.5 + random.random() / 2)
@@ -0,0 +1,74 @@
+import base64
+import json
+from datetime import datetime, timedelta, timezone
+
+MAX_PAGE_LIMIT = 1000
+STREAM_CHUNK_SIZE = 500
+# Delta responses hand back an as_of this far in the past, so writes still in
+# flight when the delta was read are sent again next time (clients upsert by id)
+DELTA_OVERLAP = timedelta(seconds=2)
+
+class CursorError(ValueError):
+    pass
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    # Opaque to clients: base64 of the (created_at, id) keyset of the last row served
+    raw = json.dumps([created_at.isoformat() if created_at else None, row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise CursorError("Invalid cursor")
+
+def parse_since(value: str) -> datetime:
+    # ISO 8601; timestamps with an offset are converted to naive UTC like the columns
+    try:
+        since = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError("since must be an ISO 8601 timestamp")
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    return since
+
+def parse_limit(value, default=None):
+    # None means "no limit" so callers keep the old return-everything behaviour
+    if value in (None, ""):
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("limit must be an integer")
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, MAX_PAGE_LIMIT)
+
+def keyset_after(query, created_col, id_col, cursor: str, ascending=False):
+    # Rows strictly after the cursor in (created_at DESC, id DESC) order, or
+    # ascending order for lists sorted the other way (appointments)
+    created_at, row_id = decode_cursor(cursor)
+    if ascending:
+        return query.filter(
+            (created_col > created_at) | ((created_col == created_at) & (id_col > row_id))
+        )
+    return query.filter(
+        (created_col < created_at) | ((created_col == created_at) & (id_col < row_id))
+    )
+
+def stream_json_array(items, dumps):
+    # Yields a JSON array piece by piece so large exports never sit in memory whole
+    buf = ["["]
+    first = True
+    for item in items:
+        if not first:
+            buf.append(",")
+        buf.append(dumps(item))
+        first = False
+        if len(buf) >= STREAM_CHUNK_SIZE:
+            yield "".join(buf)
+            buf = []
+    buf.append("]")
+    yield "".join(buf)
@@ -0,0 +1,84 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+# Password hashing with tunable parameters and a cap on concurrent hashes.
+#
+# Hashes run on a small thread pool (hashlib's scrypt/pbkdf2 release the GIL),
+# and a semaphore bounds how many may be running or waiting for it. Past that
+# bound a request waits at most PASSWORD_HASH_QUEUE_TIMEOUT for a slot and is
+# then turned away with 503, so a burst of logins cannot tie up every request
+# thread of a worker (gthread) behind CPU-bound hashing. Under gunicorn's
+# gevent worker the pool is gevent's, whose threads are real OS threads:
+# patched ones would be greenlets, and a hash would stall the whole worker.
+#
+# The configured method is stored in every hash's prefix ("scrypt:32768:8:1$
+# salt$hash"); a login whose hash was made with other parameters is rehashed
+# with the current ones once the password has been verified.
+
+# Werkzeug's defaults for parameters left out of PASSWORD_HASH_METHOD
+_METHOD_DEFAULTS = {
+    "scrypt": ["32768", "8", "1"],
+    "pbkdf2": ["sha256", str(DEFAULT_PBKDF2_ITERATIONS)],
+}
+
+def _hash_executor(workers: int):
+    try:
+        from gevent import monkey
+    except ImportError:
+        monkey = None
+    if monkey is not None and monkey.is_module_patched("threading"):
+        from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+
+        return GeventThreadPoolExecutor(max_workers=workers)
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+
+class HashingBusy(Exception):
+    """No hashing slot freed up within the queue timeout."""
+
+def normalize_method(method: str) -> str:
+    # Spell out defaulted parameters so the method can be compared with the
+    # prefix werkzeug writes into each hash
+    name, *params = method.split(":")
+    defaults = _METHOD_DEFAULTS.get(name)
+    if defaults is None or len(params) > len(defaults) or (name == "scrypt" and params and len(params) != 3):
+        raise ValueError(f"Unsupported PASSWORD_HASH_METHOD: {method!r}")
+    return ":".join([name, *params, *defaults[len(params):]])
+
+class PasswordHasher:
+    def __init__(self, method: str, workers: int, queue: int, queue_timeout: float):
+        self.method = normalize_method(method)
+        self.queue_timeout = queue_timeout
+        self._executor = _hash_executor(max(1, workers))
+        # Hashes running plus waiting for a pool thread
+        self._slots = threading.BoundedSemaphore(max(1, workers) + max(0, queue))
+        self._lock = threading.Lock()
+        self.busy_rejections = 0
+        self.rehashed = 0
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.busy_rejections += 1
+            raise HashingBusy()
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password: str) -> str:
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash: str, password: str):
+        # (password matches, hash should be replaced with one made by hash())
+        if not self._run(check_password_hash, pwhash, password):
+            return False, False
+        return True, pwhash.split("$", 1)[0] != self.method
+
+    def rehash(self, password: str) -> str:
+        # hash() for a verified password whose stored hash is outdated
+        pwhash = self.hash(password)
+        with self._lock:
+            self.rehashed += 1
+        return pwhash
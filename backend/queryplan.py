@@ -0,0 +1,229 @@
+import io
+import json
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from models import db
+from notification_log import archive_notifications
+from schema import upgrade_schema
+
+# Drives every endpoint against a scratch database and captures the SQL each
+# one runs. Two checks use the capture:
+#
+# - `flask check-query-plans` checks each statement's plan: SQLite via EXPLAIN
+#   QUERY PLAN, Postgres via EXPLAIN (FORMAT JSON) with sequential scans
+#   disabled, so a Seq Scan in the plan means no index can serve the query.
+# - `flask check-statement-counts` compares the statements per request with
+#   STATEMENT_BUDGET_PATH and fails when an endpoint needs more than before.
+
+STATEMENT_BUDGET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "statement_budget.json")
+
+# Plan problems an endpoint is allowed to have, with the reason
+ALLOWED_PLAN_ISSUES = {
+    # Results are ranked by ts_rank, which only exists after matching
+    ("search", "postgresql", "Sort"),
+}
+
+_EXPLAINABLE = re.compile(r"^\s*(SELECT|WITH|UPDATE|DELETE|INSERT\s+INTO\s+\w+\s*\([^)]*\)\s*SELECT)", re.I | re.S)
+
+class StatementLog:
+    def __init__(self):
+        self.label = None
+        self.statements = []  # (label, statement, parameters)
+        self.calls = []  # (label, statements run by that one request)
+
+    def __len__(self):
+        return len(self.statements)
+
+    def for_label(self, label):
+        return [s for s in self.statements if s[0] == label]
+
+@contextmanager
+def capture_statements(engine):
+    # Records every statement sent to the database while active
+    log = StatementLog()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if executemany and parameters:
+            parameters = parameters[0]
+        log.statements.append((log.label, statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield log
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+def drive_endpoints(client, log: StatementLog):
+    # One call per endpoint (plus the main query-string variants of the lead
+    # list), each under its own label in the statement log.
+    def call(label, method, path, **kwargs):
+        log.label = label
+        start = len(log)
+        kwargs.setdefault("headers", headers)
+        resp = client.open(path, method=method, **kwargs)
+        log.calls.append((label, len(log) - start))
+        log.label = None
+        if resp.status_code >= 400:
+            raise RuntimeError(f"{label}: {method} {path} returned {resp.status_code}: {resp.get_data(as_text=True)}")
+        return resp
+
+    headers = {}
+    call("register", "POST", "/api/auth/register", json={"name": "Plan", "email": "plan@example.com", "password": "pw"})
+    token = call("login", "POST", "/api/auth/login", json={"email": "plan@example.com", "password": "pw"}).get_json()["access_token"]
+    headers["Authorization"] = f"Bearer {token}"
+
+    lead_ids = []
+    for i in range(5):
+        lead = call("create_lead", "POST", "/api/leads", json={
+            "full_name": f"Plan Lead {i}", "phone": f"512-555-01{i:02d}", "email": f"lead{i}@example.com",
+            "city": "Austin", "estimated_value": 1000 * i, "appointment_datetime": f"2030-01-0{i + 1}T09:00",
+        }).get_json()
+        lead_ids.append(lead["id"])
+    duplicate = call("create_lead", "POST", "/api/leads?allow_duplicate=1", json={
+        "full_name": "Plan Lead 0 (again)", "phone": "(512) 555-0100", "email": "LEAD0@example.com",
+    }).get_json()
+    call("bulk_import_leads", "POST", "/api/leads/bulk",
+         data=b"full_name,city,email\nImported,Dallas,imported@example.com\nAgain,Dallas,lead1@example.com\n",
+         content_type="text/csv")
+
+    lead_id = lead_ids[0]
+    call("add_note", "POST", f"/api/leads/{lead_id}/notes", json={"note_text": "Wants a copper gutter quote"})
+    call("update_lead", "PUT", f"/api/leads/{lead_id}", json={"stage": "Booked", "estimated_value": 2500})
+    call("bulk_update_leads", "PATCH", "/api/leads", json={"ids": lead_ids[1:3], "changes": {"stage": "Contacted"}})
+    call("send_notification", "POST", "/api/notifications/send",
+         json={"channel": "email", "to_value": "lead0@example.com", "message": "Hello", "lead_id": lead_id})
+    call("add_note", "POST", f"/api/leads/{duplicate['id']}/notes", json={"note_text": "Called from a second number"})
+    call("lead_duplicates", "GET", "/api/leads/duplicates")
+    call("merge_leads", "POST", f"/api/leads/{lead_id}/merge", json={"duplicate_ids": [duplicate["id"]]})
+
+    page = call("list_leads", "GET", "/api/leads?limit=2")
+    call("list_leads", "GET", f"/api/leads?limit=2&after={page.headers['X-Next-Cursor']}")
+    call("list_leads", "GET", "/api/leads?stage=Contacted&fields=id,full_name")
+    call("list_leads", "GET", "/api/leads?stream=1")
+    call("list_leads", "GET", "/api/leads?since=2000-01-01T00:00:00Z")
+    etag = page.headers["ETag"]
+    call("list_leads", "GET", "/api/leads?limit=2", headers={**headers, "If-None-Match": etag})
+    call("get_lead", "GET", f"/api/leads/{lead_id}")
+    call("search", "GET", "/api/search?q=copp")
+    call("search", "GET", "/api/search?q=austin")
+    page = call("list_notifications", "GET", "/api/notifications?limit=1")
+    call("list_notifications", "GET", f"/api/notifications?limit=1&after={page.headers['X-Next-Cursor']}")
+    call("list_notifications", "GET", "/api/notifications?status=queued&channel=email")
+    call("list_notifications", "GET", f"/api/notifications?lead_id={lead_id}")
+    call("notification_counts", "GET", "/api/notifications/counts")
+    appointments = call("list_appointments", "GET", "/api/appointments?from=2030-01-01&to=2030-02-01&limit=2")
+    call("list_appointments", "GET",
+         f"/api/appointments?from=2030-01-01&limit=2&after={appointments.headers['X-Next-Cursor']}")
+    call("dashboard", "GET", "/api/dashboard")
+    call("analytics_funnel", "GET", "/api/analytics/funnel?period=week")
+    call("delete_lead", "DELETE", f"/api/leads/{lead_ids[-1]}")
+
+def plan_problems(conn, statement, parameters):
+    # Returns the plan lines that indicate a full scan or a sort step
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters or ()).all()
+        problems = []
+        for row in rows:
+            detail = row[-1]
+            full_scan = detail.startswith("SCAN ") and "VIRTUAL TABLE" not in detail and detail != "SCAN CONSTANT ROW"
+            if full_scan or "USE TEMP B-TREE" in detail:
+                problems.append(detail)
+        return problems
+    if dialect == "postgresql":
+        plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters or {}).scalar()
+        problems = []
+        stack = [plan[0]["Plan"]]
+        while stack:
+            node = stack.pop()
+            if node["Node Type"] in ("Seq Scan", "Sort"):
+                problems.append(f"{node['Node Type']} {node.get('Relation Name', '')}".strip())
+            stack.extend(node.get("Plans", []))
+        return problems
+    return []
+
+@contextmanager
+def endpoint_scenario(create_app, database_url=None):
+    # Yields (engine, log) after driving every endpoint, one outbox drain and
+    # one notification archive batch.
+    # With no database_url the scenario runs against a throwaway SQLite file.
+    with tempfile.TemporaryDirectory() as tmp:
+        url = database_url or f"sqlite:///{os.path.join(tmp, 'scenario.db')}"
+        app = create_app({"SQLALCHEMY_DATABASE_URI": url, "NOTIFICATION_WORKER": "off", "RESPONSE_CACHE": "off",
+                          "RATE_LIMIT_STORE": "off", "TESTING": True})
+        with app.app_context():
+            upgrade_schema()
+            engine = db.engine
+            with capture_statements(engine) as log:
+                drive_endpoints(app.test_client(), log)
+                log.label = "notification_worker"
+                start = len(log)
+                app.extensions["notification_worker"].drain()
+                log.calls.append(("notification_worker", len(log) - start))
+                log.label = "archive_notifications"
+                start = len(log)
+                archive_notifications(datetime.utcnow() + timedelta(days=1), max_batches=1)
+                log.calls.append(("archive_notifications", len(log) - start))
+            try:
+                yield engine, log
+            finally:
+                engine.dispose()
+
+def check_query_plans(create_app, database_url=None):
+    # Returns a list of (endpoint, statement, problems)
+    with endpoint_scenario(create_app, database_url) as (engine, log):
+        failures = []
+        seen = set()
+        with engine.connect() as conn:
+            if engine.dialect.name == "postgresql":
+                conn.exec_driver_sql("SET enable_seqscan = off")
+            for label, statement, parameters in log.statements:
+                if label is None or not _EXPLAINABLE.match(statement) or (label, statement) in seen:
+                    continue
+                seen.add((label, statement))
+                problems = [
+                    p for p in plan_problems(conn, statement, parameters)
+                    if (label, engine.dialect.name, p.split(" ")[0]) not in ALLOWED_PLAN_ISSUES
+                ]
+                if problems:
+                    failures.append((label, statement, problems))
+            conn.rollback()
+        return failures
+
+def statement_counts(create_app) -> dict:
+    # Most statements any single request to each endpoint ran
+    with endpoint_scenario(create_app) as (engine, log):
+        counts = {}
+        for label, count in log.calls:
+            counts[label] = max(count, counts.get(label, 0))
+        return counts
+
+def load_statement_budget(path=STATEMENT_BUDGET_PATH) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+def save_statement_budget(counts: dict, path=STATEMENT_BUDGET_PATH):
+    with open(path, "w") as f:
+        json.dump(dict(sorted(counts.items())), f, indent=2)
+        f.write("\n")
+
+def over_budget(counts: dict, budget: dict):
+    # (endpoint, budget, actual) for endpoints that got worse or have no budget yet
+    return [
+        (label, budget.get(label), count)
+        for label, count in sorted(counts.items())
+        if label not in budget or count > budget[label]
+    ]
+
+def format_failures(failures):
+    out = io.StringIO()
+    for label, statement, problems in failures:
+        out.write(f"[{label}] {' | '.join(problems)}\n    {' '.join(statement.split())}\n")
+    return out.getvalue()
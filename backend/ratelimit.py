@@ -0,0 +1,144 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import jsonify
+
+# Token-bucket rate limits for the auth endpoints.
+#
+# Each rule ("login_ip", "login_email", ...) is "<burst>/<seconds>": a key may
+# spend up to <burst> requests at once, and the bucket refills at
+# burst/seconds tokens per second. Buckets are checked before any database
+# lookup or password hash, so a rejected attempt costs almost nothing.
+#
+# "memory" keeps buckets per process, so each of RATE_LIMIT_PROCESSES gunicorn
+# workers gets that share of every limit and the workers together never allow
+# more than the configured rate (a client that always lands on one worker is
+# limited sooner); "redis" (RATE_LIMIT_URL) shares exact buckets between
+# workers and hosts.
+
+def parse_rule(text):
+    # "20/60" -> (capacity 20, refill 1/3 token per second); "off" -> None
+    text = (text or "").strip()
+    if text in ("", "off", "0"):
+        return None
+    try:
+        burst, seconds = text.split("/")
+        capacity, per = int(burst), float(seconds)
+    except ValueError:
+        raise ValueError(f"Rate limits look like '<burst>/<seconds>', got {text!r}") from None
+    if capacity < 1 or per <= 0:
+        raise ValueError(f"Rate limits look like '<burst>/<seconds>', got {text!r}")
+    return capacity, capacity / per
+
+class MemoryBucketStore:
+    """Buckets in a dict, least recently used first. When max_keys is hit,
+    the oldest buckets go (they have refilled the longest, so dropping them
+    rarely forgives anything)."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> [tokens, updated_at]
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: int, rate: float) -> float:
+        # Seconds until a token is available; 0 means one was taken
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(capacity), now]
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0.0
+            return (1 - bucket[0]) / rate
+
+# Same arithmetic as MemoryBucketStore.take, atomically on the Redis server.
+# Clocks come from the server so workers on different hosts agree.
+_TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+if tokens == nil then
+  tokens = capacity
+else
+  tokens = math.min(capacity, tokens + (now - tonumber(state[2])) * rate)
+end
+local wait = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return tostring(wait)
+"""
+
+class RedisBucketStore:
+    """Buckets shared by every worker. Keys expire once a bucket would be full again."""
+
+    def __init__(self, url: str, prefix: str = "ratelimit:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._take = self.client.register_script(_TAKE_SCRIPT)
+
+    def take(self, key: str, capacity: int, rate: float) -> float:
+        return float(self._take(keys=[self.prefix + key], args=[capacity, rate]))
+
+class RateLimiter:
+    def __init__(self, store, rules: dict):
+        self.store = store
+        self.rules = {name: rule for name, rule in rules.items() if rule is not None}
+        self._lock = threading.Lock()
+        self.rejections = {name: 0 for name in self.rules}
+
+    def hit(self, rule: str, key: str) -> float:
+        # Spend one token from `key`'s bucket under `rule`; returns the
+        # seconds to wait when the bucket is empty, else 0
+        limit = self.rules.get(rule)
+        if limit is None or not key:
+            return 0.0
+        wait = self.store.take(f"{rule}:{key}", *limit)
+        if wait:
+            with self._lock:
+                self.rejections[rule] += 1
+        return wait
+
+def too_many_requests(wait: float):
+    resp = jsonify({"error": "Too many attempts, try again later"})
+    resp.status_code = 429
+    resp.headers["Retry-After"] = str(max(1, math.ceil(wait)))
+    return resp
+
+def build_rate_limiter(config):
+    kind = config.get("RATE_LIMIT_STORE", "memory")
+    if kind in ("off", "", None):
+        return None
+    rules = {
+        "login_ip": parse_rule(config["RATE_LIMIT_LOGIN_IP"]),
+        "login_email": parse_rule(config["RATE_LIMIT_LOGIN_EMAIL"]),
+        "register_ip": parse_rule(config["RATE_LIMIT_REGISTER_IP"]),
+    }
+    if kind == "redis":
+        store = RedisBucketStore(config["RATE_LIMIT_URL"])
+    else:
+        store = MemoryBucketStore()
+        processes = max(1, config.get("RATE_LIMIT_PROCESSES", 1))
+        for name, rule in rules.items():
+            if rule is not None:
+                capacity, rate = rule
+                rules[name] = (max(1, capacity // processes), rate / processes)
+    return RateLimiter(store, rules)
@@ -0,0 +1,102 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from models import db, Lead, LeadStageRollup
+
+# Per-user, per-stage lead counts and value totals kept in step with every
+# Lead write, so the dashboard reads O(stages) rows. Values are kept as
+# integer cents: a float total maintained by adding and subtracting deltas
+# loses small values next to large ones for good (100 + 1e17 - 1e17 == 96),
+# while integer deltas always cancel exactly.
+
+# Largest estimated_value a lead may have, so a user's total in cents stays
+# far inside a 64-bit integer
+MAX_ESTIMATED_VALUE = 10**12
+
+def to_cents(value) -> int:
+    # The float's shortest decimal form, rounded half up to whole cents
+    if not value:
+        return 0
+    return int(Decimal(repr(float(value))).scaleb(2).to_integral_value(ROUND_HALF_UP))
+
+def _upsert_insert(dialect_name: str):
+    # Imported on first use so a SQLite deployment never loads the Postgres dialect
+    if dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    return insert
+
+def apply_delta(user_id: int, stage: str, count: int, cents: int = 0):
+    # Runs inside the caller's transaction, so the rollup commits (or rolls
+    # back) together with the lead write that caused it.
+    if not count and not cents:
+        return
+    insert = _upsert_insert(db.session.get_bind().dialect.name)
+    if insert is not None:
+        stmt = insert(LeadStageRollup).values(user_id=user_id, stage=stage, lead_count=count, total_cents=cents)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id", "stage"],
+            set_={
+                "lead_count": LeadStageRollup.lead_count + stmt.excluded.lead_count,
+                "total_cents": LeadStageRollup.total_cents + stmt.excluded.total_cents,
+            },
+        )
+        db.session.execute(stmt)
+        return
+
+    updated = LeadStageRollup.query.filter_by(user_id=user_id, stage=stage).update({
+        "lead_count": LeadStageRollup.lead_count + count,
+        "total_cents": LeadStageRollup.total_cents + cents,
+    }, synchronize_session=False)
+    if not updated:
+        db.session.add(LeadStageRollup(user_id=user_id, stage=stage, lead_count=count, total_cents=cents))
+
+def record_lead_added(lead: Lead):
+    apply_delta(lead.user_id, lead.stage, 1, to_cents(lead.estimated_value))
+
+def record_lead_removed(lead: Lead):
+    apply_delta(lead.user_id, lead.stage, -1, -to_cents(lead.estimated_value))
+
+def record_lead_changed(user_id: int, old_stage: str, old_value, new_stage: str, new_value):
+    old_cents, new_cents = to_cents(old_value), to_cents(new_value)
+    if old_stage == new_stage:
+        apply_delta(user_id, new_stage, 0, new_cents - old_cents)
+        return
+    apply_delta(user_id, old_stage, -1, -old_cents)
+    apply_delta(user_id, new_stage, 1, new_cents)
+
+def rebuild_rollups(user_id=None, repair=True):
+    # Recompute rollups from Lead and (unless repair=False) replace the stored
+    # ones. Returns the drift found as
+    # (user_id, stage, stored_count, actual_count, stored_cents, actual_cents).
+    # Values are converted lead by lead with to_cents(), as the write paths do.
+    actual_q = db.session.query(Lead.user_id, Lead.stage, Lead.estimated_value)
+    stored_q = LeadStageRollup.query
+    if user_id is not None:
+        actual_q = actual_q.filter(Lead.user_id == user_id)
+        stored_q = stored_q.filter_by(user_id=user_id)
+
+    actual = {}
+    for u, s, value in actual_q.yield_per(10_000):
+        totals = actual.setdefault((u, s), [0, 0])
+        totals[0] += 1
+        totals[1] += to_cents(value)
+    stored = {(r.user_id, r.stage): (r.lead_count, r.total_cents) for r in stored_q.all()}
+
+    drift = []
+    for key in sorted(set(actual) | set(stored)):
+        stored_count, stored_cents = stored.get(key, (0, 0))
+        actual_count, actual_cents = actual.get(key, (0, 0))
+        if (stored_count, stored_cents) != (actual_count, actual_cents):
+            drift.append((*key, stored_count, actual_count, stored_cents, actual_cents))
+    if not repair:
+        return drift
+
+    stored_q.delete(synchronize_session=False)
+    db.session.add_all(
+        LeadStageRollup(user_id=u, stage=s, lead_count=c, total_cents=v) for (u, s), (c, v) in actual.items()
+    )
+    db.session.commit()
+    return drift
@@ -0,0 +1,284 @@
+import os
+from contextlib import contextmanager
+
+from flask import current_app
+from sqlalchemy import MetaData, bindparam, inspect, text
+from sqlalchemy.schema import AddConstraint, CreateColumn, CreateTable
+from sqlalchemy.types import String
+
+from analytics import backfill_stage_events, rebuild_funnel
+from appointments import parse_appointment
+from dedupe import contact_keys
+from models import (
+    db, Lead, LeadFunnelDaily, LeadStageEvent, LeadStageRollup, Note, Notification, NotificationCount, UTCDateTime,
+)
+from notification_log import rebuild_notification_counts
+from rollups import rebuild_rollups
+from search import ensure_search_index, index_notes
+from versions import bump_version
+
+# Schema upgrades run from `flask upgrade-schema` (a release step), never
+# while the app boots, so gunicorn workers cannot race each other through
+# them. Every step checks what is already there first, so a run that died
+# halfway (SQLite commits most DDL at once) is finished by the next one.
+
+# pg_advisory_lock key held while an upgrade runs
+UPGRADE_LOCK_ID = 0x43434F4E  # "CCON"
+
+# Single-column indexes replaced by composite ones in models.py that start
+# with the same column, and indexes nothing reads any more; dropped so writes
+# stop maintaining them.
+SUPERSEDED_INDEXES = [
+    "ix_lead_user_id",           # ix_lead_user_created
+    "ix_note_lead_id",           # ix_note_lead_created
+    "ix_note_lead_user_created", # ix_note_lead_created
+    "ix_notification_user_id",   # ix_notification_user_created
+    "ix_notification_lead_id",   # ix_notification_lead_created
+    "ix_notification_status_next_attempt",  # ix_notification_status_next_attempt_created
+    "ix_lead_user_stage_value",  # dashboard reads LeadStageRollup.total_cents
+    "ix_lead_stage_event_user_to_occurred",  # funnel reads LeadFunnelDaily.total_cents
+]
+
+# Columns no longer in models.py; dropped so inserts without them work.
+DROPPED_COLUMNS = [
+    ("lead_stage_rollup", "total_value"),   # float; replaced by total_cents
+    ("lead_funnel_daily", "total_value"),   # float; replaced by total_cents
+]
+
+def upgrade_schema():
+    # Creates missing tables, brings an older database up to date and seeds
+    # the derived tables (search index, rollups, counters, stage history).
+    # Runs in an app context, one process at a time per database.
+    with _upgrade_lock(db.engine):
+        _recover_sqlite_rebuilds()
+        db.create_all()
+        _upgrade_tables(current_app.extensions["appointment_timezone"], current_app.config["LEAD_PHONE_COUNTRY_CODE"])
+        ensure_search_index()
+        # First run after the rollup table was introduced: seed it from Lead.
+        # Rows without total_cents predate that column, so rebuild those too.
+        if (Lead.query.first() and not LeadStageRollup.query.first()) or (
+            LeadStageRollup.query.filter(LeadStageRollup.total_cents.is_(None)).first()
+        ):
+            rebuild_rollups()
+        # Same for the notification counters
+        if Notification.query.first() and not NotificationCount.query.first():
+            rebuild_notification_counts()
+        # And for the stage history behind the funnel (which rebuilds the
+        # buckets); buckets without total_cents predate that column
+        if Lead.query.first() and not LeadStageEvent.query.first():
+            backfill_stage_events()
+        elif LeadFunnelDaily.query.filter(LeadFunnelDaily.total_cents.is_(None)).first():
+            rebuild_funnel()
+        db.session.commit()
+
+@contextmanager
+def _upgrade_lock(engine):
+    # Postgres: a session advisory lock on its own connection. SQLite: an
+    # exclusive lock on a file next to the database. Other databases (and
+    # in-memory SQLite) are not locked.
+    if engine.dialect.name == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": UPGRADE_LOCK_ID})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": UPGRADE_LOCK_ID})
+        return
+    path = engine.url.database if engine.dialect.name == "sqlite" else None
+    try:
+        import fcntl
+    except ImportError:  # Windows
+        fcntl = None
+    if not path or path == ":memory:" or fcntl is None:
+        yield
+        return
+    with open(f"{os.path.abspath(path)}.upgrade-lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def _upgrade_tables(appointment_tz, phone_country_code="1"):
+    # db.create_all() only creates missing tables. Databases created by an
+    # older release also need the columns and indexes added since then, so
+    # add those in place. New columns must be nullable or carry a
+    # server_default for this to work on a populated table.
+    # appointment_tz: zone for old appointment text without an offset;
+    # phone_country_code: see dedupe.phone_key.
+    engine = db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    name = engine.dialect.identifier_preparer.format_table(table)
+                    ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                    conn.exec_driver_sql(f"ALTER TABLE {name} ADD COLUMN {ddl}")
+            for table_name, column_name in DROPPED_COLUMNS:
+                if table_name == table.name and column_name in columns:
+                    name = engine.dialect.identifier_preparer.format_table(table)
+                    conn.exec_driver_sql(f"ALTER TABLE {name} DROP COLUMN {column_name}")
+
+        converted = unreadable = ()
+        if "lead" in existing_tables:
+            # Also picks up leads a run that died after adding the columns missed
+            _backfill_contact_keys(conn, phone_country_code)
+            converted, unreadable = _convert_appointment_column(conn, inspector, appointment_tz)
+
+        # Foreign keys that gained an ON DELETE rule (note/notification -> lead)
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            stale = _stale_foreign_keys(inspector, table)
+            if not stale:
+                continue
+            if engine.dialect.name == "sqlite":
+                # SQLite cannot alter a constraint; copy the rows into a
+                # table created from the model instead
+                _rebuild_sqlite_table(conn, table)
+                continue
+            for fk, reflected in stale:
+                name = engine.dialect.identifier_preparer.format_table(table)
+                conn.exec_driver_sql(f'ALTER TABLE {name} DROP CONSTRAINT "{reflected["name"]}"')
+                conn.execute(AddConstraint(fk))
+
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+        for name in SUPERSEDED_INDEXES:
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+
+    if converted:
+        _finish_appointment_conversion(converted, unreadable)
+
+def _backfill_contact_keys(conn, country_code):
+    # Lead.phone_key/email_key for leads written before they existed
+    table = conn.engine.dialect.identifier_preparer.format_table(Lead.__table__)
+    rows = conn.execute(text(
+        f"SELECT id, phone, email FROM {table} "
+        "WHERE (phone IS NOT NULL AND phone_key IS NULL) OR (email IS NOT NULL AND email_key IS NULL)"
+    ))
+    keys = [
+        {"lead_id": lead_id, **contact_keys({"phone": phone, "email": email}, country_code)}
+        for lead_id, phone, email in rows
+    ]
+    if keys:
+        conn.execute(
+            text(f"UPDATE {table} SET phone_key = :phone_key, email_key = :email_key WHERE id = :lead_id"), keys
+        )
+
+def _convert_appointment_column(conn, inspector, tz):
+    # Lead.appointment_datetime used to be free text. Parse it into a new
+    # DateTime column and swap that in; the index on it is recreated with the
+    # other indexes. Returns the affected user ids and the (lead_id, user_id,
+    # text) rows that were not a date.
+    columns = {c["name"]: c for c in inspector.get_columns("lead")}
+    dialect = conn.engine.dialect
+    table = dialect.identifier_preparer.format_table(Lead.__table__)
+    if "appointment_datetime__new" in columns:
+        if "appointment_datetime" not in columns:
+            # An earlier run died between the drop and the rename
+            conn.exec_driver_sql(
+                f"ALTER TABLE {table} RENAME COLUMN appointment_datetime__new TO appointment_datetime"
+            )
+            return (), ()
+        # ... or before the drop: start over from the text column
+        conn.exec_driver_sql(f"ALTER TABLE {table} DROP COLUMN appointment_datetime__new")
+    if not isinstance(columns["appointment_datetime"]["type"], String):
+        return (), ()
+    conn.exec_driver_sql(
+        f"ALTER TABLE {table} ADD COLUMN appointment_datetime__new {UTCDateTime().compile(dialect=dialect)}"
+    )
+    parsed, unreadable, users = [], [], set()
+    rows = conn.execute(text(
+        f"SELECT id, user_id, appointment_datetime FROM {table} WHERE appointment_datetime IS NOT NULL"
+    ))
+    for lead_id, user_id, value in rows:
+        users.add(user_id)
+        try:
+            when = parse_appointment(value, tz)
+        except ValueError:
+            unreadable.append((lead_id, user_id, value.strip()))
+            continue
+        if when is not None:
+            parsed.append({"lead_id": lead_id, "when": when})
+    if parsed:
+        conn.execute(
+            text(f"UPDATE {table} SET appointment_datetime__new = :when WHERE id = :lead_id")
+            .bindparams(bindparam("when", type_=UTCDateTime())),
+            parsed,
+        )
+    # SQLite (3.35+) only drops unindexed columns
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ix_lead_user_appointment")
+    conn.exec_driver_sql(f"ALTER TABLE {table} DROP COLUMN appointment_datetime")
+    conn.exec_driver_sql(f"ALTER TABLE {table} RENAME COLUMN appointment_datetime__new TO appointment_datetime")
+    return users, unreadable
+
+def _finish_appointment_conversion(users, unreadable):
+    # Text that was not a date is kept as a note on its lead. Every user with
+    # appointments gets a new "leads" version: the values now serialize
+    # differently, so cached ETags must stop matching.
+    notes = [
+        Note(lead_id=lead_id, user_id=user_id, note_text=f"Appointment (not a date, removed from the lead): {value}")
+        for lead_id, user_id, value in unreadable
+    ]
+    db.session.add_all(notes)
+    db.session.flush()
+    if notes and "note_fts" in inspect(db.engine).get_table_names():
+        # Otherwise ensure_search_index() builds the whole index next
+        index_notes([n.id for n in notes])
+    for user_id in users:
+        bump_version(user_id, "leads")
+    db.session.commit()
+
+def _stale_foreign_keys(inspector, table):
+    # (model constraint, reflected constraint) pairs whose ON DELETE differs
+    reflected = {
+        (tuple(fk["constrained_columns"]), fk["referred_table"]): fk
+        for fk in inspector.get_foreign_keys(table.name)
+    }
+    stale = []
+    for fk in table.foreign_key_constraints:
+        found = reflected.get((tuple(fk.column_keys), fk.referred_table.name))
+        if found is None:
+            continue
+        ondelete = (found.get("options") or {}).get("ondelete") or ""
+        if ondelete.upper() != (fk.ondelete or "").upper():
+            stale.append((fk, found))
+    return stale
+
+def _rebuild_sqlite_table(conn, table):
+    # Only used for tables nothing else references (note, notification), so
+    # dropping and renaming cannot trip other tables' foreign keys. Columns no
+    # longer in the model are not carried over.
+    metadata = MetaData()
+    for t in db.metadata.sorted_tables:
+        t.to_metadata(metadata)
+    rebuilt = table.to_metadata(metadata, name=f"{table.name}__rebuild")
+    columns = ", ".join(f'"{c}"' for c in table.columns.keys())
+    conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{rebuilt.name}"')
+    conn.execute(CreateTable(rebuilt))
+    conn.exec_driver_sql(f'INSERT INTO "{rebuilt.name}" ({columns}) SELECT {columns} FROM "{table.name}"')
+    conn.exec_driver_sql(f'DROP TABLE "{table.name}"')
+    conn.exec_driver_sql(f'ALTER TABLE "{rebuilt.name}" RENAME TO "{table.name}"')
+
+def _recover_sqlite_rebuilds():
+    # A run that died inside _rebuild_sqlite_table leaves "<table>__rebuild"
+    # behind. Once the old table is gone the copy is complete (it was filled
+    # before the drop), so it becomes the table; otherwise the next rebuild
+    # replaces it.
+    if db.engine.dialect.name != "sqlite":
+        return
+    existing = set(inspect(db.engine).get_table_names())
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            leftover = f"{table.name}__rebuild"
+            if leftover in existing and table.name not in existing:
+                conn.exec_driver_sql(f'ALTER TABLE "{leftover}" RENAME TO "{table.name}"')
@@ -0,0 +1,235 @@
+import re
+
+from models import db
+
+# Full-text search over leads and notes.
+#
+# SQLite: two FTS5 tables kept in step explicitly by the write paths in app.py
+# (index_leads / index_notes / remove_leads), in the same transaction as the
+# write. Each row carries an "owner" token (u<user_id>) that every MATCH
+# requires, so a user's search only walks their own postings instead of
+# post-filtering everyone's, and FTS5 ranks and limits inside the query.
+#
+# Postgres: GIN expression indexes on lead and note, so the index is
+# maintained by the database and the sync calls are no-ops.
+
+MAX_SEARCH_LIMIT = 100
+SEARCH_SNIPPET_TOKENS = 12
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+_SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS lead_fts USING fts5("
+    "owner, full_name, email, phone, address, city, prefix='2 3')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS note_fts USING fts5("
+    "owner, note_text, lead_id UNINDEXED, prefix='2 3')",
+]
+
+# Phone numbers are indexed as typed and as bare digits, so "5125550100"
+# finds "(512) 555-0100"
+_SQLITE_LEAD_ROWS = """
+    SELECT id, 'u' || user_id, full_name, email,
+           coalesce(phone, '') || ' ' || {digits}, address, city
+    FROM lead
+""".format(digits="replace(replace(replace(replace(replace(replace(coalesce(phone, ''), "
+                  "'-', ''), ' ', ''), '(', ''), ')', ''), '.', ''), '+', '')")
+
+_PG_LEAD_VECTOR = (
+    "to_tsvector('simple', coalesce(full_name, '') || ' ' || coalesce(email, '') || ' ' || "
+    "coalesce(phone, '') || ' ' || regexp_replace(coalesce(phone, ''), '\\D', '', 'g') || ' ' || "
+    "coalesce(address, '') || ' ' || coalesce(city, ''))"
+)
+_PG_NOTE_VECTOR = "to_tsvector('simple', note_text)"
+
+_PG_DDL = [
+    f"CREATE INDEX IF NOT EXISTS ix_lead_search ON lead USING gin ({_PG_LEAD_VECTOR})",
+    f"CREATE INDEX IF NOT EXISTS ix_note_search ON note USING gin ({_PG_NOTE_VECTOR})",
+]
+
+def _dialect():
+    return db.session.get_bind().dialect.name
+
+def ensure_search_index():
+    # Called by upgrade_schema() after create_all(); builds the index on first run
+    dialect = _dialect()
+    if dialect == "sqlite":
+        existed = db.session.execute(db.text(
+            "SELECT count(*) FROM sqlite_master WHERE name IN ('lead_fts', 'note_fts')"
+        )).scalar() == 2
+        for ddl in _SQLITE_DDL:
+            db.session.execute(db.text(ddl))
+        if not existed:
+            rebuild_search_index()
+        db.session.commit()
+    elif dialect == "postgresql":
+        for ddl in _PG_DDL:
+            db.session.execute(db.text(ddl))
+        db.session.commit()
+
+def rebuild_search_index():
+    if _dialect() != "sqlite":
+        return
+    db.session.execute(db.text("DELETE FROM lead_fts"))
+    db.session.execute(db.text("DELETE FROM note_fts"))
+    db.session.execute(db.text(
+        f"INSERT INTO lead_fts(rowid, owner, full_name, email, phone, address, city) {_SQLITE_LEAD_ROWS}"
+    ))
+    db.session.execute(db.text(
+        "INSERT INTO note_fts(rowid, owner, note_text, lead_id) SELECT id, 'u' || user_id, note_text, lead_id FROM note"
+    ))
+
+def index_leads(lead_ids, new=False):
+    # (Re)index leads from their current rows; call before commit. new=True
+    # skips clearing old entries for leads that were only just inserted.
+    if not lead_ids or _dialect() != "sqlite":
+        return
+    db.session.flush()
+    ids = db.bindparam("ids", list(lead_ids), expanding=True)
+    if not new:
+        db.session.execute(db.text("DELETE FROM lead_fts WHERE rowid IN :ids").bindparams(ids))
+    db.session.execute(db.text(
+        f"INSERT INTO lead_fts(rowid, owner, full_name, email, phone, address, city) {_SQLITE_LEAD_ROWS} "
+        "WHERE id IN :ids"
+    ).bindparams(ids))
+
+def index_notes(note_ids):
+    if not note_ids or _dialect() != "sqlite":
+        return
+    db.session.flush()
+    ids = db.bindparam("ids", list(note_ids), expanding=True)
+    db.session.execute(db.text(
+        "INSERT INTO note_fts(rowid, owner, note_text, lead_id) "
+        "SELECT id, 'u' || user_id, note_text, lead_id FROM note WHERE id IN :ids"
+    ).bindparams(ids))
+
+def remove_leads(lead_ids):
+    # Drop leads and their notes from the index; call before deleting the rows
+    if not lead_ids or _dialect() != "sqlite":
+        return
+    ids = db.bindparam("ids", list(lead_ids), expanding=True)
+    db.session.execute(db.text("DELETE FROM lead_fts WHERE rowid IN :ids").bindparams(ids))
+    db.session.execute(db.text(
+        "DELETE FROM note_fts WHERE rowid IN (SELECT id FROM note WHERE lead_id IN :ids)"
+    ).bindparams(ids))
+
+def query_terms(q: str):
+    return _TOKEN_RE.findall(q or "")
+
+def search(user_id: int, q: str, limit: int):
+    # Returns hits ordered best first:
+    # {"type": "lead"|"note", "lead_id", "note_id", "full_name", "stage", "snippet", "score"}
+    terms = query_terms(q)
+    if not terms:
+        return []
+    dialect = _dialect()
+    if dialect == "sqlite":
+        hits = _search_sqlite(user_id, terms, limit)
+    elif dialect == "postgresql":
+        hits = _search_postgres(user_id, terms, limit)
+    else:
+        hits = _search_like(user_id, terms, limit)
+    # Best score first, newest first among equals
+    hits.sort(key=lambda h: (h["score"], h["note_id"] or 0, h["lead_id"]), reverse=True)
+    return hits[:limit]
+
+def _sqlite_match(terms, prefix=True):
+    # Every term must match. With prefix=True, terms of two or more characters
+    # match as prefixes; a one-character prefix would expand to most of the
+    # vocabulary, so those always match a whole token.
+    return " AND ".join(
+        '"{}"{}'.format(t.replace('"', '""'), "*" if prefix and len(t) > 1 else "") for t in terms
+    )
+
+def _search_sqlite(user_id, terms, limit):
+    # FTS5 ranks inside the MATCH: the owner token narrows the doclists to this
+    # user's rows and ORDER BY rank LIMIT keeps only the best `limit`, so every
+    # match is ranked and nothing past the limit is joined or returned. rank is
+    # bm25() with a name hit counting three times a hit on contact details.
+    leads = _sqlite_ranked(
+        "SELECT f.rowid, l.full_name, l.stage, -f.rank "
+        "FROM lead_fts f JOIN lead l ON l.id = f.rowid "
+        "WHERE lead_fts MATCH :match AND f.rank MATCH 'bm25(0.0, 3.0, 1.0, 1.0, 1.0, 1.0)' "
+        "ORDER BY f.rank LIMIT :limit",
+        f"owner:u{user_id} AND {{full_name email phone address city}}", terms, limit,
+    )
+    notes = _sqlite_ranked(
+        "SELECT f.rowid, f.lead_id, l.full_name, l.stage, "
+        f"snippet(note_fts, 1, '<b>', '</b>', '…', {SEARCH_SNIPPET_TOKENS}), -f.rank "
+        "FROM note_fts f JOIN lead l ON l.id = f.lead_id "
+        "WHERE note_fts MATCH :match ORDER BY f.rank LIMIT :limit",
+        f"owner:u{user_id} AND note_text", terms, limit,
+    )
+    return (
+        [_hit("lead", lead_id, None, name, stage, None, score) for lead_id, name, stage, score in leads]
+        + [_hit("note", lead_id, note_id, name, stage, snip, score) for note_id, lead_id, name, stage, snip, score in notes]
+    )
+
+def _sqlite_ranked(sql, scope, terms, limit):
+    # Runs `sql` (rowid first, -rank last) for whole-token matches, then for
+    # prefix matches to fill the rest of the limit, so "Name 4999" lists 4999
+    # before 49990. Lead and note bm25 scores come from different columns and
+    # weights, so each tier is scaled by its best score into (0, 1]; whole-token
+    # hits get 1 on top and sort above every prefix-only hit.
+    tiers = [(1.0, _sqlite_match(terms, prefix=False))]
+    if any(len(t) > 1 for t in terms):
+        tiers.append((0.0, _sqlite_match(terms)))
+    ranked = []
+    seen = set()
+    for bonus, match in tiers:
+        if len(ranked) >= limit:
+            break
+        # Whole-token hits match the prefix query too; fetch enough to skip them
+        rows = db.session.execute(db.text(sql), {
+            "match": f"{scope}: ({match})", "limit": limit + len(seen),
+        }).all()
+        rows = [row for row in rows if row[0] not in seen][:limit - len(ranked)]
+        best = max((row[-1] for row in rows), default=0)
+        best = best if best > 0 else 1
+        for row in rows:
+            seen.add(row[0])
+            ranked.append((*row[:-1], bonus + row[-1] / best))
+    return ranked
+
+def _search_postgres(user_id, terms, limit):
+    tsquery = " & ".join(f"{t}:*" for t in terms)
+    params = {"uid": user_id, "q": tsquery, "limit": limit}
+    leads = db.session.execute(db.text(
+        f"SELECT id, full_name, stage, ts_rank({_PG_LEAD_VECTOR}, to_tsquery('simple', :q)) AS score "
+        f"FROM lead WHERE user_id = :uid AND {_PG_LEAD_VECTOR} @@ to_tsquery('simple', :q) "
+        "ORDER BY score DESC LIMIT :limit"
+    ), params).all()
+    notes = db.session.execute(db.text(
+        "SELECT note.id, note.lead_id, l.full_name, l.stage, "
+        f"ts_headline('simple', note_text, to_tsquery('simple', :q), 'MaxWords={SEARCH_SNIPPET_TOKENS}, MinWords=4'), "
+        f"ts_rank({_PG_NOTE_VECTOR}, to_tsquery('simple', :q)) AS score "
+        "FROM note JOIN lead l ON l.id = note.lead_id "
+        f"WHERE note.user_id = :uid AND {_PG_NOTE_VECTOR} @@ to_tsquery('simple', :q) "
+        "ORDER BY score DESC LIMIT :limit"
+    ), params).all()
+    return (
+        [_hit("lead", lead_id, None, name, stage, None, score) for lead_id, name, stage, score in leads]
+        + [_hit("note", lead_id, note_id, name, stage, snip, score) for note_id, lead_id, name, stage, snip, score in notes]
+    )
+
+def _search_like(user_id, terms, limit):
+    # Unindexed fallback for other databases
+    from models import Lead
+    q = Lead.query.filter(Lead.user_id == user_id)
+    for t in terms:
+        pattern = f"%{t}%"
+        q = q.filter(db.or_(
+            Lead.full_name.ilike(pattern), Lead.email.ilike(pattern), Lead.phone.ilike(pattern),
+            Lead.address.ilike(pattern), Lead.city.ilike(pattern),
+        ))
+    return [_hit("lead", l.id, None, l.full_name, l.stage, None, 0.0) for l in q.limit(limit)]
+
+def _hit(kind, lead_id, note_id, full_name, stage, snippet, score):
+    return {
+        "type": kind,
+        "lead_id": lead_id,
+        "note_id": note_id,
+        "full_name": full_name,
+        "stage": stage,
+        "snippet": snippet,
+        "score": float(score or 0),
+    }
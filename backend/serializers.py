@@ -0,0 +1,154 @@
+import codecs
+from datetime import date, time
+from json.encoder import encode_basestring_ascii
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib encoder is used instead
+    orjson = None
+
+from models import Lead, Note, Notification
+
+# Response bodies for leads, notes and notifications.
+#
+# List endpoints query only the columns they return and build each object
+# from the result tuple in one dict(zip(...)); datetimes stay datetime
+# objects and are written as ISO 8601 by the JSON provider. JSON goes through
+# FastJSONProvider, which encodes with orjson when it is installed and falls
+# back to the stdlib json module whenever orjson's output could differ, so
+# response bytes (and cached bodies) are the same with or without it.
+
+LEAD_FIELDS = (
+    "id", "full_name", "phone", "email", "address", "city", "state", "stage",
+    "estimated_value", "appointment_datetime", "created_at", "updated_at",
+)
+NOTE_FIELDS = ("id", "lead_id", "note_text", "created_at")
+NOTIFICATION_FIELDS = (
+    "id", "lead_id", "channel", "to_value", "subject", "message", "status", "provider_response", "created_at",
+)
+
+def lead_columns(fields=LEAD_FIELDS):
+    return [getattr(Lead, f) for f in fields]
+
+NOTIFICATION_COLUMNS = [getattr(Notification, f) for f in NOTIFICATION_FIELDS]
+
+def serialize_lead_rows(rows, fields=LEAD_FIELDS):
+    # Result tuples start with `fields`; trailing columns (cursor keys) are dropped by zip
+    return [dict(zip(fields, row)) for row in rows]
+
+def serialize_lead_row(row, fields=LEAD_FIELDS):
+    return dict(zip(fields, row))
+
+def serialize_lead(l: Lead):
+    return {f: getattr(l, f) for f in LEAD_FIELDS}
+
+def serialize_notification_rows(rows):
+    return [dict(zip(NOTIFICATION_FIELDS, row)) for row in rows]
+
+def serialize_note(n: Note):
+    return {f: getattr(n, f) for f in NOTE_FIELDS}
+
+def serialize_notification(n: Notification):
+    return {f: getattr(n, f) for f in NOTIFICATION_FIELDS}
+
+COMPACT = (",", ":")
+
+# orjson writes some floats differently (1e16 vs 1e+16, 2.5e-7 vs 2.5e-07,
+# 0.00001 vs 1e-05). Spotting them with plain byte searches is many times
+# faster than a regex over a multi-megabyte body; a hit inside a string only
+# costs the slower encoder.
+_DIGITS_TO_ZERO = bytes.maketrans(b"123456789", b"000000000")
+_NUMBER_START = b":,["
+
+def _starts_number(buf: bytes, start: int) -> bool:
+    # In orjson's compact output a number follows : , or [ (or starts the body)
+    return not start or buf[start - 1] in _NUMBER_START
+
+def _differing_floats(out: bytes) -> bool:
+    # Exponents: with every digit mapped to 0, "1e16" and "2.5e-7" contain "0e"
+    flat = out.translate(_DIGITS_TO_ZERO)
+    i = flat.find(b"0e")
+    while i != -1:
+        start = i
+        while start and flat[start - 1] in b"0.-":
+            start -= 1
+        if _starts_number(flat, start):
+            return True
+        i = flat.find(b"0e", i + 2)
+    # Small numbers written out: 0.00001
+    i = out.find(b"0.0000")
+    while i != -1:
+        start = i - 1 if i and out[i - 1] == ord("-") else i
+        if _starts_number(out, start):
+            return True
+        i = out.find(b"0.0000", i + 6)
+    return False
+
+_escapes = {}
+
+def _json_ascii_escape(error):
+    # Codec error handler: runs of non-ASCII characters get the stdlib's own
+    # ensure_ascii escapes. Names repeat a lot, so escapes are memoised.
+    chars = error.object[error.start:error.end]
+    escaped = _escapes.get(chars)
+    if escaped is None:
+        if len(_escapes) >= 4096:
+            _escapes.clear()
+        escaped = _escapes[chars] = encode_basestring_ascii(chars)[1:-1]
+    return escaped, error.end
+
+codecs.register_error("json_ascii_escape", _json_ascii_escape)
+
+if orjson is not None:
+    # Dataclasses go through default() and Flask's asdict() like before
+    _ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATACLASS
+
+def _default(o):
+    # ISO 8601 datetimes, which is what orjson writes natively and what every
+    # serializer used to produce with .isoformat(); Flask's default would
+    # write RFC 822 dates
+    if isinstance(o, (date, time)):
+        return o.isoformat()
+    return DefaultJSONProvider.default(o)
+
+class FastJSONProvider(DefaultJSONProvider):
+    """DefaultJSONProvider with orjson for compact output. Anything orjson
+    cannot encode identically is re-encoded with the stdlib."""
+
+    default = staticmethod(_default)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and kwargs == {"separators": COMPACT}:
+            out = self._orjson_dumps(obj)
+            if out is not None:
+                return out.decode()
+        return super().dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        # Hands orjson's bytes to the response without a str round trip
+        compact = self.compact if self.compact is not None else not self._app.debug
+        if orjson is not None and compact:
+            out = self._orjson_dumps(self._prepare_response_obj(args, kwargs))
+            if out is not None:
+                return self._app.response_class(out + b"\n", mimetype=self.mimetype)
+        return super().response(*args, **kwargs)
+
+    def _orjson_dumps(self, obj):
+        # Compact JSON bytes, or None where the stdlib's output would differ
+        options = _ORJSON_OPTIONS | (orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+        try:
+            out = orjson.dumps(obj, default=self.default, option=options)
+        except TypeError:
+            # Integers over 64 bits, non-string keys, or types default() rejects
+            return None
+        if _differing_floats(out):
+            return None
+        if self.ensure_ascii:
+            # The stdlib escapes non-ASCII characters and DEL; orjson writes them raw
+            if not out.isascii():
+                out = out.decode().encode("ascii", "json_ascii_escape")
+            if b"\x7f" in out:
+                out = out.replace(b"\x7f", b"\\u007f")
+        return out
@@ -0,0 +1,132 @@
+from datetime import datetime, timedelta
+
+import pytest
+import requests
+from twilio.base.exceptions import TwilioRestException
+
+from app import create_app
+from models import db, Notification, User
+from notifications import FakeProvider, ProviderRegistry
+from outbox import FAILED, QUEUED, SENDING, SENT, NotificationWorker, enqueue_notification
+from schema import upgrade_schema
+
+# The outbox against a throwaway SQLite database, with FakeProviders in place
+# of SendGrid and Twilio and the worker driven by hand (run_once/drain).
+
+class FailingProvider(FakeProvider):
+    def __init__(self, channel, exc):
+        super().__init__(channel)
+        self.exc = exc
+
+    def send(self, to_value, subject, message):
+        raise self.exc
+
+def http_error(status):
+    resp = requests.Response()
+    resp.status_code = status
+    return requests.HTTPError(f"{status} Client Error", response=resp)
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path}/outbox.db",
+        "NOTIFICATION_WORKER": "off",
+        "NOTIFICATION_MAX_ATTEMPTS": 3,
+        "NOTIFICATION_BACKOFF_SECONDS": 10,
+        "NOTIFICATION_BACKOFF_MAX_SECONDS": 60,
+        "NOTIFICATION_LEASE_SECONDS": 30,
+    })
+    with app.app_context():
+        upgrade_schema()
+        db.session.add(User(id=1, name="A", email="a@example.com", password_hash="x"))
+        db.session.commit()
+        yield app
+
+def worker_with(app, *providers):
+    registry = ProviderRegistry(app.config)
+    for provider in providers:
+        registry.register(provider)
+    return NotificationWorker(app, providers=registry)
+
+def enqueue(channel="email", to_value="b@example.com"):
+    notif = enqueue_notification(1, None, channel, to_value, None, "hello")
+    db.session.commit()
+    return notif.id
+
+def load(notif_id):
+    db.session.expire_all()
+    return db.session.get(Notification, notif_id)
+
+def make_due(notif_id):
+    Notification.query.filter_by(id=notif_id).update({"next_attempt_at": datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+
+def test_claims_and_sends_each_row_once(app):
+    email, sms = FakeProvider("email"), FakeProvider("sms")
+    worker = worker_with(app, email, sms)
+    ids = [enqueue(), enqueue(), enqueue("sms", "+15550100")]
+
+    assert worker.drain() == 3
+    assert len(email.sent) == 2 and len(sms.sent) == 1
+    for notif_id in ids:
+        notif = load(notif_id)
+        assert (notif.status, notif.attempts, notif.next_attempt_at) == (SENT, 1, None)
+        assert notif.sent_at is not None
+    assert worker.run_once() == 0
+
+def test_retries_with_exponential_backoff_then_fails(app):
+    worker = worker_with(app, FakeProvider("email", fail_every=1))
+    notif_id = enqueue()
+
+    for attempt, base in ((1, 10), (2, 20)):
+        before = datetime.utcnow()
+        assert worker.run_once() == 1
+        notif = load(notif_id)
+        assert (notif.status, notif.attempts) == (QUEUED, attempt)
+        # base * 2^(n-1) with jitter in [0.5, 1)
+        delay = (notif.next_attempt_at - before).total_seconds()
+        assert base * 0.5 - 1 <= delay <= base + 1
+        # Not due yet
+        assert worker.run_once() == 0
+        make_due(notif_id)
+
+    assert worker.run_once() == 1
+    notif = load(notif_id)
+    assert (notif.status, notif.attempts, notif.next_attempt_at) == (FAILED, 3, None)
+
+def test_stale_claim_is_taken_over_after_its_lease(app):
+    provider = FakeProvider("email")
+    dead, alive = worker_with(app, provider), worker_with(app, provider)
+    notif_id = enqueue()
+
+    # The first worker claims the row and dies before delivering it
+    assert dead._claim_batch() == [(notif_id, "email")]
+    assert (load(notif_id).status, load(notif_id).attempts) == (SENDING, 1)
+    assert alive.run_once() == 0
+
+    make_due(notif_id)
+    assert alive.run_once() == 1
+    notif = load(notif_id)
+    assert (notif.status, notif.attempts) == (SENT, 2)
+
+    # A late delivery from the old claim changes nothing
+    dead._deliver(notif_id)
+    assert len(provider.sent) == 1
+    assert load(notif_id).status == SENT
+
+@pytest.mark.parametrize("exc, status", [
+    (http_error(400), FAILED),
+    (http_error(404), FAILED),
+    (TwilioRestException(400, "https://api.twilio.com/Messages.json", "Invalid 'To' number", 21211), FAILED),
+    (http_error(429), QUEUED),
+    (http_error(503), QUEUED),
+    (requests.ConnectionError("reset"), QUEUED),
+])
+def test_client_errors_fail_without_retry(app, exc, status):
+    worker = worker_with(app, FailingProvider("email", exc))
+    notif_id = enqueue()
+
+    assert worker.run_once() == 1
+    notif = load(notif_id)
+    assert (notif.status, notif.attempts) == (status, 1)
+    assert type(exc).__name__ in notif.provider_response
@@ -0,0 +1,13 @@
+import os
+
+from app import create_app
+from queryplan import check_query_plans, format_failures
+
+# `flask check-query-plans` as a test: every endpoint runs against a scratch
+# database, and any of its queries that scans a whole table or sorts rows
+# itself fails the build. QUERY_PLAN_DATABASE_URL points it at a scratch
+# Postgres database instead of a temporary SQLite file.
+
+def test_endpoint_queries_use_indexes():
+    failures = check_query_plans(create_app, os.getenv("QUERY_PLAN_DATABASE_URL"))
+    assert not failures, f"{len(failures)} query plan(s) without a usable index:\n{format_failures(failures)}"
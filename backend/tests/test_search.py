@@ -0,0 +1,54 @@
+import pytest
+
+from app import create_app
+from models import db, Lead, Note, User
+from schema import upgrade_schema
+from search import index_leads, index_notes, search
+
+# SQLite FTS5 ranking: whole-token matches above prefix matches, and lead and
+# note hits merged on one scale.
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path}/search.db", "NOTIFICATION_WORKER": "off"})
+    with app.app_context():
+        upgrade_schema()
+        db.session.add(User(id=1, name="A", email="a@example.com", password_hash="x"))
+        db.session.commit()
+        yield app
+
+def add_leads(*names):
+    leads = [Lead(user_id=1, full_name=name) for name in names]
+    db.session.add_all(leads)
+    db.session.flush()
+    index_leads([lead.id for lead in leads], new=True)
+    db.session.commit()
+    return leads
+
+def test_whole_token_match_ranks_above_prefix_matches(app):
+    add_leads("Name 49999", "Name 49998", "Name 4999", "Name 49990")
+
+    hits = search(1, "Name 4999", 10)
+    assert [h["full_name"] for h in hits][0] == "Name 4999"
+    assert len(hits) == 4
+    assert hits[0]["score"] > 1 >= hits[1]["score"]
+
+def test_prefix_hits_fill_the_limit_after_whole_token_hits(app):
+    add_leads(*[f"Copper {i}" for i in range(5)], *[f"Copperfield {i}" for i in range(5)])
+
+    hits = search(1, "copper", 7)
+    names = [h["full_name"] for h in hits]
+    assert len(names) == 7 and len(set(names)) == 7
+    assert all(name.startswith("Copper ") for name in names[:5])
+    assert all(name.startswith("Copperfield ") for name in names[5:])
+
+def test_lead_and_note_scores_share_a_scale(app):
+    lead, other = add_leads("Roof Repair", "Someone Else")
+    note = Note(user_id=1, lead_id=other.id, note_text="asked about a roof " + "and gutters " * 40)
+    db.session.add(note)
+    db.session.flush()
+    index_notes([note.id])
+    db.session.commit()
+
+    hits = search(1, "roof", 10)
+    assert {(h["type"], h["score"]) for h in hits} == {("lead", 2.0), ("note", 2.0)}
@@ -0,0 +1,14 @@
+from app import create_app
+from queryplan import load_statement_budget, over_budget, statement_counts
+
+# `flask check-statement-counts` as a test: an endpoint that starts running
+# more SQL statements per request than statement_budget.json allows (an N+1
+# query, say) fails the build. After a deliberate change, lower or raise the
+# budget with `flask --app app check-statement-counts --update`.
+
+def test_endpoints_stay_within_statement_budget():
+    failures = over_budget(statement_counts(create_app), load_statement_budget())
+    assert not failures, "Endpoints over their statement budget:\n" + "\n".join(
+        f"{label}: {count} statement(s), budget {allowed if allowed is not None else 'none'}"
+        for label, allowed, count in failures
+    )
@@ -0,0 +1,109 @@
+import functools
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from flask import Response, current_app, g, request
+from flask_jwt_extended import get_jwt_identity
+
+from models import db, DataVersion
+from rollups import _upsert_insert
+
+# Per-user data version counters behind the ETag / Last-Modified headers.
+#
+# "leads" covers leads and their notes, "notifications" the notification log.
+# Every write bumps its scope inside its own transaction, so a client's ETag
+# goes stale exactly when the data it describes commits a change, in every
+# process. Checking a conditional request costs one primary-key lookup.
+# Last-Modified only has one-second resolution, so clients should prefer the
+# ETag; If-None-Match wins when a request sends both.
+
+def bump_version(user_id: int, *scopes: str):
+    if not scopes:
+        return
+    now = datetime.utcnow()
+    insert = _upsert_insert(db.session.get_bind().dialect.name)
+    if insert is not None:
+        # One statement for all scopes
+        stmt = insert(DataVersion).values([
+            {"user_id": user_id, "scope": scope, "version": 1, "changed_at": now} for scope in scopes
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id", "scope"],
+            set_={"version": DataVersion.version + 1, "changed_at": stmt.excluded.changed_at},
+        )
+        db.session.execute(stmt)
+        return
+    for scope in scopes:
+        updated = DataVersion.query.filter_by(user_id=user_id, scope=scope).update(
+            {"version": DataVersion.version + 1, "changed_at": now}, synchronize_session=False
+        )
+        if not updated:
+            db.session.add(DataVersion(user_id=user_id, scope=scope, version=1, changed_at=now))
+
+def current_version(user_id: int, scope: str):
+    # (version, changed_at); (0, None) until the first write
+    row = (
+        db.session.query(DataVersion.version, DataVersion.changed_at)
+        .filter(DataVersion.user_id == user_id, DataVersion.scope == scope)
+        .first()
+    )
+    return (row.version, row.changed_at) if row else (0, None)
+
+def conditional_view(scope: str):
+    # Adds a strong ETag and Last-Modified to a GET view's 200 responses and
+    # answers If-None-Match / If-Modified-Since with 304 before the view runs.
+    # Goes under @jwt_required() and above @cached_view().
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            uid = int(get_jwt_identity())
+            version, changed_at = current_version(uid, scope)
+            # For replica_reads() further down
+            g.setdefault("data_versions", {})[scope] = (version, changed_at)
+            # The same data version serializes differently per URL and query string
+            variant = zlib.crc32(request.full_path.encode())
+            etag = f"{scope}-{uid}-{version}-{variant:08x}"
+            last_modified = changed_at.replace(microsecond=0, tzinfo=timezone.utc) if changed_at else None
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                since = request.if_modified_since
+                not_modified = bool(since and last_modified and last_modified <= since)
+            if not_modified:
+                resp = Response(status=304)
+            else:
+                resp = current_app.make_response(view(**kwargs))
+                if resp.status_code != 200:
+                    return resp
+            resp.set_etag(etag)
+            # Let the browser keep the body but revalidate on every use, which
+            # is what lets the frontend's plain fetch() calls get 304s
+            resp.headers["Cache-Control"] = "private, no-cache"
+            if last_modified:
+                resp.last_modified = last_modified
+            return resp
+        return wrapper
+    return decorator
+
+def replica_reads(scope: str):
+    # Sends a read-only view's queries to the read replica (DATABASE_READ_URL,
+    # see engine.py) once the user's `scope` data last changed more than
+    # DATABASE_READ_MAX_LAG seconds ago. Until then they stay on the primary,
+    # so users read their own writes and nothing stale gets into the response
+    # cache. Goes right above the view, under @conditional_view() and
+    # @cached_view(): the version either of them read is reused, and cache
+    # hits skip the check.
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            if current_app.config["DATABASE_READ_URL"]:
+                known = g.get("data_versions", {}).get(scope)
+                _, changed_at = known or current_version(int(get_jwt_identity()), scope)
+                max_lag = timedelta(seconds=current_app.config["DATABASE_READ_MAX_LAG"])
+                if changed_at is None or datetime.utcnow() - changed_at > max_lag:
+                    # Left set for the rest of the request: streamed bodies query later
+                    g.read_replica = True
+            return view(**kwargs)
+        return wrapper
+    return decorator